@@ -21,20 +21,28 @@ ogr2ogr -f "SQLite" -dsco "SPATIALITE=YES" -t_srs EPSG:4326 NHDFlowline_Network.
 # Extract county boundaries from National Map/Census data
 ogr2ogr -f "SQLite" -dsco "SPATIALITE=YES" -t_srs EPSG:4326 TIGER_2013_2017_counties.spatialite /vsizip/GovernmentUnits_National_GDB.zip GU_CountyOrEquivalent
 
-# Reproject NLCD data to WGS84
-gdalwarp -multi -t_srs EPSG:4326 -of GTiff -co "COMPRESS=LZW" -co "ZLEVEL=9" /vsizip/NLCD_2016_Land_Cover_L48_20190424.zip/NLCD_2016_Land_Cover_L48_20190424.img NLCD_2016_Land_Cover_L48_20190424-WGS84.tif
-gdalwarp -multi -t_srs EPSG:4326 -of GTiff -co "COMPRESS=LZW" -co "ZLEVEL=9" /vsizip/nlcd_2011_land_cover_l48_20210604.zip/nlcd_2011_land_cover_l48_20210604.img nlcd_2011_land_cover_l48_20210604-WGS84.tif
+# Convert NLCD data to GeoTIFF, keeping its native Albers equal area CRS (zones are reprojected instead)
+gdal_translate -of GTiff -co "COMPRESS=LZW" -co "BIGTIFF=IF_SAFER" /vsizip/NLCD_2016_Land_Cover_L48_20190424.zip/NLCD_2016_Land_Cover_L48_20190424.img NLCD_2016_Land_Cover_L48_20190424.tif
+gdal_translate -of GTiff -co "COMPRESS=LZW" -co "BIGTIFF=IF_SAFER" /vsizip/nlcd_2011_land_cover_l48_20210604.zip/nlcd_2011_land_cover_l48_20210604.img nlcd_2011_land_cover_l48_20210604.tif
 
-# Reproject CropScape Cropland Data Layer (CDL) to WGS84
-gdalwarp -multi -t_srs EPSG:4326 -of GTiff -co "COMPRESS=LZW" -co "ZLEVEL=9" /vsizip/2020_30m_cdls.zip/2020_30m_cdls.img 2020_30m_cdls.tif
-gdalwarp -multi -t_srs EPSG:4326 -of GTiff -co "COMPRESS=LZW" -co "ZLEVEL=9" /vsizip/2015_30m_cdls.zip/2015_30m_cdls.img 2015_30m_cdls.tif
-gdalwarp -multi -t_srs EPSG:4326 -of GTiff -co "COMPRESS=LZW" -co "ZLEVEL=9" /vsizip/2010_30m_cdls.zip/2010_30m_cdls.img 2010_30m_cdls.tif
+# Convert CropScape Cropland Data Layer (CDL) to GeoTIFF, keeping its native CRS
+gdal_translate -of GTiff -co "COMPRESS=LZW" -co "BIGTIFF=IF_SAFER" /vsizip/2020_30m_cdls.zip/2020_30m_cdls.img 2020_30m_cdls.tif
+gdal_translate -of GTiff -co "COMPRESS=LZW" -co "BIGTIFF=IF_SAFER" /vsizip/2015_30m_cdls.zip/2015_30m_cdls.img 2015_30m_cdls.tif
+gdal_translate -of GTiff -co "COMPRESS=LZW" -co "BIGTIFF=IF_SAFER" /vsizip/2010_30m_cdls.zip/2010_30m_cdls.img 2010_30m_cdls.tif
 
-# Reproject USGS groundwater recharge data
-gdalwarp -multi -t_srs EPSG:4326 -of GTiff -co "COMPRESS=LZW" -co "ZLEVEL=9" /vsitar/rech48grd.tgz/arctar00000/rech48grd/w001001x.adf rech48grd.tif
+# Convert USGS groundwater recharge data to GeoTIFF, keeping its native CRS
+gdal_translate -of GTiff -co "COMPRESS=LZW" -co "BIGTIFF=IF_SAFER" /vsitar/rech48grd.tgz/arctar00000/rech48grd/w001001x.adf rech48grd.tif
+
+# Re-tile rasters as cloud-optimized GeoTIFFs so that zonal statistics only read the tiles they need
+prepare-cog.sh
+
+# Count the classes of each tile of the CDL and NLCD rasters so that zonal statistics only read boundary tiles
+carma-tile-histograms-build -d .
 
 # Create indices to speed up lookups
 sqlite3 WBDSnapshot_National.spatialite "CREATE INDEX IF NOT EXISTS idx_huc_12 ON WBDSnapshot_National (huc_12)"
+# R*Tree spatial index of flowlines, through which stream characteristics are queried (ogr2ogr normally creates it)
+sqlite3 -cmd ".load mod_spatialite" NHDFlowline_Network.spatialite "SELECT CreateSpatialIndex('nhdflowline_network', 'shape') WHERE NOT EXISTS (SELECT 1 FROM sqlite_master WHERE name = 'idx_nhdflowline_network_shape')"
 sqlite3 NHDFlowline_Network.spatialite "CREATE INDEX IF NOT EXISTS idx_reachcode ON nhdflowline_network (reachcode)"
 sqlite3 NHDFlowline_Network.spatialite "CREATE INDEX IF NOT EXISTS idx_streamorde ON nhdflowline_network (streamorde)"
 sqlite3 NHDFlowline_Network.spatialite "CREATE INDEX IF NOT EXISTS idx_streamleve ON nhdflowline_network (streamleve)"
@@ -0,0 +1,45 @@
+#!/bin/bash
+# Re-tile prepared CDL, NLCD, and groundwater recharge rasters as cloud-optimized GeoTIFFs (COGs):
+# internally tiled, with overviews, and compressed with a fast codec plus predictor. Each COG is
+# written next to its source with a "-cog.tif" suffix; CARMA harvesters use the COG when present.
+#
+# Usage: prepare-cog.sh [RASTER ...]
+# With no arguments, all CDL, NLCD, and recharge rasters in the current directory are converted.
+# Set COG_COMPRESS (default DEFLATE; ZSTD if your GDAL supports it) and COG_BLOCKSIZE (default 512)
+# to override the codec and tile size.
+COG_COMPRESS=${COG_COMPRESS:-DEFLATE}
+COG_BLOCKSIZE=${COG_BLOCKSIZE:-512}
+
+if [ $# -eq 0 ]; then
+  set -- nlcd_2011_land_cover_l48_20210604.tif NLCD_2016_Land_Cover_L48_20190424.tif \
+    nlcd_2011_land_cover_l48_20210604-WGS84.tif NLCD_2016_Land_Cover_L48_20190424-WGS84.tif \
+    2010_30m_cdls.tif 2015_30m_cdls.tif 2020_30m_cdls.tif rech48grd.tif
+fi
+
+for src in "$@"; do
+  if [ ! -f "$src" ]; then
+    echo "Skipping $src, which does not exist."
+    continue
+  fi
+  dst="${src%.tif}-cog.tif"
+  tmp="${src%.tif}-cog-tmp.tif"
+
+  # Categorical rasters (CDL, NLCD) use horizontal differencing and mode overviews;
+  # continuous rasters (recharge) use the floating point predictor and average overviews.
+  if gdalinfo "$src" | grep -q "Type=Float"; then
+    predictor=3
+    resampling=average
+  else
+    predictor=2
+    resampling=mode
+  fi
+  creation_opts="-co TILED=YES -co BLOCKXSIZE=${COG_BLOCKSIZE} -co BLOCKYSIZE=${COG_BLOCKSIZE} \
+    -co COMPRESS=${COG_COMPRESS} -co PREDICTOR=${predictor} -co BIGTIFF=IF_SAFER"
+
+  echo "Writing COG ${dst}..."
+  gdal_translate -of GTiff ${creation_opts} "$src" "$tmp" \
+    && gdaladdo -r ${resampling} --config COMPRESS_OVERVIEW ${COG_COMPRESS} \
+      --config PREDICTOR_OVERVIEW ${predictor} "$tmp" 2 4 8 16 32 64 \
+    && gdal_translate -of GTiff ${creation_opts} -co COPY_SRC_OVERVIEWS=YES "$tmp" "$dst"
+  rm -f "$tmp"
+done
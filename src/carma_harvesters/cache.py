@@ -0,0 +1,270 @@
+# Copyright (C) 2021-present University of Louisiana at Lafayette.
+# All rights reserved. Licensed under the GPLv3 License. See LICENSE.txt in the project root for license information.
+
+from typing import Callable, List
+import os
+import time
+import pickle
+import sqlite3
+import hashlib
+import logging
+
+from shapely.geometry import shape
+
+
+# Path of the SQLite database used to cache derived zonal and stream attributes
+CACHE_PATH_ENV = 'CARMA_CACHE_PATH'
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'carma-harvesters', 'derived-cache.sqlite')
+# Size limit of cached values, in megabytes; 0 disables the cache
+CACHE_MAX_MB_ENV = 'CARMA_CACHE_MAX_MB'
+DEFAULT_CACHE_MAX_MB = 1024
+# When the cache exceeds its size limit, least recently used entries are pruned down to this fraction of it
+PRUNE_TARGET_FRACTION = 0.9
+# Number of puts between checks of the total size of cached values against the size limit
+SIZE_CHECK_INTERVAL = 256
+# Number of cache hits whose access times are buffered before being written together
+ACCESS_FLUSH_INTERVAL = 256
+
+logger = logging.getLogger(__name__)
+
+
+def geometry_hash(geometry: dict) -> str:
+    """
+    Hash a GeoJSON-like geometry by its WKB representation.
+    """
+    return hashlib.sha256(shape(geometry).wkb).hexdigest()
+
+
+def dataset_fingerprint(path: str) -> tuple:
+    """
+    Identify the current contents of a dataset file by its absolute path, modification time, and size,
+    so that cache entries are invalidated when a dataset is replaced.
+    """
+    st = os.stat(path)
+    return os.path.abspath(path), st.st_mtime_ns, st.st_size
+
+
+def cache_key(kind: str, geometry: dict, dataset_path: str, *extra) -> str:
+    """
+    Make a content-addressed key for a value derived from a geometry and a dataset.
+    :param kind: Kind of value (e.g. 'zone_histogram')
+    :param geometry: GeoJSON-like geometry the value was derived for
+    :param dataset_path: Path of the dataset the value was derived from
+    :param extra: Other parameters the value depends on (e.g. band, or data year)
+    :return: Hex digest
+    """
+    parts = (kind, geometry_hash(geometry), dataset_fingerprint(dataset_path)) + extra
+    return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+
+
+class DerivedCache:
+    """
+    Persistent SQLite cache of values derived from geometries and datasets (e.g. class histograms
+    and stream characteristics), so that re-running commands over the same geometries only
+    computes values for new or changed geometries and datasets. Cached values are pickled; when
+    their total size exceeds max_bytes, least recently used entries are pruned. To keep reads and writes
+    cheap for the worker processes sharing the cache, the total size is tracked as values are put and
+    only checked against the database every SIZE_CHECK_INTERVAL puts, and access times of hits are
+    buffered and written every ACCESS_FLUSH_INTERVAL hits, with the next put, or when the cache is closed.
+    """
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._conn_pid = None
+        self._accessed = {}
+        self._size = None
+        self._puts = 0
+
+    def __repr__(self) -> str:
+        return f"DerivedCache(path={self.path}, max_bytes={self.max_bytes}, hits={self.hits}, misses={self.misses})"
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # Connections must not be shared with forked worker processes
+        if self._conn is None or self._conn_pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=60)
+            self._conn_pid = os.getpid()
+            # Access times and size buffered by a parent process are its own to write
+            self._accessed = {}
+            self._size = None
+            self._puts = 0
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(('CREATE TABLE IF NOT EXISTS derived '
+                                '(key TEXT PRIMARY KEY, kind TEXT, value BLOB, size INTEGER, accessed REAL)'))
+            self._conn.execute('CREATE INDEX IF NOT EXISTS derived_accessed ON derived (accessed)')
+            self._conn.commit()
+        return self._conn
+
+    def close(self):
+        if self._conn is not None and self._conn_pid == os.getpid():
+            self.flush()
+            self._conn.close()
+        self._conn = None
+
+    def flush(self):
+        """
+        Write buffered access times of cache hits.
+        """
+        if self._accessed:
+            with self.conn:
+                self._write_accessed()
+
+    def _write_accessed(self):
+        self.conn.executemany('UPDATE derived SET accessed = ? WHERE key = ?',
+                              [(accessed, key) for key, accessed in self._accessed.items()])
+        self._accessed = {}
+
+    def get(self, key: str, default=None):
+        """
+        :return: Cached value, or default if key is not in the cache
+        """
+        row = self.conn.execute('SELECT value FROM derived WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._accessed[key] = time.time()
+        if len(self._accessed) >= ACCESS_FLUSH_INTERVAL:
+            self.flush()
+        return pickle.loads(row[0])
+
+    def put(self, key: str, kind: str, value):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if self._size is None:
+            self._size = self.size()
+        with self.conn:
+            self._write_accessed()
+            self.conn.execute('INSERT OR REPLACE INTO derived VALUES (?, ?, ?, ?, ?)',
+                              (key, kind, data, len(data), time.time()))
+        # Replaced values and puts by other processes make this an estimate, which is corrected periodically
+        self._size += len(data)
+        self._puts += 1
+        if self._puts % SIZE_CHECK_INTERVAL == 0 or self._size > self.max_bytes:
+            self._size = self.size()
+            if self._size > self.max_bytes:
+                self.prune(int(self.max_bytes * PRUNE_TARGET_FRACTION))
+
+    def size(self) -> int:
+        """
+        :return: Total size of cached values, in bytes
+        """
+        return self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM derived').fetchone()[0]
+
+    def stats(self) -> dict:
+        entries, nbytes = self.conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM derived').fetchone()
+        return {'path': self.path,
+                'entries': entries,
+                'nbytes': nbytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses}
+
+    def prune(self, max_bytes: int = None) -> int:
+        """
+        Delete least recently used entries until cached values fit in max_bytes.
+        :param max_bytes: Size to prune to, in bytes; defaults to the size limit of the cache
+        :return: Number of entries deleted
+        """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        self.flush()
+        total = 0
+        to_delete = []
+        for key, size in self.conn.execute('SELECT key, size FROM derived ORDER BY accessed DESC'):
+            total += size
+            if total > max_bytes:
+                to_delete.append((key,))
+        with self.conn:
+            self.conn.executemany('DELETE FROM derived WHERE key = ?', to_delete)
+        self._size = None
+        logger.debug(f"Pruned {len(to_delete)} entries from {self.path}")
+        return len(to_delete)
+
+    def clear(self):
+        with self.conn:
+            self.conn.execute('DELETE FROM derived')
+        self._accessed = {}
+        self._size = None
+
+    def vacuum(self):
+        self.conn.execute('VACUUM')
+
+
+_derived_cache = None
+_MISSING = object()
+
+
+def get_derived_cache() -> DerivedCache:
+    """
+    Get the derived attribute cache, creating it if needed. Its location and size limit are read from
+    the CARMA_CACHE_PATH and CARMA_CACHE_MAX_MB environment variables.
+    :return: DerivedCache, or None if the cache is disabled
+    """
+    global _derived_cache
+    if _derived_cache is None:
+        max_mb = int(os.environ.get(CACHE_MAX_MB_ENV, DEFAULT_CACHE_MAX_MB))
+        _derived_cache = DerivedCache(os.environ.get(CACHE_PATH_ENV, DEFAULT_CACHE_PATH), max_mb * 1024 * 1024)
+    if _derived_cache.max_bytes <= 0:
+        return None
+    return _derived_cache
+
+
+def set_derived_cache(path: str, max_mb: int = DEFAULT_CACHE_MAX_MB):
+    """
+    Set the location and size limit of the derived attribute cache for this process.
+    :param path: Path of SQLite database
+    :param max_mb: Size limit in megabytes; 0 disables the cache
+    """
+    global _derived_cache
+    if _derived_cache is not None:
+        _derived_cache.close()
+    _derived_cache = DerivedCache(path, max_mb * 1024 * 1024)
+
+
+def memoize(kind: str, geometry: dict, dataset_path: str, compute: Callable, *extra):
+    """
+    Get a value derived from a geometry and a dataset from the cache, computing and caching it if needed.
+    :param kind: Kind of value (e.g. 'zone_histogram')
+    :param geometry: GeoJSON-like geometry the value is derived for
+    :param dataset_path: Path of the dataset the value is derived from
+    :param compute: Function, taking no arguments, that computes the value
+    :param extra: Other parameters the value depends on
+    :return: Value
+    """
+    cache = get_derived_cache()
+    if cache is None:
+        return compute()
+    key = cache_key(kind, geometry, dataset_path, *extra)
+    value = cache.get(key, _MISSING)
+    if value is _MISSING:
+        value = compute()
+        cache.put(key, kind, value)
+    return value
+
+
+def memoize_many(kind: str, geometries: List[dict], dataset_path: str, compute: Callable, *extra) -> list:
+    """
+    Get values derived from several geometries and a dataset from the cache, computing those not cached
+    together (e.g. with a single batched query) and caching them, see memoize.
+    :param kind: Kind of value (e.g. 'stream_characteristics')
+    :param geometries: GeoJSON-like geometries the values are derived for
+    :param dataset_path: Path of the dataset the values are derived from
+    :param compute: Function, taking a list of geometries, that computes the value of each geometry
+    :param extra: Other parameters the values depend on
+    :return: List of value of each geometry
+    """
+    cache = get_derived_cache()
+    if cache is None:
+        return list(compute(geometries))
+    keys = [cache_key(kind, geometry, dataset_path, *extra) for geometry in geometries]
+    values = [cache.get(key, _MISSING) for key in keys]
+    missing = [i for i, value in enumerate(values) if value is _MISSING]
+    if missing:
+        for i, value in zip(missing, compute([geometries[i] for i in missing])):
+            cache.put(keys[i], kind, value)
+            values[i] = value
+    return values
@@ -0,0 +1,55 @@
+# Copyright (C) 2021-present University of Louisiana at Lafayette.
+# All rights reserved. Licensed under the GPLv3 License. See LICENSE.txt in the project root for license information.
+
+import argparse
+import logging
+import sys
+import os
+
+from .. common import DATA_BASENAMES, get_raster_path
+from .. zonal.rawraster import build_raw_raster, RawRaster
+
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=('Write uncompressed copies of CDL and NLCD rasters next to the '
+                                                  'rasters, so that zonal statistics read pixels from memory-mapped '
+                                                  'files instead of decoding compressed blocks. Raw rasters take '
+                                                  'one byte per pixel, i.e. 15 to 17 GB per year of CDL or NLCD.'))
+    parser.add_argument('-d', '--datapath', required=True,
+                        help=('Directory containing data downloaded/extracted from '
+                              'bin/download-data.sh.'))
+    parser.add_argument('-ly', '--landcover_year', required=False, type=int, nargs='+',
+                        default=list(DATA_BASENAMES['nlcd'].keys()),
+                        help='Year(s) of NLCD landcover data to write. Defaults to all years.')
+    parser.add_argument('-cy', '--crop_year', required=False, type=int, nargs='+',
+                        default=list(DATA_BASENAMES['cdl'].keys()),
+                        help='Year(s) of USDA Cropland Data Layer to write. Defaults to all years.')
+    parser.add_argument('-v', '--verbose', help='Produce verbose output', action='store_true', default=False)
+    parser.add_argument('--overwrite', action='store_true', default=False,
+                        help='Rewrite raw rasters that are already up to date')
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    else:
+        logging.basicConfig(stream=sys.stdout, level=logging.ERROR)
+
+    rasters = []
+    for layer, years in (('nlcd', args.landcover_year), ('cdl', args.crop_year)):
+        for year in years:
+            if year not in DATA_BASENAMES[layer]:
+                sys.exit(f"No {layer.upper()} data for year {year}.")
+            rasters.append(get_raster_path(args.datapath, layer, year))
+
+    for raster_path in rasters:
+        if not os.path.exists(raster_path):
+            print(f"Skipping {raster_path}, which does not exist.")
+            continue
+        if not args.overwrite and RawRaster.load(raster_path) is not None:
+            print(f"Raw raster of {raster_path} is up to date.")
+            continue
+        path = build_raw_raster(raster_path)
+        print(f"Wrote raw raster of {raster_path} to {path}.")
@@ -0,0 +1,56 @@
+# Copyright (C) 2021-present University of Louisiana at Lafayette.
+# All rights reserved. Licensed under the GPLv3 License. See LICENSE.txt in the project root for license information.
+
+import argparse
+import logging
+import sys
+import os
+
+from .. common import DATA_BASENAMES, get_raster_path
+from .. zonal.tilehistograms import build_tile_histograms, TileHistograms
+
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=('Count the classes of each tile of CDL and NLCD rasters and store '
+                                                  'the counts next to the rasters, so that zonal statistics only '
+                                                  'read the pixels of tiles crossed by geography boundaries.'))
+    parser.add_argument('-d', '--datapath', required=True,
+                        help=('Directory containing data downloaded/extracted from '
+                              'bin/download-data.sh.'))
+    parser.add_argument('-ly', '--landcover_year', required=False, type=int, nargs='+',
+                        default=list(DATA_BASENAMES['nlcd'].keys()),
+                        help='Year(s) of NLCD landcover data to count. Defaults to all years.')
+    parser.add_argument('-cy', '--crop_year', required=False, type=int, nargs='+',
+                        default=list(DATA_BASENAMES['cdl'].keys()),
+                        help='Year(s) of USDA Cropland Data Layer to count. Defaults to all years.')
+    parser.add_argument('-t', '--tile_size', required=False, type=int, default=None,
+                        help='Size of tiles, in pixels. Defaults to the block size of tiled rasters, or 512.')
+    parser.add_argument('-v', '--verbose', help='Produce verbose output', action='store_true', default=False)
+    parser.add_argument('--overwrite', action='store_true', default=False,
+                        help='Rebuild tile histograms that are already up to date')
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    else:
+        logging.basicConfig(stream=sys.stdout, level=logging.ERROR)
+
+    rasters = []
+    for layer, years in (('nlcd', args.landcover_year), ('cdl', args.crop_year)):
+        for year in years:
+            if year not in DATA_BASENAMES[layer]:
+                sys.exit(f"No {layer.upper()} data for year {year}.")
+            rasters.append(get_raster_path(args.datapath, layer, year))
+
+    for raster_path in rasters:
+        if not os.path.exists(raster_path):
+            print(f"Skipping {raster_path}, which does not exist.")
+            continue
+        if not args.overwrite and TileHistograms.load(raster_path) is not None:
+            print(f"Tile histograms of {raster_path} are up to date.")
+            continue
+        path = build_tile_histograms(raster_path, args.tile_size)
+        print(f"Wrote tile histograms of {raster_path} to {path}.")
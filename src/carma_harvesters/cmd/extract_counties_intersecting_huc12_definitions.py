@@ -21,8 +21,10 @@ from .. common import verify_raw_data, DEFAULT_NLCD_YEAR, DEFAULT_CDL_YEAR, \
 from .. util import run_ogr2ogr
 from .. census import query_population_for_counties, POPULATION_URL_TEMPLATES
 from .. nhd import get_geography_stream_characteristics
-from .. crops.cropscape import calculate_geography_crop_area
-from .. nlcd import get_percent_highly_developed_land
+from .. zonal.engine import ZonalStatsEngine
+from .. zonal.update import crops_entry, developed_area_entry
+from .. zonal.overview import ZonalErrorReport, get_zonal_error_sidecar_path
+from .. zonal.histograms import HistogramStore, NLCD_LAYER, get_histogram_sidecar_path
 
 
 ST_PATT = re.compile('^\s*([0-9]{2}),*\s*$')
@@ -45,10 +47,18 @@ def main():
                         help='Year for which county population should be queried from US Census.')
     parser.add_argument('-a', '--census_api_key', required=True,
                         help='Census API key obtained from https://api.census.gov/data/key_signup.html')
-    parser.add_argument('-ly', '--landcover_year', required=False, type=int, default=DEFAULT_NLCD_YEAR,
-                        help='Year of NLCD landcover data to use to derive developed area.')
-    parser.add_argument('-cy', '--crop_year', required=False, type=int, default=DEFAULT_CDL_YEAR,
-                        help='Year USDA Cropland Data Layer to use for crops data.')
+    parser.add_argument('-ly', '--landcover_year', required=False, type=int, nargs='+', default=[DEFAULT_NLCD_YEAR],
+                        help='Year(s) of NLCD landcover data to use to derive developed area.')
+    parser.add_argument('-cy', '--crop_year', required=False, type=int, nargs='+', default=[DEFAULT_CDL_YEAR],
+                        help='Year(s) of USDA Cropland Data Layer to use for crops data.')
+    parser.add_argument('--zonal_resolution', required=False, type=int, default=1,
+                        help=('Compute crop and developed area from raster overviews up to this many times coarser '
+                              'than full resolution (e.g. 8), for fast approximate results. Standard errors of '
+                              'the approximate areas are written to a file ending in "-zonal-error.json" next to '
+                              'the output. Requires rasters with overviews, see bin/prepare-cog.sh.'))
+    parser.add_argument('--rollup', action='store_true', default=False,
+                        help=('Do not compute crop and developed area for counties; instead, derive them from '
+                              'sub-HUC12s using generate_subhuc12_definitions --rollup.'))
     parser.add_argument('-v', '--verbose', help='Produce verbose output', action='store_true', default=False)
     parser.add_argument('--debug', help='Debug mode: do not delete output if there is an exception',
                         action='store_true', default=False)
@@ -135,6 +145,11 @@ def main():
         logger.debug(f"Population by county: {pop_by_county}")
 
         # Do county-by-county processing
+        zonal_engine = ZonalStatsEngine(data_result['paths']['cdl_years'], data_result['paths']['nlcd_years'],
+                                        zonal_resolution=args.zonal_resolution)
+        error_report = ZonalErrorReport(args.zonal_resolution) if args.zonal_resolution > 1 else None
+        # Keep full NLCD histograms so that developed area can be recomputed for other classes
+        histogram_store = HistogramStore.load(get_histogram_sidecar_path(abs_carma_inpath))
         progress_bar = tqdm(carma_counties)
         for c in progress_bar:
             short_id = County.get_short_id(c['id'])
@@ -155,32 +170,31 @@ def main():
             c['minStreamLevel'] = min_strm_lvl
             c['meanAnnualFlow'] = max_mean_ann_flow
 
-            # Compute zonal stats for crop cover
-            logger.debug(f"Computing zonal stats for crop cover for county {c['id']}.")
-            cdl_year, cdl_path = data_result['paths']['cdl']
-            total_crop_area, crop_areas = calculate_geography_crop_area(c['geometry'], cdl_path, c['area'])
-            logger.debug(f"CDL total crop area: {total_crop_area}")
-            logger.debug(f"CDL individual crop areas: {crop_areas}")
-            c['crops'] = [OrderedDict([
-                ('year', cdl_year),
-                ('cropArea', total_crop_area),
-                ('cropAreaDetail', crop_areas)
-            ])]
-
-            # Compute zonal stats for landcover
-            logger.debug(f"Computing zonal stats for landcover for county {c['id']}.")
-            nlcd_year, nlcd_path = data_result['paths']['nlcd']
-            developed_nlcd_cells, total_nlcd_cells = get_percent_highly_developed_land(c['geometry'], nlcd_path)
-            developed_proportion = developed_nlcd_cells / total_nlcd_cells
-            c['developedArea'] = [OrderedDict([
-                ('year', nlcd_year),
-                ('area', c['area'] * developed_proportion)
-            ])]
+            if args.rollup:
+                # Crop and developed area will be rolled up from sub-HUC12s
+                c['crops'] = []
+                c['developedArea'] = []
+                continue
+
+            # Compute zonal stats for crop cover and landcover in one pass
+            logger.debug(f"Computing zonal stats for crop cover and landcover for county {c['id']}.")
+            zonal_stats = zonal_engine.compute(c['geometry'], c['area'])
+            c['crops'] = [crops_entry(year, histogram, c['area'])
+                          for year, histogram in zonal_stats.cdl_histograms.items()]
+            c['developedArea'] = [developed_area_entry(year, histogram, c['area'])
+                                  for year, histogram in zonal_stats.nlcd_histograms.items()]
+            histogram_store.put_entity(NLCD_LAYER, c, zonal_stats.nlcd_histograms)
+            if error_report is not None:
+                error_report.add_zonal_stats(c, zonal_stats)
 
         # Save CARMA county definitions
         write_objects_to_existing_carma_document(carma_counties, 'Counties',
                                                  document, abs_carma_inpath,
                                                  temp_out, args.overwrite)
+        histogram_store.save(get_histogram_sidecar_path(abs_carma_inpath))
+        if error_report is not None:
+            error_report.save(get_zonal_error_sidecar_path(abs_carma_inpath))
+            print(error_report.summary())
     except Exception as e:
         logger.error(traceback.format_exc())
         error = True
@@ -20,9 +20,11 @@ from .. common import verify_raw_data, DEFAULT_NLCD_YEAR, DEFAULT_CDL_YEAR, \
     verify_input, verify_outpath, output_json
 from .. util import run_ogr2ogr
 from .. nhd import get_huc12_stream_characteristics
-from .. crops.cropscape import calculate_geography_crop_area
-from .. usgs.recharge import calculate_huc12_mean_recharge
-from .. nlcd import get_percent_highly_developed_land
+from .. zonal.engine import ZonalStatsEngine
+from .. zonal.update import crops_entry, developed_area_entry
+from .. zonal.overview import ZonalErrorReport, get_zonal_error_sidecar_path
+from .. zonal.histograms import HistogramStore, NLCD_LAYER, get_histogram_sidecar_path
+from .. usgs.recharge import calculate_huc12_mean_recharge_batch
 
 
 HUC12_PATT = re.compile('^\s*([0-9]{12}),*\s*$')
@@ -53,10 +55,18 @@ def main():
                               'should be stored.'))
     parser.add_argument('-i', '--huc_path', required=True,
                         help='Path to file containing one or more HUC12 identifiers, one per line.')
-    parser.add_argument('-ly', '--landcover_year', required=False, type=int, default=DEFAULT_NLCD_YEAR,
-                        help='Year of NLCD landcover data to use to derive developed area.')
-    parser.add_argument('-cy', '--crop_year', required=False, type=int, default=DEFAULT_CDL_YEAR,
-                        help='Year USDA Cropland Data Layer to use for crops data.')
+    parser.add_argument('-ly', '--landcover_year', required=False, type=int, nargs='+', default=[DEFAULT_NLCD_YEAR],
+                        help='Year(s) of NLCD landcover data to use to derive developed area.')
+    parser.add_argument('-cy', '--crop_year', required=False, type=int, nargs='+', default=[DEFAULT_CDL_YEAR],
+                        help='Year(s) of USDA Cropland Data Layer to use for crops data.')
+    parser.add_argument('--zonal_resolution', required=False, type=int, default=1,
+                        help=('Compute crop and developed area from raster overviews up to this many times coarser '
+                              'than full resolution (e.g. 8), for fast approximate results. Standard errors of '
+                              'the approximate areas are written to a file ending in "-zonal-error.json" next to '
+                              'the output. Requires rasters with overviews, see bin/prepare-cog.sh.'))
+    parser.add_argument('--rollup', action='store_true', default=False,
+                        help=('Do not compute crop and developed area for HUC12s; instead, derive them from '
+                              'sub-HUC12s using generate_subhuc12_definitions --rollup.'))
     parser.add_argument('-v', '--verbose', help='Produce verbose output', action='store_true', default=False)
     parser.add_argument('--debug', help='Debug mode: do not delete output if there is an exception',
                         action='store_true', default=False)
@@ -101,6 +111,12 @@ def main():
         huc12_ids = [id for id in _read_huc12_id(args.huc_path)]
         logger.debug(f"HUC12s: {huc12_ids}")
 
+        zonal_engine = ZonalStatsEngine(data_result['paths']['cdl_years'], data_result['paths']['nlcd_years'],
+                                        zonal_resolution=args.zonal_resolution)
+        error_report = ZonalErrorReport(args.zonal_resolution) if args.zonal_resolution > 1 else None
+        # Keep full NLCD histograms so that developed area can be recomputed for other classes
+        histogram_store = HistogramStore()
+
         carma_huc12s = []
         progress_bar = tqdm(huc12_ids)
         for id in progress_bar:
@@ -156,40 +172,41 @@ def main():
             if max_mean_ann_flow:
                 h12['meanAnnualFlow'] = max_mean_ann_flow
 
-            # Compute zonal stats for crop cover
-            cdl_year, cdl_path = data_result['paths']['cdl']
-            total_crop_area, crop_areas = calculate_geography_crop_area(f, cdl_path, h12['area'])
-            logger.debug(f"CDL total crop area: {total_crop_area}")
-            logger.debug(f"CDL individual crop areas: {crop_areas}")
-            h12['crops'] = [OrderedDict([
-                ('year', cdl_year),
-                ('cropArea', total_crop_area),
-                ('cropAreaDetail', crop_areas)
-            ])]
-
-            # Compute zonal stats for landcover
-            nlcd_year, nlcd_path = data_result['paths']['nlcd']
-            developed_nlcd_cells, total_nlcd_cells = get_percent_highly_developed_land(f, nlcd_path)
-            developed_proportion = developed_nlcd_cells / total_nlcd_cells
-            h12['developedArea'] = [OrderedDict([
-                ('year', nlcd_year),
-                ('area', h12['area'] * developed_proportion)
-            ])]
-
-            # Compute zonal stats for groundwater recharge
-            recharge_path = data_result['paths']['recharge']
-            recharge = calculate_huc12_mean_recharge(f, recharge_path)
-            if recharge:
-                h12['recharge'] = recharge
+            if args.rollup:
+                # Crop and developed area will be rolled up from sub-HUC12s
+                h12['crops'] = []
+                h12['developedArea'] = []
+            else:
+                # Compute zonal stats for crop cover and landcover in one pass
+                zonal_stats = zonal_engine.compute(f, h12['area'])
+                h12['crops'] = [crops_entry(year, histogram, h12['area'])
+                                for year, histogram in zonal_stats.cdl_histograms.items()]
+                h12['developedArea'] = [developed_area_entry(year, histogram, h12['area'])
+                                        for year, histogram in zonal_stats.nlcd_histograms.items()]
+                histogram_store.put_entity(NLCD_LAYER, h12, zonal_stats.nlcd_histograms)
+                if error_report is not None:
+                    error_report.add_zonal_stats(h12, zonal_stats)
 
             # Add geometry last so that other properties appear first
             h12['geometry'] = f['geometry']
 
             carma_huc12s.append(h12)
 
+        # Compute groundwater recharge for all HUC12s at once
+        recharges = calculate_huc12_mean_recharge_batch([h12['geometry'] for h12 in carma_huc12s],
+                                                        data_result['paths']['recharge'])
+        for h12, recharge in zip(carma_huc12s, recharges):
+            if recharge:
+                h12['recharge'] = recharge
+                h12.move_to_end('geometry')
+
         # Save CARMA HUC12 definitions
         carma_definition = {'HUC12Watersheds': carma_huc12s}
         output_json(out_result['paths']['out_file_path'], temp_out, carma_definition, args.overwrite)
+        histogram_store.save(get_histogram_sidecar_path(out_result['paths']['out_file_path']))
+        if error_report is not None:
+            error_report.save(get_zonal_error_sidecar_path(out_result['paths']['out_file_path']))
+            print(error_report.summary())
     except Exception as e:
         logger.error(traceback.format_exc())
         error = True
@@ -0,0 +1,110 @@
+# Copyright (C) 2021-present University of Louisiana at Lafayette.
+# All rights reserved. Licensed under the GPLv3 License. See LICENSE.txt in the project root for license information.
+
+import os
+import argparse
+import logging
+import sys
+import traceback
+import json
+
+from tqdm import tqdm
+from shapely.geometry import shape
+
+from .. common import verify_raw_data, verify_input, open_existing_carma_document, \
+    DEFAULT_NLCD_YEAR, DEFAULT_CDL_YEAR
+from .. crops.cropscape import CDL_RASTER_VALUE_TO_NAME
+from .. nlcd import NLCD_RASTER_VALUE_TO_NAME
+from .. zonal.overview import entity_key
+from .. zonal.histograms import CDL_LAYER, NLCD_LAYER
+from .. zonal.transitions import cached_zone_transitions, transition_areas, get_transitions_sidecar_path
+
+
+ENTITY_TYPES = ['HUC12Watersheds', 'Counties', 'SubHUC12Watersheds']
+
+logger = logging.getLogger(__name__)
+
+
+def _year_pairs(years: list) -> list:
+    years = sorted(set(years))
+    return list(zip(years[:-1], years[1:]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=('Compute crop and land cover transitions between pairs of '
+                                                  'consecutive years of CDL and NLCD for the HUC12s, counties, '
+                                                  'and sub-HUC12s of a CARMA file. Transitions are written to a '
+                                                  'file ending in "-transitions.json" next to the CARMA file.'))
+    parser.add_argument('-d', '--datapath', required=True,
+                        help=('Directory containing data downloaded/extracted from '
+                              'bin/download-data.sh.'))
+    parser.add_argument('-c', '--carma_inpath', required=True,
+                        help='Path of CARMA file containing entities to compute transitions for.')
+    parser.add_argument('-cy', '--crop_year', required=False, type=int, nargs='+', default=[],
+                        help=('Years of USDA Cropland Data Layer to compute crop transitions between, '
+                              'e.g. 2010 2015 2020.'))
+    parser.add_argument('-ly', '--landcover_year', required=False, type=int, nargs='+', default=[],
+                        help=('Years of NLCD landcover data to compute land cover transitions between, '
+                              'e.g. 2011 2016.'))
+    parser.add_argument('-v', '--verbose', help='Produce verbose output', action='store_true', default=False)
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    else:
+        logging.basicConfig(stream=sys.stdout, level=logging.ERROR)
+
+    layers = [(CDL_LAYER, _year_pairs(args.crop_year), CDL_RASTER_VALUE_TO_NAME),
+              (NLCD_LAYER, _year_pairs(args.landcover_year), NLCD_RASTER_VALUE_TO_NAME)]
+    if not any(pairs for _, pairs, _ in layers):
+        sys.exit("At least two years of CDL (--crop_year) or NLCD (--landcover_year) are required.")
+
+    success, data_result = verify_raw_data(args.datapath,
+                                           nlcd_year=args.landcover_year or DEFAULT_NLCD_YEAR,
+                                           cdl_year=args.crop_year or DEFAULT_CDL_YEAR)
+    if not success:
+        for e in data_result['errors']:
+            print(e)
+        sys.exit("Invalid source data, exiting. Try running 'download-data.sh'.")
+    raster_paths = {CDL_LAYER: dict(data_result['paths']['cdl_years']),
+                    NLCD_LAYER: dict(data_result['paths']['nlcd_years'])}
+
+    abs_carma_inpath = os.path.abspath(args.carma_inpath)
+    success, input_result = verify_input(abs_carma_inpath)
+    if not success:
+        for e in input_result['errors']:
+            print(e)
+        sys.exit("Invalid input data, exiting.")
+
+    try:
+        document = open_existing_carma_document(abs_carma_inpath)
+        entities = [e for entity_type in ENTITY_TYPES for e in document.get(entity_type, [])]
+        if not entities:
+            sys.exit(f"No HUC12s, counties, or sub-HUC12s defined in {abs_carma_inpath}")
+
+        transitions_path = get_transitions_sidecar_path(abs_carma_inpath)
+        transitions = {}
+        if os.path.exists(transitions_path):
+            with open(transitions_path) as f:
+                transitions = json.load(f)
+
+        progress_bar = tqdm(entities)
+        for e in progress_bar:
+            key = entity_key(e)
+            progress_bar.set_description(f"Computing transitions for {key}")
+            bounds = shape(e['geometry']).bounds
+            # Years of a layer share a pixel grid, so each entity is rasterized once
+            masks = {}
+            for layer, pairs, class_names in layers:
+                for from_year, to_year in pairs:
+                    matrix = cached_zone_transitions(raster_paths[layer][from_year], raster_paths[layer][to_year],
+                                                     e['geometry'], bounds, masks)
+                    transitions.setdefault(layer, {}).setdefault(f"{from_year}-{to_year}", {})[key] = \
+                        transition_areas(matrix, class_names, e['area'])
+
+        with open(transitions_path, 'w') as f:
+            json.dump(transitions, f)
+        print(f"Wrote transitions of {len(entities)} entities to {transitions_path}.")
+    except Exception as e:
+        logger.error(traceback.format_exc())
+        sys.exit(e)
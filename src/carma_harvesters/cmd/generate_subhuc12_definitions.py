@@ -9,30 +9,50 @@ import tempfile
 import traceback
 import shutil
 import json
+import math
 from collections import OrderedDict
 from multiprocessing import Pool
-from typing import List
+from typing import List, Tuple
 
 from shapely.geometry import asShape
 
 from .. exception import SchemaValidationException
 from .. common import verify_raw_data, DEFAULT_NLCD_YEAR, DEFAULT_CDL_YEAR,\
     verify_input, open_existing_carma_document, write_objects_to_existing_carma_document
-from .. nhd import get_geography_stream_characteristics
+from .. nhd import get_geographies_stream_characteristics, get_flowline_index, huc8_bounds, huc8_code
 from .. util import Geometry, intersect_shapely_to_multipolygon
-from .. crops.cropscape import calculate_geography_crop_area
-from .. nlcd import get_percent_highly_developed_land
+from .. zonal.engine import ZonalStatsEngine
+from .. zonal.update import crops_entry, developed_area_entry, CHUNKS_PER_JOB
+from .. zonal.hilbert import entity_hilbert_order
+from .. zonal.datasets import init_worker
+from .. zonal.blockcache import get_block_cache
+from .. zonal.maskcache import get_mask_cache
+from .. zonal.rollup import HistogramStore, CDL_LAYER, NLCD_LAYER, get_histogram_sidecar_path, \
+    subhuc12_key, rollup_entities
 
 
 logger = logging.getLogger(__name__)
 
 
-def do_generate_subhuc12_definitions(data_result: dict, document: dict, huc: dict) -> List[dict]:
+def do_generate_subhuc12_definitions(data_result: dict, document: dict, huc: dict,
+                                     flowline_bounds: tuple = None) -> Tuple[List[dict], dict]:
+    """
+    Generate sub-HUC12s for a HUC12.
+    :param flowline_bounds: Bounds of the HUC8 of huc (see nhd.huc8_bounds); if provided, the flowlines within are
+        loaded into memory once per process (see nhd.get_flowline_index) to compute stream characteristics
+        of sub-HUC12s, instead of querying the flowline database for each sub-HUC12
+    :return: Tuple consisting of: list of sub-HUC12s, and dict mapping sub-HUC12 key
+        to tuple of CDL and NLCD histograms, each a dict mapping year to histogram
+    """
     sub_huc12s = []
+    histograms = {}
     print(f"\tBegin processing HUC12 {huc['id']}.")
     huc_geom = Geometry(huc['geometry'])
     huc_shape = asShape(huc_geom)
     huc_geom_geojson = json.dumps(huc['geometry'])
+    zonal_engine = ZonalStatsEngine(data_result['paths']['cdl_years'], data_result['paths']['nlcd_years'])
+    flowline_path = data_result['paths']['flowline']
+    flowline_index = get_flowline_index(flowline_path, flowline_bounds) if flowline_bounds else None
     # Iterate over all counties, checking for an intersection
     for county in document['Counties']:
         county_geom = Geometry(county['geometry'])
@@ -60,46 +80,38 @@ def do_generate_subhuc12_definitions(data_result: dict, document: dict, huc: dic
             # Wrap sub-HUC12 geometry as a Geometry for zonal stats computation
             geom = Geometry(sub_huc_geom)
 
-            # Compute zonal stats for crop cover
-            cdl_year, cdl_path = data_result['paths']['cdl']
-            total_crop_area, crop_areas = calculate_geography_crop_area(geom, cdl_path, sub_huc['area'])
-            logger.debug(f"CDL total crop area: {total_crop_area}")
-            logger.debug(f"CDL individual crop areas: {crop_areas}")
-            sub_huc['crops'].append(OrderedDict([
-                ('year', cdl_year),
-                ('cropArea', total_crop_area),
-                ('cropAreaDetail', crop_areas)
-            ]))
-
-            # Compute zonal stats for landcover
-            nlcd_year, nlcd_path = data_result['paths']['nlcd']
-            developed_nlcd_cells, total_nlcd_cells = get_percent_highly_developed_land(geom, nlcd_path)
-            if total_nlcd_cells == 0:
-                developed_proportion = 0.0
-            else:
-                developed_proportion = developed_nlcd_cells / total_nlcd_cells
-            sub_huc['developedArea'].append(OrderedDict([
-                ('year', nlcd_year),
-                ('area', sub_huc['area'] * developed_proportion)
-            ]))
-
-            # Calculate stream order, stream level, mean annual flow
-            logger.debug(
-                f"Getting stream characteristics for sub-HUC12 {sub_huc['huc12']}:{sub_huc['county']}. This may take a while...")
-            max_strm_ord, min_strm_lvl, max_mean_ann_flow = \
-                get_geography_stream_characteristics(sub_huc['geometry'], data_result['paths']['flowline'],
-                                                     huc_geom_geojson)
-            logger.debug(
-                f"Stream characteristics: max_strm_ord: {max_strm_ord}, min_strm_lvl: {min_strm_lvl}, max_mean_ann_flow: {max_mean_ann_flow}")
-            if max_strm_ord:
-                sub_huc['maxStreamOrder'] = max_strm_ord
-            if min_strm_lvl:
-                sub_huc['minStreamLevel'] = min_strm_lvl
-            if max_mean_ann_flow:
-                sub_huc['meanAnnualFlow'] = max_mean_ann_flow
-
+            # Compute zonal stats for crop cover and landcover in one pass
+            zonal_stats = zonal_engine.compute(geom, sub_huc['area'])
+            histograms[subhuc12_key(sub_huc)] = (zonal_stats.cdl_histograms, zonal_stats.nlcd_histograms)
+            for year, histogram in zonal_stats.cdl_histograms.items():
+                sub_huc['crops'].append(crops_entry(year, histogram, sub_huc['area']))
+            for year, histogram in zonal_stats.nlcd_histograms.items():
+                sub_huc['developedArea'].append(developed_area_entry(year, histogram, sub_huc['area']))
+
+    # Calculate stream order, stream level, mean annual flow of all sub-HUC12s at once, so that those without
+    # flowlines share a single search for their nearest flowlines in the HUC12
+    logger.debug(f"Getting stream characteristics for {len(sub_huc12s)} sub-HUC12s of HUC12 {huc['id']}...")
+    characteristics = get_geographies_stream_characteristics([s['geometry'] for s in sub_huc12s], flowline_path,
+                                                             huc_geom_geojson, flowline_index)
+    for sub_huc, (max_strm_ord, min_strm_lvl, max_mean_ann_flow) in zip(sub_huc12s, characteristics):
+        logger.debug(
+            f"Stream characteristics of sub-HUC12 {sub_huc['huc12']}:{sub_huc['county']}: "
+            f"max_strm_ord: {max_strm_ord}, min_strm_lvl: {min_strm_lvl}, max_mean_ann_flow: {max_mean_ann_flow}")
+        if max_strm_ord:
+            sub_huc['maxStreamOrder'] = max_strm_ord
+        if min_strm_lvl:
+            sub_huc['minStreamLevel'] = min_strm_lvl
+        if max_mean_ann_flow:
+            sub_huc['meanAnnualFlow'] = max_mean_ann_flow
+
+    logger.debug(f"Raster block cache after HUC12 {huc['id']}: {get_block_cache()}")
+    logger.debug(f"Zone mask cache after HUC12 {huc['id']}: {get_mask_cache()}")
     print(f"\tFinished processing HUC12 {huc['id']}.")
-    return sub_huc12s
+    return sub_huc12s, histograms
+
+
+def _generate_subhuc12_worker(args: tuple) -> Tuple[List[dict], dict]:
+    return do_generate_subhuc12_definitions(*args)
 
 
 def main():
@@ -116,10 +128,14 @@ def main():
                         help=('Path of CARMA file containing definitions of HUC12 watersheds '
                               'and county definitions. Resulting sub-HUC12 watersheds '
                               'will be written to the same file.'))
-    parser.add_argument('-ly', '--landcover_year', required=False, type=int, default=DEFAULT_NLCD_YEAR,
-                        help='Year of NLCD landcover data to use to derive developed area.')
-    parser.add_argument('-cy', '--crop_year', required=False, type=int, default=DEFAULT_CDL_YEAR,
-                        help='Year USDA Cropland Data Layer to use for crops data.')
+    parser.add_argument('-ly', '--landcover_year', required=False, type=int, nargs='+', default=[DEFAULT_NLCD_YEAR],
+                        help='Year(s) of NLCD landcover data to use to derive developed area.')
+    parser.add_argument('-cy', '--crop_year', required=False, type=int, nargs='+', default=[DEFAULT_CDL_YEAR],
+                        help='Year(s) of USDA Cropland Data Layer to use for crops data.')
+    parser.add_argument('--rollup', action='store_true', default=False,
+                        help=('Set crop and developed area of HUC12s and counties by summing the CDL and NLCD '
+                              'histograms of their sub-HUC12s, which are saved alongside carma_inpath. Use '
+                              'with HUC12s and counties extracted with --rollup.'))
     parser.add_argument('-v', '--verbose', help='Produce verbose output', action='store_true', default=False)
     parser.add_argument('--overwrite', action='store_true', help='Overwrite output', default=False)
     args = parser.parse_args()
@@ -159,22 +175,54 @@ def main():
 
         # Build sub-HUC12 watersheds (i.e. parts of HUC12 watersheds that intersect a county)
         sub_huc12s = []
-
-        # For each HUC12, determine which counties it intersects with
-        num_huc12 = len(document['HUC12Watersheds'])
-        results = []
-        with Pool() as pool:
-            for i, huc in enumerate(document['HUC12Watersheds']):
-                print(f"Generating sub watersheds for HUC12 {i} of {num_huc12}")
-                r = pool.apply_async(do_generate_subhuc12_definitions, (data_result, document, huc), callback=sub_huc12s.extend)
-                results.append(r)
-            for r in results:
-                r.wait()
+        histogram_store = HistogramStore.load(get_histogram_sidecar_path(abs_carma_inpath))
+        cdl_rasters = data_result['paths']['cdl_years']
+        nlcd_rasters = data_result['paths']['nlcd_years']
+
+        def _collect_result(result: Tuple[List[dict], dict]):
+            sub_huc12s.extend(result[0])
+            for key, (cdl_histograms, nlcd_histograms) in result[1].items():
+                for year, histogram in cdl_histograms.items():
+                    histogram_store.put(CDL_LAYER, year, key, histogram)
+                for year, histogram in nlcd_histograms.items():
+                    histogram_store.put(NLCD_LAYER, year, key, histogram)
+
+        # For each HUC12, determine which counties it intersects with. HUC12s are dispatched in Hilbert
+        # order of their centroids, in runs of neighboring HUC12s per worker, so that each worker reads a
+        # compact region of the rasters.
+        huc12s = document['HUC12Watersheds']
+        num_huc12 = len(huc12s)
+        order = entity_hilbert_order(huc12s)
+        processes = os.cpu_count() or 1
+        chunk_size = max(1, math.ceil(num_huc12 / (processes * CHUNKS_PER_JOB)))
+        results = [None] * num_huc12
+        # Flowlines are loaded in memory by HUC8, which neighboring HUC12s share
+        extents = huc8_bounds(huc12s)
+        raster_paths = [path for _, path in cdl_rasters + nlcd_rasters]
+        with Pool(processes, initializer=init_worker, initargs=(None, raster_paths)) as pool:
+            tasks = [(data_result, document, huc12s[i], extents[huc8_code(huc12s[i]['id'])]) for i in order]
+            for n, (i, result) in enumerate(zip(order, pool.imap(_generate_subhuc12_worker, tasks,
+                                                                  chunksize=chunk_size))):
+                print(f"Generated sub watersheds for HUC12 {n + 1} of {num_huc12}")
+                results[i] = result
+        # Keep sub-HUC12s in the order of their HUC12s in the document
+        for result in results:
+            _collect_result(result)
+
+        if args.rollup:
+            # Derive HUC12 and county values from their sub-HUC12s, instead of re-reading rasters for them
+            zonal_engine = ZonalStatsEngine(cdl_rasters, nlcd_rasters)
+            for entity_type, parent_attr in [('HUC12Watersheds', 'huc12'), ('Counties', 'county')]:
+                num_rolled_up, num_direct = rollup_entities(document[entity_type], parent_attr, sub_huc12s,
+                                                            histogram_store, args.crop_year, args.landcover_year,
+                                                            zonal_engine)
+                print(f"{entity_type}: rolled up {num_rolled_up} from sub-HUC12s, computed {num_direct} directly.")
 
         # Save sub-HUC12 definitions
         write_objects_to_existing_carma_document(sub_huc12s, 'SubHUC12Watersheds',
                                                  document, abs_carma_inpath,
                                                  temp_out, args.overwrite)
+        histogram_store.save(get_histogram_sidecar_path(abs_carma_inpath))
     except SchemaValidationException as e:
         logger.error(traceback.format_exc())
         sys.exit(e)
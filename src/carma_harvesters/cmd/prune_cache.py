@@ -0,0 +1,49 @@
+# Copyright (C) 2021-present University of Louisiana at Lafayette.
+# All rights reserved. Licensed under the GPLv3 License. See LICENSE.txt in the project root for license information.
+
+import argparse
+import logging
+import sys
+import os
+
+from .. cache import DerivedCache, CACHE_PATH_ENV, DEFAULT_CACHE_PATH, CACHE_MAX_MB_ENV, DEFAULT_CACHE_MAX_MB
+
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=('Prune the cache of derived zonal and stream attributes (crop and '
+                                                  'landcover histograms, mean recharge, stream characteristics) '
+                                                  'that is used when extracting, generating, and updating '
+                                                  'CARMA geographies.'))
+    parser.add_argument('-p', '--cache_path', required=False,
+                        default=os.environ.get(CACHE_PATH_ENV, DEFAULT_CACHE_PATH),
+                        help=f"Path of cache database. Defaults to ${CACHE_PATH_ENV} or {DEFAULT_CACHE_PATH}.")
+    parser.add_argument('-m', '--max_mb', required=False, type=int,
+                        default=int(os.environ.get(CACHE_MAX_MB_ENV, DEFAULT_CACHE_MAX_MB)),
+                        help=(f"Size, in megabytes, to prune the cache to, removing least recently used entries "
+                              f"first. Defaults to ${CACHE_MAX_MB_ENV} or {DEFAULT_CACHE_MAX_MB}."))
+    parser.add_argument('--clear', action='store_true', help='Remove all entries from the cache', default=False)
+    parser.add_argument('-v', '--verbose', help='Produce verbose output', action='store_true', default=False)
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    else:
+        logging.basicConfig(stream=sys.stdout, level=logging.ERROR)
+
+    if not os.path.exists(args.cache_path):
+        sys.exit(f"Cache {args.cache_path} does not exist.")
+
+    cache = DerivedCache(args.cache_path, args.max_mb * 1024 * 1024)
+    if args.clear:
+        cache.clear()
+        print(f"Cleared {args.cache_path}.")
+    else:
+        num_pruned = cache.prune()
+        print(f"Pruned {num_pruned} entries from {args.cache_path}.")
+    cache.vacuum()
+    stats = cache.stats()
+    print(f"Cache now has {stats['entries']} entries totaling {stats['nbytes'] / (1024 * 1024):.1f} MB.")
+    cache.close()
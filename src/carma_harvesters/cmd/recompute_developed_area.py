@@ -0,0 +1,90 @@
+# Copyright (C) 2021-present University of Louisiana at Lafayette.
+# All rights reserved. Licensed under the GPLv3 License. See LICENSE.txt in the project root for license information.
+
+import os
+import argparse
+import tempfile
+import shutil
+import logging
+import sys
+import traceback
+
+from .. common import verify_input, open_existing_carma_document, output_json
+from .. nlcd import NLCD_DEVELOPED_CLASSES
+from .. zonal import NUM_CATEGORICAL_CLASSES
+from .. zonal.update import developed_area_entry, set_year_entry
+from .. zonal.histograms import HistogramStore, NLCD_LAYER, get_histogram_sidecar_path
+
+
+ENTITY_TYPES = ['HUC12Watersheds', 'Counties', 'SubHUC12Watersheds']
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=('Recompute developed area of HUC12s, counties, and sub-HUC12s in '
+                                                  'a CARMA file from the NLCD histograms saved next to it, counting '
+                                                  'the given NLCD classes as developed. NLCD rasters are not read.'))
+    parser.add_argument('-c', '--carma_inpath', required=True,
+                        help='Path of CARMA file containing entities whose developed area should be recomputed.')
+    parser.add_argument('-n', '--nlcd_classes', required=False, type=int, nargs='+',
+                        default=list(NLCD_DEVELOPED_CLASSES),
+                        help=('NLCD class(es) to count as developed, e.g. 23 24 for medium and high intensity. '
+                              f"Defaults to {' '.join(str(c) for c in NLCD_DEVELOPED_CLASSES)}."))
+    parser.add_argument('-ly', '--landcover_year', required=False, type=int, nargs='+',
+                        help='Year(s) of developed area to recompute. Defaults to all years of each entity.')
+    parser.add_argument('-v', '--verbose', help='Produce verbose output', action='store_true', default=False)
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    else:
+        logging.basicConfig(stream=sys.stdout, level=logging.ERROR)
+
+    invalid_classes = [c for c in args.nlcd_classes if not 0 <= c < NUM_CATEGORICAL_CLASSES]
+    if invalid_classes:
+        sys.exit(f"Invalid NLCD classes: {invalid_classes}")
+
+    abs_carma_inpath = os.path.abspath(args.carma_inpath)
+    success, input_result = verify_input(abs_carma_inpath)
+    if not success:
+        for e in input_result['errors']:
+            print(e)
+        sys.exit("Invalid input data, exiting.")
+
+    histogram_path = get_histogram_sidecar_path(abs_carma_inpath)
+    if not os.path.exists(histogram_path):
+        sys.exit(f"No NLCD histograms found for {abs_carma_inpath}: expected {histogram_path}.")
+
+    try:
+        # Make temporary working directory
+        temp_out = tempfile.mkdtemp()
+        logger.debug(f"Temp dir: {temp_out}")
+
+        document = open_existing_carma_document(abs_carma_inpath)
+        histogram_store = HistogramStore.load(histogram_path)
+
+        for entity_type in ENTITY_TYPES:
+            num_updated = 0
+            num_missing = 0
+            for e in document.get(entity_type, []):
+                years = args.landcover_year or [d['year'] for d in e.get('developedArea', [])]
+                for year in years:
+                    histogram = histogram_store.get_entity(NLCD_LAYER, year, e)
+                    if histogram is None:
+                        num_missing += 1
+                        continue
+                    set_year_entry(e.setdefault('developedArea', []),
+                                   developed_area_entry(year, histogram, e['area'], args.nlcd_classes))
+                    num_updated += 1
+            if num_updated or num_missing:
+                print(f"{entity_type}: recomputed {num_updated} developed areas, "
+                      f"{num_missing} without NLCD histograms were left unchanged.")
+
+        # Save updated CARMA document (always overwrite because we are updating)
+        output_json(abs_carma_inpath, temp_out, document, overwrite=True)
+    except Exception as e:
+        logger.error(traceback.format_exc())
+        sys.exit(e)
+    finally:
+        shutil.rmtree(temp_out)
@@ -18,10 +18,10 @@ from carma_schema.geoconnex.census import County
 
 from .. common import verify_raw_data, DEFAULT_NLCD_YEAR, DEFAULT_CDL_YEAR, \
     verify_input, open_existing_carma_document, output_json
-from .. util import Geometry
 from .. census import query_population_for_counties, POPULATION_URL_TEMPLATES
-from .. crops.cropscape import calculate_geography_crop_area
-from .. nlcd import get_percent_highly_developed_land
+from .. zonal.update import update_entity_crops, update_entity_developed_area
+from .. zonal.overview import ZonalErrorReport, get_zonal_error_sidecar_path
+from .. zonal.histograms import HistogramStore, get_histogram_sidecar_path
 
 
 ST_PATT = re.compile('^\s*([0-9]{2}),*\s*$')
@@ -43,10 +43,17 @@ def main():
                         help='Year for which county population should be queried from US Census.')
     parser.add_argument('--census_api_key', required=True,
                         help='Census API key obtained from https://api.census.gov/data/key_signup.html')
-    parser.add_argument('-ly', '--landcover_year', required=False, type=int, default=DEFAULT_NLCD_YEAR,
-                        help='Year of NLCD landcover data to use to derive developed area.')
-    parser.add_argument('-cy', '--crop_year', required=False, type=int, default=DEFAULT_CDL_YEAR,
-                        help='Year USDA Cropland Data Layer to use for crops data.')
+    parser.add_argument('-ly', '--landcover_year', required=False, type=int, nargs='+', default=[DEFAULT_NLCD_YEAR],
+                        help='Year(s) of NLCD landcover data to use to derive developed area.')
+    parser.add_argument('-cy', '--crop_year', required=False, type=int, nargs='+', default=[DEFAULT_CDL_YEAR],
+                        help='Year(s) of USDA Cropland Data Layer to use for crops data.')
+    parser.add_argument('--zonal_resolution', required=False, type=int, default=1,
+                        help=('Compute crop and developed area from raster overviews up to this many times coarser '
+                              'than full resolution (e.g. 8), for fast approximate results. Standard errors of '
+                              'the approximate areas are written to a file ending in "-zonal-error.json" next to '
+                              'the CARMA file. Requires rasters with overviews, see bin/prepare-cog.sh.'))
+    parser.add_argument('-j', '--jobs', required=False, type=int, default=1,
+                        help='Number of worker processes to use to compute zonal statistics.')
     parser.add_argument('-v', '--verbose', help='Produce verbose output', action='store_true', default=False)
     parser.add_argument('--overwrite', action='store_true', help='Overwrite output', default=False)
     args = parser.parse_args()
@@ -67,8 +74,8 @@ def main():
             print(e)
         sys.exit("Invalid source data, exiting. Try running 'download-data.sh'.")
 
-    cdl_year, cdl_path = data_result['paths']['cdl']
-    nlcd_year, nlcd_path = data_result['paths']['nlcd']
+    cdl_rasters = data_result['paths']['cdl_years']
+    nlcd_rasters = data_result['paths']['nlcd_years']
 
     abs_carma_inpath = os.path.abspath(args.carma_inpath)
     success, input_result = verify_input(abs_carma_inpath)
@@ -100,9 +107,6 @@ def main():
             progress_bar.set_description(f"Updating {county['id']}")
             short_id = County.get_short_id(county['id'])
 
-            # Wrap HUC12 geometry as a Geometry for zonal stats computation
-            geom = Geometry(county['geometry'])
-
             # Add new population data
             pops = county['population']
             pop_years = {p['year'] for p in pops}
@@ -114,32 +118,23 @@ def main():
                         ('count', p.population)
                     ]))
 
-            # Compute zonal stats for crop cover (if needed)
-            crops = county['crops']
-            crop_years = {c['year'] for c in crops}
-            if cdl_year not in crop_years:
-                total_crop_area, crop_areas = calculate_geography_crop_area(geom, cdl_path, county['area'])
-                logger.debug(f"CDL total crop area: {total_crop_area}")
-                logger.debug(f"CDL individual crop areas: {crop_areas}")
-                crops.append(OrderedDict([
-                    ('year', cdl_year),
-                    ('cropArea', total_crop_area),
-                    ('cropAreaDetail', crop_areas)
-                ]))
-
-            # Compute zonal stats for landcover (if needed)
-            developed_area = county['developedArea']
-            developed_area_years = {d['year'] for d in developed_area}
-            if nlcd_year not in developed_area_years:
-                developed_nlcd_cells, total_nlcd_cells = get_percent_highly_developed_land(geom, nlcd_path)
-                developed_proportion = developed_nlcd_cells / total_nlcd_cells
-                developed_area.append(OrderedDict([
-                    ('year', nlcd_year),
-                    ('area', county['area'] * developed_proportion)
-                ]))
+        # Compute zonal stats for crop cover and landcover (if needed) for all counties at once
+        error_report = ZonalErrorReport(args.zonal_resolution) if args.zonal_resolution > 1 else None
+        histogram_store = HistogramStore.load(get_histogram_sidecar_path(abs_carma_inpath))
+        num_updated = update_entity_crops(counties, cdl_rasters, jobs=args.jobs,
+                                          zonal_resolution=args.zonal_resolution, report=error_report)
+        logger.debug(f"Added crop data for {args.crop_year} to {num_updated} counties")
+        num_updated = update_entity_developed_area(counties, nlcd_rasters, jobs=args.jobs,
+                                                   zonal_resolution=args.zonal_resolution, report=error_report,
+                                                   store=histogram_store)
+        logger.debug(f"Added developed area for {args.landcover_year} to {num_updated} counties")
 
         # Save updated CARMA document (always overwrite because we are updating)
         output_json(abs_carma_inpath, temp_out, document, overwrite=True)
+        histogram_store.save(get_histogram_sidecar_path(abs_carma_inpath))
+        if error_report is not None:
+            error_report.save(get_zonal_error_sidecar_path(abs_carma_inpath))
+            print(error_report.summary())
     except Exception as e:
         logger.error(traceback.format_exc())
         sys.exit(e)
@@ -9,15 +9,12 @@ import re
 import logging
 import sys
 import traceback
-from collections import OrderedDict
-
-from tqdm import tqdm
 
 from .. common import verify_raw_data, DEFAULT_NLCD_YEAR, DEFAULT_CDL_YEAR, \
     verify_input, open_existing_carma_document, output_json
-from .. util import Geometry
-from .. crops.cropscape import calculate_geography_crop_area
-from .. nlcd import get_percent_highly_developed_land
+from .. zonal.update import update_entity_crops, update_entity_developed_area
+from .. zonal.overview import ZonalErrorReport, get_zonal_error_sidecar_path
+from .. zonal.histograms import HistogramStore, get_histogram_sidecar_path
 
 
 HUC12_PATT = re.compile('^\s*([0-9]{12}),*\s*$')
@@ -45,10 +42,17 @@ def main():
     parser.add_argument('-c', '--carma_inpath', required=True,
                         help=('Path of CARMA file containing definitions of HUC12 watersheds '
                               'to be updated with additional year of crop and landcover data.'))
-    parser.add_argument('-ly', '--landcover_year', required=False, type=int, default=DEFAULT_NLCD_YEAR,
-                        help='Year of NLCD landcover data to use to derive developed area.')
-    parser.add_argument('-cy', '--crop_year', required=False, type=int, default=DEFAULT_CDL_YEAR,
-                        help='Year USDA Cropland Data Layer to use for crops data.')
+    parser.add_argument('-ly', '--landcover_year', required=False, type=int, nargs='+', default=[DEFAULT_NLCD_YEAR],
+                        help='Year(s) of NLCD landcover data to use to derive developed area.')
+    parser.add_argument('-cy', '--crop_year', required=False, type=int, nargs='+', default=[DEFAULT_CDL_YEAR],
+                        help='Year(s) of USDA Cropland Data Layer to use for crops data.')
+    parser.add_argument('--zonal_resolution', required=False, type=int, default=1,
+                        help=('Compute crop and developed area from raster overviews up to this many times coarser '
+                              'than full resolution (e.g. 8), for fast approximate results. Standard errors of '
+                              'the approximate areas are written to a file ending in "-zonal-error.json" next to '
+                              'the CARMA file. Requires rasters with overviews, see bin/prepare-cog.sh.'))
+    parser.add_argument('-j', '--jobs', required=False, type=int, default=1,
+                        help='Number of worker processes to use to compute zonal statistics.')
     parser.add_argument('-v', '--verbose', help='Produce verbose output', action='store_true', default=False)
     parser.add_argument('--debug', help='Debug mode: do not delete output if there is an exception',
                         action='store_true', default=False)
@@ -67,8 +71,8 @@ def main():
             print(e)
         sys.exit("Invalid source data, exiting. Try running 'download-data.sh'.")
 
-    cdl_year, cdl_path = data_result['paths']['cdl']
-    nlcd_year, nlcd_path = data_result['paths']['nlcd']
+    cdl_rasters = data_result['paths']['cdl_years']
+    nlcd_rasters = data_result['paths']['nlcd_years']
 
     abs_carma_inpath = os.path.abspath(args.carma_inpath)
     success, input_result = verify_input(abs_carma_inpath)
@@ -89,44 +93,25 @@ def main():
         if 'SubHUC12Watersheds' not in document or len(document['SubHUC12Watersheds']) < 1:
             sys.exit(f"No SubHUC12 watersheds defined in {abs_carma_inpath}")
 
-        huc12s = document['SubHUC12Watersheds']
-        progress_bar = tqdm(huc12s)
-        for subH12 in progress_bar:
-            id = f"{subH12['county']}:{subH12['huc12']}"
-            progress_bar.set_description(f"Updating {id}")
-
-            # Wrap HUC12 geometry as a Geometry for zonal stats computation
-            geom = Geometry(subH12['geometry'])
-
-            # Compute zonal stats for crop cover (if needed)
-            crops = subH12['crops']
-            crop_years = {c['year'] for c in crops}
-            if cdl_year not in crop_years:
-                total_crop_area, crop_areas = calculate_geography_crop_area(geom, cdl_path, subH12['area'])
-                logger.debug(f"CDL total crop area: {total_crop_area}")
-                logger.debug(f"CDL individual crop areas: {crop_areas}")
-                crops.append(OrderedDict([
-                    ('year', cdl_year),
-                    ('cropArea', total_crop_area),
-                    ('cropAreaDetail', crop_areas)
-                ]))
-
-            # Compute zonal stats for landcover (if needed)
-            developed_area = subH12['developedArea']
-            developed_area_years = {d['year'] for d in developed_area}
-            if nlcd_year not in developed_area_years:
-                developed_nlcd_cells, total_nlcd_cells = get_percent_highly_developed_land(geom, nlcd_path)
-                if total_nlcd_cells == 0:
-                    developed_proportion = 0
-                else:
-                    developed_proportion = developed_nlcd_cells / total_nlcd_cells
-                developed_area.append(OrderedDict([
-                    ('year', nlcd_year),
-                    ('area', subH12['area'] * developed_proportion)
-                ]))
+        sub_huc12s = document['SubHUC12Watersheds']
+
+        # Compute zonal stats for crop cover and landcover (if needed) for all sub-HUC12s at once
+        error_report = ZonalErrorReport(args.zonal_resolution) if args.zonal_resolution > 1 else None
+        histogram_store = HistogramStore.load(get_histogram_sidecar_path(abs_carma_inpath))
+        num_updated = update_entity_crops(sub_huc12s, cdl_rasters, jobs=args.jobs,
+                                          zonal_resolution=args.zonal_resolution, report=error_report)
+        logger.debug(f"Added crop data for {args.crop_year} to {num_updated} sub-HUC12s")
+        num_updated = update_entity_developed_area(sub_huc12s, nlcd_rasters, jobs=args.jobs,
+                                                   zonal_resolution=args.zonal_resolution, report=error_report,
+                                                   store=histogram_store)
+        logger.debug(f"Added developed area for {args.landcover_year} to {num_updated} sub-HUC12s")
 
         # Save updated CARMA document (always overwrite because we are updating)
         output_json(abs_carma_inpath, temp_out, document, overwrite=True)
+        histogram_store.save(get_histogram_sidecar_path(abs_carma_inpath))
+        if error_report is not None:
+            error_report.save(get_zonal_error_sidecar_path(abs_carma_inpath))
+            print(error_report.summary())
     except Exception as e:
         logger.error(traceback.format_exc())
         error = True
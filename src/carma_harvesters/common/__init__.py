@@ -22,6 +22,7 @@ import carma_schema
 from carma_schema import get_water_use_data_for_huc12
 
 from .. util import Geometry
+from .. nhd import get_connection, has_spatial_index, FLOWLINE_SPATIAL_INDEX
 from .. exception import SchemaValidationException
 
 
@@ -39,8 +40,19 @@ DATA_BASENAMES = {'wbd': 'WBDSnapshot_National.spatialite',
                     },
                   'rech48grd': 'rech48grd.tif'
                   }
+# Basenames of rasters in their native CRS (Albers equal area for CDL and NLCD), as converted by
+# bin/download-data.sh. DATA_BASENAMES are those of the WGS84 copies made by earlier versions of
+# download-data.sh; CDL and recharge rasters have the same basenames in either layout.
+NATIVE_DATA_BASENAMES = {'nlcd': {
+                             2011: 'nlcd_2011_land_cover_l48_20210604.tif',
+                             2016: 'NLCD_2016_Land_Cover_L48_20190424.tif'
+                           },
+                         'cdl': DATA_BASENAMES['cdl']
+                         }
 DEFAULT_NLCD_YEAR = 2016
 DEFAULT_CDL_YEAR = 2015
+# Suffix of cloud-optimized copies of rasters written by bin/prepare-cog.sh
+COG_SUFFIX = '-cog.tif'
 
 CARMA_SCHEMA_RSRC_KEY = 'carma_schema'
 CARMA_SCHEMA_REL_PATH = 'data/schema/CARMA-schema-20210908.json'
@@ -73,21 +85,70 @@ def spatialite_to_geojson(spatialite_path: str, table_name: str, geojson_path: s
     return True
 
 
+def get_cog_path(raster_path: str) -> str:
+    return os.path.splitext(raster_path)[0] + COG_SUFFIX
+
+
+def prefer_cog(raster_path: str) -> str:
+    """
+    Return the path of the cloud-optimized (tiled, with overviews) copy of a raster if one
+    has been prepared and is readable, otherwise return raster_path.
+    """
+    cog_path = get_cog_path(raster_path)
+    if os.path.exists(cog_path) and os.access(cog_path, os.R_OK):
+        logger.debug(f"Using cloud-optimized raster {cog_path} in place of {raster_path}")
+        return cog_path
+    return raster_path
+
+
+def get_raster_path(data_path: str, layer: str, year: int) -> str:
+    """
+    Get the path of a CDL or NLCD raster, in its native CRS if present, otherwise the WGS84 copy made by
+    earlier versions of bin/download-data.sh. Zonal statistics reproject zones into the CRS of the raster.
+    :param data_path: Directory containing data downloaded/extracted from bin/download-data.sh
+    :param layer: 'cdl' or 'nlcd'
+    :param year: Year of raster, which must be in DATA_BASENAMES[layer]
+    :return: Path of raster, or its cloud-optimized copy (see prefer_cog); the path in the native
+        layout if the raster exists in neither
+    """
+    native_path = prefer_cog(os.path.join(data_path, NATIVE_DATA_BASENAMES[layer][year]))
+    if not os.path.exists(native_path):
+        wgs84_path = prefer_cog(os.path.join(data_path, DATA_BASENAMES[layer][year]))
+        if os.path.exists(wgs84_path):
+            return wgs84_path
+    return native_path
+
+
 def verify_raw_data(data_path: str,
                     nlcd_year=DEFAULT_NLCD_YEAR,
                     cdl_year=DEFAULT_CDL_YEAR) -> (bool, dict):
+    """
+    Verify that the datasets downloaded by bin/download-data.sh exist and are readable. Rasters may be
+    in their native CRS or in WGS84, see get_raster_path.
+    :param data_path: Directory containing data downloaded/extracted from bin/download-data.sh
+    :param nlcd_year: Year, or list of years, of NLCD data
+    :param cdl_year: Year, or list of years, of CDL data
+    :return: Tuple consisting of: True if all datasets are OK, and dict with 'errors' and 'paths'.
+        paths['nlcd'] and paths['cdl'] are (year, path) tuples for the first year; paths['nlcd_years']
+        and paths['cdl_years'] are lists of (year, path) tuples for all years.
+    """
     errors = []
     data_ok = True
 
-    if nlcd_year not in DATA_BASENAMES['nlcd']:
-        data_ok = False
-        errors.append(f"No NLCD data for year {nlcd_year}.")
-        return data_ok, {'errors': errors, 'paths': {}}
+    nlcd_years = list(nlcd_year) if isinstance(nlcd_year, (list, tuple)) else [nlcd_year]
+    cdl_years = list(cdl_year) if isinstance(cdl_year, (list, tuple)) else [cdl_year]
 
-    if cdl_year not in DATA_BASENAMES['cdl']:
-        data_ok = False
-        errors.append(f"No CropScape Cropland Data Layer data for year {cdl_year}.")
-        return data_ok, {'errors': errors, 'paths': {}}
+    for year in nlcd_years:
+        if year not in DATA_BASENAMES['nlcd']:
+            data_ok = False
+            errors.append(f"No NLCD data for year {year}.")
+            return data_ok, {'errors': errors, 'paths': {}}
+
+    for year in cdl_years:
+        if year not in DATA_BASENAMES['cdl']:
+            data_ok = False
+            errors.append(f"No CropScape Cropland Data Layer data for year {year}.")
+            return data_ok, {'errors': errors, 'paths': {}}
 
     # Verify water boundary dataset
     wbd_path = os.path.join(data_path, DATA_BASENAMES['wbd'])
@@ -106,24 +167,34 @@ def verify_raw_data(data_path: str,
     elif not os.access(flowline_path, os.R_OK):
         data_ok = False
         errors.append(f"NHD Flowline dataset {flowline_path} is not readable.")
-
-    # Verify NLCD dataset
-    nlcd_path = os.path.join(data_path, DATA_BASENAMES['nlcd'][nlcd_year])
-    if not os.path.exists(nlcd_path):
-        data_ok = False
-        errors.append(f"NLCD dataset {nlcd_path} does not exist.")
-    elif not os.access(nlcd_path, os.R_OK):
-        data_ok = False
-        errors.append(f"NLCD dataset {nlcd_path} is not readable.")
-
-    # Verify CropScape Cropland Data Layer (CDL) dataset
-    cdl_path = os.path.join(data_path, DATA_BASENAMES['cdl'][cdl_year])
-    if not os.path.exists(cdl_path):
-        data_ok = False
-        errors.append(f"CropScape Cropland Data Layer dataset {cdl_path} does not exist.")
-    elif not os.access(cdl_path, os.R_OK):
-        data_ok = False
-        errors.append(f"CropScape Cropland Data Layer dataset {cdl_path} is not readable.")
+    elif not has_spatial_index(get_connection(flowline_path, spatialite=False)):
+        logger.warning(f"NHD Flowline dataset {flowline_path} has no spatial index ({FLOWLINE_SPATIAL_INDEX}), "
+                       "so stream characteristics will be slow to query. Create it by running the CreateSpatialIndex "
+                       "command from bin/download-data.sh.")
+
+    # Verify NLCD datasets
+    nlcd_paths = []
+    for year in nlcd_years:
+        nlcd_path = get_raster_path(data_path, 'nlcd', year)
+        if not os.path.exists(nlcd_path):
+            data_ok = False
+            errors.append(f"NLCD dataset {nlcd_path} does not exist.")
+        elif not os.access(nlcd_path, os.R_OK):
+            data_ok = False
+            errors.append(f"NLCD dataset {nlcd_path} is not readable.")
+        nlcd_paths.append((year, nlcd_path))
+
+    # Verify CropScape Cropland Data Layer (CDL) datasets
+    cdl_paths = []
+    for year in cdl_years:
+        cdl_path = get_raster_path(data_path, 'cdl', year)
+        if not os.path.exists(cdl_path):
+            data_ok = False
+            errors.append(f"CropScape Cropland Data Layer dataset {cdl_path} does not exist.")
+        elif not os.access(cdl_path, os.R_OK):
+            data_ok = False
+            errors.append(f"CropScape Cropland Data Layer dataset {cdl_path} is not readable.")
+        cdl_paths.append((year, cdl_path))
 
     # Verify National Map/TIGER counties dataset
     counties_path = os.path.join(data_path, DATA_BASENAMES['counties'])
@@ -135,7 +206,7 @@ def verify_raw_data(data_path: str,
         errors.append(f"Counties dataset {counties_path} is not readable.")
 
     # Verify USGS groundwater recharge dataset
-    rech48grd_path = os.path.join(data_path, DATA_BASENAMES['rech48grd'])
+    rech48grd_path = prefer_cog(os.path.join(data_path, DATA_BASENAMES['rech48grd']))
     if not os.path.exists(rech48grd_path):
         data_ok = False
         errors.append(f"USGS groundwater recharge dataset {rech48grd_path} does not exist.")
@@ -146,8 +217,10 @@ def verify_raw_data(data_path: str,
     paths = {'wbd': wbd_path,
              'flowline': flowline_path,
              'counties': counties_path,
-             'nlcd': (nlcd_year, nlcd_path),
-             'cdl': (cdl_year, cdl_path),
+             'nlcd': nlcd_paths[0],
+             'cdl': cdl_paths[0],
+             'nlcd_years': nlcd_paths,
+             'cdl_years': cdl_paths,
              'recharge': rech48grd_path}
 
     return data_ok, {'errors': errors, 'paths': paths}
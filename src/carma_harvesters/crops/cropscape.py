@@ -2,10 +2,15 @@
 # All rights reserved. Licensed under the GPLv3 License. See LICENSE.txt in the project root for license information.
 
 from collections import OrderedDict
-from typing import Tuple
+from typing import Tuple, List
 import logging
 
-import rasterstats
+import numpy as np
+
+from .. zonal import get_zone_geometry, cached_zone_histogram, NUM_CATEGORICAL_CLASSES
+from .. zonal.datasets import get_dataset
+from .. zonal.overview import select_overview, proportion_standard_error
+from .. zonal.batch import batch_categorical_histograms
 
 logger = logging.getLogger(__name__)
 
@@ -158,21 +163,25 @@ def is_crop(dn: int) -> bool:
     return False
 
 
-def calculate_geography_crop_area(zone_features: dict,
-                                  cdl_raster_path: str,
-                                  geography_area: float) -> Tuple[float, dict]:
-    stats = rasterstats.zonal_stats(zone_features,
-                                    cdl_raster_path,
-                                    categorical=True)[0]
-    total_pixels = sum(stats.values())
+# Lookup tables indexed by CDL raster value (0-255)
+CDL_CROP_LUT = np.array([is_crop(dn) for dn in range(NUM_CATEGORICAL_CLASSES)], dtype=bool)
+CDL_NAMED_LUT = np.array([dn in CDL_RASTER_VALUE_TO_NAME for dn in range(NUM_CATEGORICAL_CLASSES)], dtype=bool)
+
+
+def crop_areas_from_histogram(histogram: np.ndarray, geography_area: float) -> Tuple[float, dict]:
+    """
+    Convert a CDL histogram for a geography into crop areas.
+    :param histogram: Array of length 256 of pixel counts (or summed coverage fractions, see
+        zonal.zone_weights) indexed by CDL raster value
+    :param geography_area: Area of the geography
+    :return: Tuple consisting of: total crop area, and dict mapping CDL class name to area
+    """
+    total_pixels = histogram.sum().item()
     crop_areas = OrderedDict()
     if total_pixels > 0:
-        crop_pixels = 0.0
-        for k in stats.keys():
-            if is_crop(k):
-                crop_pixels += stats[k]
-            if k in CDL_RASTER_VALUE_TO_NAME:
-                crop_areas[CDL_RASTER_VALUE_TO_NAME[k]] = (stats[k] / total_pixels) * geography_area
+        crop_pixels = histogram[CDL_CROP_LUT].sum().item()
+        for dn in np.flatnonzero(histogram * CDL_NAMED_LUT).tolist():
+            crop_areas[CDL_RASTER_VALUE_TO_NAME[dn]] = (histogram[dn].item() / total_pixels) * geography_area
         total_crop_area = (crop_pixels / total_pixels) * geography_area
     else:
         # No crops
@@ -180,3 +189,47 @@ def calculate_geography_crop_area(zone_features: dict,
         total_crop_area = 0.0
 
     return total_crop_area, crop_areas
+
+
+def crop_area_standard_error(histogram: np.ndarray, geography_area: float, factor: int) -> float:
+    """
+    Estimate the standard error of the total crop area of a geography computed from a raster overview.
+    :param histogram: CDL histogram of the geography, computed from an overview
+    :param geography_area: Area of the geography
+    :param factor: Decimation factor of the overview, see zonal.overview.select_overview
+    :return: Standard error of total crop area; 0.0 at full resolution
+    """
+    return geography_area * proportion_standard_error(histogram[CDL_CROP_LUT].sum().item(),
+                                                      histogram.sum().item(), factor)
+
+
+def calculate_geography_crop_area(zone_features: dict,
+                                  cdl_raster_path: str,
+                                  geography_area: float,
+                                  zonal_resolution: int = 1) -> Tuple[float, dict]:
+    """
+    :param zonal_resolution: Compute crop areas from an overview up to this many times coarser than
+        full resolution, see zonal.overview.select_overview
+    """
+    level, _ = select_overview(cdl_raster_path, zonal_resolution)
+    histogram = cached_zone_histogram(cdl_raster_path, get_zone_geometry(zone_features), overview_level=level)
+    return crop_areas_from_histogram(histogram, geography_area)
+
+
+def calculate_geography_crop_area_batch(zone_features: list,
+                                        cdl_raster_path: str,
+                                        geography_areas: List[float],
+                                        show_progress: bool = False) -> List[Tuple[float, dict]]:
+    """
+    Calculate crop areas for many geographies at once. Equivalent to calling
+    calculate_geography_crop_area for each geography, but raster windows shared by
+    neighboring geographies are only read once.
+    :param zone_features: List of geographies
+    :param cdl_raster_path: Path of CDL raster
+    :param geography_areas: Area of each geography
+    :param show_progress: Display a progress bar
+    :return: List of tuples consisting of: total crop area, and dict mapping CDL class name to area
+    """
+    histograms = batch_categorical_histograms(zone_features, get_dataset(cdl_raster_path),
+                                              show_progress=show_progress)
+    return [crop_areas_from_histogram(h, a) for h, a in zip(histograms, geography_areas)]
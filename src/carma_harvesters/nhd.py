@@ -1,96 +1,432 @@
 # Copyright (C) 2021-present University of Louisiana at Lafayette.
 # All rights reserved. Licensed under the GPLv3 License. See LICENSE.txt in the project root for license information.
 
+from urllib.request import pathname2url
+import os
 import sqlite3
 import json
 import logging
+import threading
+import warnings
+from collections import OrderedDict
+from typing import Tuple, List, Optional, Callable, Dict
 
+import numpy as np
+from shapely import wkb
+from shapely.geometry import shape
+from shapely.prepared import prep
+from shapely.strtree import STRtree
+
+from . cache import memoize_many, geometry_hash
+
+
+# Size of the page cache, and of the memory map, of each pooled SQLite (e.g. NHD flowline) connection, in megabytes
+SQLITE_CACHE_MB_ENV = 'CARMA_SQLITE_CACHE_MB'
+DEFAULT_SQLITE_CACHE_MB = 256
+SQLITE_MMAP_MB_ENV = 'CARMA_SQLITE_MMAP_MB'
+DEFAULT_SQLITE_MMAP_MB = 2048
+# Number of prepared statements kept by each pooled connection
+CACHED_STATEMENTS = 64
+
+# R*Tree spatial index of flowline geometries, as created by SpatiaLite's CreateSpatialIndex
+# (see bin/download-data.sh)
+FLOWLINE_SPATIAL_INDEX = 'idx_nhdflowline_network_shape'
+FLOWLINE_INTERSECTS = 'ST_Intersects(GeomFromGeoJSON(?), shape)'
+# Flowlines whose bounding boxes in the spatial index intersect a bounding box, given as (east, west, north, south)
+FLOWLINE_BBOX_FILTER = (f"rowid in (select pkid from {FLOWLINE_SPATIAL_INDEX} "
+                        "where xmin <= ? and xmax >= ? and ymin <= ? and ymax >= ?)")
+# Flowlines whose bounding boxes intersect a bounding box, given as (west, south, east, north), without spatial index
+FLOWLINE_MBR_FILTER = 'MbrIntersects(shape, BuildMbr(?, ?, ?, ?))'
+FLOWLINE_INDEX_QUERY = 'select AsBinary(shape), streamorde, streamleve, qe_ma from nhdflowline_network where '
+# Lengths of HUC12 and HUC8 codes; HUC8 codes are the first digits of the codes of their HUC12s
+HUC12_CODE_LENGTH = 12
+HUC8_CODE_LENGTH = 8
+# Number of in-memory flowline indexes (e.g. of the HUC8s in play) kept per process
+FLOWLINE_INDEX_CACHE_SIZE = 4
+STREAM_CHARACTERISTICS_QUERY = 'select max(streamorde), min(streamleve), max(qe_ma) from nhdflowline_network where '
 
 logger = logging.getLogger(__name__)
 
+_connections = {}
+_connections_pid = None
+# Whether the database of each pooled connection has a spatial index, by connection and index table
+_spatial_indexes = {}
 
-def get_huc12_mean_annual_flow(huc12_flowline_db: str):
-    flowline_conn = sqlite3.connect(huc12_flowline_db)
-    flowline = flowline_conn.cursor()
 
-    query = 'select max(qe_ma) from nhdflowline_network'
-    flowline.execute(query)
-    r = flowline.fetchone()
-    if r is None:
-        return None
-    return r[0]
+def get_connection(db_path: str, spatialite: bool = True) -> sqlite3.Connection:
+    """
+    Get a connection to a SQLite database (e.g. the NHD flowline SpatiaLite database) from the per-process
+    connection pool, opening it if needed. Databases are opened read-only and immutable, since they do not
+    change while harvesting, with a memory map and a page cache (see CARMA_SQLITE_MMAP_MB and
+    CARMA_SQLITE_CACHE_MB), and with the SpatiaLite extension loaded once. Statements are prepared once per
+    connection and reused for queries with the same SQL. Each thread gets its own connections, like
+    zonal.datasets.get_dataset.
+    :param db_path: Path of SQLite database
+    :param spatialite: Load the SpatiaLite extension
+    :return: Connection, which stays open until close_connections is called or the process exits
+    """
+    global _connections_pid
+    pid = os.getpid()
+    if _connections_pid != pid:
+        # Connections inherited from the parent process must not be used by a child;
+        # forget them without closing them
+        _connections.clear()
+        _spatial_indexes.clear()
+        _connections_pid = pid
+    key = (threading.get_ident(), os.path.abspath(db_path), spatialite)
+    conn = _connections.get(key)
+    if conn is None:
+        logger.debug(f"Opening SQLite database {db_path} in process {pid}")
+        conn = sqlite3.connect(f"file:{pathname2url(os.path.abspath(db_path))}?mode=ro&immutable=1", uri=True,
+                               cached_statements=CACHED_STATEMENTS)
+        cache_mb = int(os.environ.get(SQLITE_CACHE_MB_ENV, DEFAULT_SQLITE_CACHE_MB))
+        mmap_mb = int(os.environ.get(SQLITE_MMAP_MB_ENV, DEFAULT_SQLITE_MMAP_MB))
+        # Negative cache sizes are in KiB rather than pages
+        conn.execute(f"PRAGMA cache_size = {-cache_mb * 1024}")
+        conn.execute(f"PRAGMA mmap_size = {mmap_mb * 1024 * 1024}")
+        if spatialite:
+            # Enable Spatialite extension (so that we can do spatial queries)
+            conn.enable_load_extension(True)
+            conn.execute('SELECT load_extension("mod_spatialite")')
+            conn.enable_load_extension(False)
+        _connections[key] = conn
+    return conn
 
 
-def get_huc12_max_stream_order(huc12_flowline_db: str):
-    flowline_conn = sqlite3.connect(huc12_flowline_db)
-    flowline = flowline_conn.cursor()
+def close_connections():
+    """
+    Close all connections opened by this process.
+    """
+    if _connections_pid == os.getpid():
+        for conn in _connections.values():
+            conn.close()
+    _connections.clear()
+    _spatial_indexes.clear()
 
-    query = 'select max(streamorde) from nhdflowline_network'
-    flowline.execute(query)
-    r = flowline.fetchone()
-    if r is None:
-        return None
-    return r[0]
 
+def has_spatial_index(conn: sqlite3.Connection, index_table: str = FLOWLINE_SPATIAL_INDEX) -> bool:
+    """
+    Check once per connection (databases are immutable while pooled, see get_connection) whether its database
+    has an R*Tree spatial index.
+    :return: True if the database of conn has the R*Tree spatial index index_table (e.g. of flowline geometries)
+    """
+    key = (conn, index_table)
+    if key not in _spatial_indexes:
+        _spatial_indexes[key] = conn.execute("select count(*) from sqlite_master where type = 'table' and name = ?",
+                                             (index_table,)).fetchone()[0] > 0
+    return _spatial_indexes[key]
 
-def get_huc12_min_stream_level(huc12_flowline_db: str):
-    flowline_conn = sqlite3.connect(huc12_flowline_db)
-    flowline = flowline_conn.cursor()
 
-    query = 'select min(streamleve) from nhdflowline_network'
-    flowline.execute(query)
-    r = flowline.fetchone()
+def flowline_filter(conn: sqlite3.Connection, geometry: dict) -> Tuple[str, tuple]:
+    """
+    Make the where clause of a query of the flowlines intersecting a geometry. If the flowline database has
+    a spatial index, flowlines are first selected by bounding box through the R*Tree, so that only those
+    near the geometry are tested for intersection, rather than every flowline in the nation.
+    :param conn: Connection to NHD flowline database, see get_connection
+    :param geometry: A Python object that represents a GeoJSON geometry
+    :return: Tuple consisting of: where clause, and its parameters
+    """
+    geometry_str = json.dumps(geometry)
+    if not has_spatial_index(conn):
+        return FLOWLINE_INTERSECTS, (geometry_str,)
+    west, south, east, north = shape(geometry).bounds
+    return f"{FLOWLINE_BBOX_FILTER} and {FLOWLINE_INTERSECTS}", (east, west, north, south, geometry_str)
+
+
+def flowline_bbox_filter(conn: sqlite3.Connection, bounds: tuple) -> Tuple[str, tuple]:
+    """
+    Make the where clause of a query of the flowlines whose bounding boxes intersect a bounding box,
+    through the R*Tree if the flowline database has a spatial index.
+    :param conn: Connection to NHD flowline database, see get_connection
+    :param bounds: Tuple of (west, south, east, north)
+    :return: Tuple consisting of: where clause, and its parameters
+    """
+    west, south, east, north = bounds
+    if has_spatial_index(conn):
+        return FLOWLINE_BBOX_FILTER, (east, west, north, south)
+    return FLOWLINE_MBR_FILTER, (west, south, east, north)
+
+
+class GeometryTree:
+    """
+    STRtree of geometries whose queries return the items (e.g. indices in a larger list of geometries) of
+    matching geometries. Only the parts of the STRtree API common to shapely 1.7 to 2.0 are used: queries
+    return geometries (mapped back to items by identity) before 2.0, and positions of geometries since.
+    """
+    def __init__(self, geometries: List, items: List[int]):
+        self.items = list(items)
+        with warnings.catch_warnings():
+            # Shapely 1.8 warns of changes in 2.0 on every STRtree, including those that do not affect this API
+            warnings.filterwarnings('ignore', message='STRtree will be changed in 2.0.0')
+            self.tree = STRtree(geometries)
+        self._positions = {id(g): i for i, g in enumerate(geometries)}
+
+    def item(self, result) -> int:
+        """
+        :param result: Geometry, or position of geometry, returned by an STRtree query
+        :return: Item of geometry
+        """
+        position = result if isinstance(result, (int, np.integer)) else self._positions[id(result)]
+        return self.items[position]
+
+    def query(self, geometry) -> List[int]:
+        """
+        :param geometry: Shapely geometry
+        :return: Items of geometries whose bounding boxes intersect that of geometry
+        """
+        return [self.item(result) for result in self.tree.query(geometry)]
+
+    def nearest(self, geometry) -> Optional[int]:
+        """
+        :param geometry: Shapely geometry
+        :return: Item of the geometry nearest to geometry, or None if the tree is empty
+        """
+        result = self.tree.nearest(geometry)
+        return self.item(result) if result is not None else None
+
+
+class FlowlineIndex:
+    """
+    In-memory index of NHD flowlines (e.g. those of the HUC8s in play while generating sub-HUC12s): an STRtree
+    of flowline geometries, with their stream order, stream level and mean annual flow alongside as arrays,
+    so that stream characteristics of geometries are computed without querying the flowline database.
+    """
+    def __init__(self, geometries: List, stream_order: np.ndarray, stream_level: np.ndarray,
+                 mean_annual_flow: np.ndarray):
+        self.geometries = geometries
+        self.stream_order = np.asarray(stream_order, dtype=np.float64)
+        self.stream_level = np.asarray(stream_level, dtype=np.float64)
+        self.mean_annual_flow = np.asarray(mean_annual_flow, dtype=np.float64)
+        self.tree = GeometryTree(geometries, range(len(geometries)))
+
+    @classmethod
+    def load(cls, flowline_db: str, bounds: tuple):
+        """
+        Load the flowlines whose bounding boxes intersect a bounding box.
+        :param flowline_db: File path to NHDFlowline Spatialite database
+        :param bounds: Tuple of (west, south, east, north)
+        :return: FlowlineIndex
+        """
+        conn = get_connection(flowline_db)
+        where, params = flowline_bbox_filter(conn, bounds)
+        rows = conn.execute(FLOWLINE_INDEX_QUERY + where, params).fetchall()
+        logger.debug(f"Loaded {len(rows)} flowlines within {bounds} from {flowline_db}")
+        # Missing (null) attributes become NaN, and are ignored by aggregates like in SQL
+        return cls([wkb.loads(bytes(r[0])) for r in rows],
+                   np.array([r[1] for r in rows], dtype=np.float64),
+                   np.array([r[2] for r in rows], dtype=np.float64),
+                   np.array([r[3] for r in rows], dtype=np.float64))
+
+    def __len__(self):
+        return len(self.geometries)
+
+    def intersecting(self, geometry: dict) -> np.ndarray:
+        """
+        :param geometry: A Python object that represents a GeoJSON geometry
+        :return: Array of indices of flowlines intersecting geometry
+        """
+        geometry_shape = shape(geometry)
+        candidates = self.tree.query(geometry_shape)
+        if not candidates:
+            return np.zeros(0, dtype=np.int64)
+        prepared = prep(geometry_shape)
+        return np.array(sorted(i for i in candidates if prepared.intersects(self.geometries[i])), dtype=np.int64)
+
+    def aggregate(self, indices: np.ndarray) -> Tuple[float, float, float]:
+        """
+        :param indices: Array of indices of flowlines
+        :return: Tuple consisting of: max(stream order), min(stream level), and max(mean annual streamflow)
+            of flowlines, each None if unknown for all of them
+        """
+        if len(indices) == 0:
+            return None, None, None
+        return (_nan_aggregate(np.fmax.reduce, self.stream_order[indices]),
+                _nan_aggregate(np.fmin.reduce, self.stream_level[indices]),
+                _nan_aggregate(np.fmax.reduce, self.mean_annual_flow[indices]))
+
+    def nearest(self, geometries: List[dict], indices: np.ndarray) -> List[Optional[int]]:
+        """
+        Find the flowline nearest to each of several geometries among some flowlines (e.g. those intersecting
+        the HUC12 containing the geometries), with a nearest-neighbor search of an STRtree of these flowlines,
+        which is built once for all geometries.
+        :param geometries: Python objects that represent GeoJSON geometries
+        :param indices: Array of indices of flowlines to search
+        :return: List of index of the flowline nearest to each geometry, or None if indices is empty
+        """
+        if len(indices) == 0:
+            return [None] * len(geometries)
+        tree = GeometryTree([self.geometries[i] for i in indices], indices.tolist())
+        return [tree.nearest(shape(geometry)) for geometry in geometries]
+
+    def nearest_stream_characteristics(self, geometries: List[dict],
+                                       huc_geometry: dict) -> List[Tuple[float, float, float]]:
+        """
+        Get the stream characteristics of the flowline in a HUC12 nearest to each of several geometries
+        (e.g. sub-HUC12s without flowlines).
+        :param geometries: Python objects that represent GeoJSON geometries
+        :param huc_geometry: A Python object that represents the GeoJSON HUC12 geometry
+        :return: List of tuple consisting of: stream order, stream level, and mean annual streamflow
+        """
+        characteristics = []
+        for nearest in self.nearest(geometries, self.intersecting(huc_geometry)):
+            nearest_characteristics = self.aggregate(np.array([nearest] if nearest is not None else [], dtype=int))
+            if not nearest_characteristics[0]:
+                logger.warning("No stream flowline found in or near sub-HUC12 boundary. This should never happen.")
+                nearest_characteristics = (0.0, 0.0, 0.0)
+            characteristics.append(nearest_characteristics)
+        return characteristics
+
+    def stream_characteristics(self, geometries: List[dict],
+                               huc_geometry: dict = None) -> List[Tuple[float, float, float]]:
+        """
+        Compute stream characteristics of several geometries, like get_geographies_stream_characteristics.
+        :param geometries: Python objects that represent GeoJSON geometries
+        :param huc_geometry: A Python object that represents the GeoJSON HUC12 geometry containing geometries
+        :return: List of tuple consisting of: max(stream order), min(stream level), and max(mean annual streamflow)
+        """
+        characteristics = [self.aggregate(self.intersecting(geometry)) for geometry in geometries]
+        return _fill_stream_less(characteristics, geometries, huc_geometry, lambda: self)
+
+
+def _fill_stream_less(characteristics: List[tuple], geometries: List[dict], huc_geometry: dict,
+                      get_index: Callable) -> List[tuple]:
+    # Use stream stats from the flowline inside of the HUC12 nearest to each geometry without flowlines,
+    # with a single nearest-neighbor search for all of them
+    stream_less = [i for i, c in enumerate(characteristics) if not c[0]]
+    characteristics = [c if c[0] else (0.0, 0.0, 0.0) for c in characteristics]
+    if stream_less and huc_geometry:
+        logger.debug(f"No stream flowline found in {len(stream_less)} sub-HUC12 boundaries, "
+                     "looking for nearest flowlines in the HUC12...")
+        nearest = get_index().nearest_stream_characteristics([geometries[i] for i in stream_less], huc_geometry)
+        for i, nearest_characteristics in zip(stream_less, nearest):
+            characteristics[i] = nearest_characteristics
+    return characteristics
+
+
+def _nan_aggregate(reduce, values: np.ndarray):
+    # fmax and fmin ignore NaNs unless all values are NaN
+    value = reduce(values).item()
+    return None if value != value else value
+
+
+def huc8_code(huc12_id: str) -> str:
+    """
+    :param huc12_id: Id of a HUC12, as a geoconnex URI (e.g. https://geoconnex.us/usgs/hydrologic-unit/080801030109)
+        or as a 12-digit code
+    :return: 8-digit code of the HUC8 containing the HUC12
+    """
+    return huc12_id[-HUC12_CODE_LENGTH:][:HUC8_CODE_LENGTH]
+
+
+def huc8_bounds(huc12s: List[dict]) -> Dict[str, tuple]:
+    """
+    Compute the extent of each HUC8 in play, i.e. of the HUC12s it contains, e.g. to load its flowlines
+    with get_flowline_index.
+    :param huc12s: CARMA HUC12 entities
+    :return: Dict mapping HUC8 code to tuple of (west, south, east, north)
+    """
+    extents = {}
+    for huc in huc12s:
+        west, south, east, north = shape(huc['geometry']).bounds
+        huc8 = huc8_code(huc['id'])
+        if huc8 in extents:
+            w, s, e, n = extents[huc8]
+            west, south, east, north = min(west, w), min(south, s), max(east, e), max(north, n)
+        extents[huc8] = (west, south, east, north)
+    return extents
+
+
+_flowline_indexes = OrderedDict()
+
+
+def get_flowline_index(flowline_db: str, bounds: tuple) -> FlowlineIndex:
+    """
+    Get the in-memory index of the flowlines within a bounding box (e.g. of a HUC8), loading it once per process.
+    The FLOWLINE_INDEX_CACHE_SIZE most recently used indexes are kept.
+    :param flowline_db: File path to NHDFlowline Spatialite database
+    :param bounds: Tuple of (west, south, east, north)
+    :return: FlowlineIndex
+    """
+    key = (os.path.abspath(flowline_db), tuple(bounds))
+    index = _flowline_indexes.pop(key, None)
+    if index is None:
+        index = FlowlineIndex.load(flowline_db, bounds)
+    _flowline_indexes[key] = index
+    while len(_flowline_indexes) > FLOWLINE_INDEX_CACHE_SIZE:
+        _flowline_indexes.popitem(last=False)
+    return index
+
+
+def _huc12_flowline_aggregate(huc12_flowline_db: str, query: str):
+    r = get_connection(huc12_flowline_db, spatialite=False).execute(query).fetchone()
     if r is None:
         return None
     return r[0]
 
 
-def get_geography_stream_characteristics(geometry: dict, flowline_db: str,
-                                         huc_geometry_str: str=None) -> (float, float, float):
+def get_huc12_mean_annual_flow(huc12_flowline_db: str):
+    return _huc12_flowline_aggregate(huc12_flowline_db, 'select max(qe_ma) from nhdflowline_network')
+
+
+def get_huc12_max_stream_order(huc12_flowline_db: str):
+    return _huc12_flowline_aggregate(huc12_flowline_db, 'select max(streamorde) from nhdflowline_network')
+
+
+def get_huc12_min_stream_level(huc12_flowline_db: str):
+    return _huc12_flowline_aggregate(huc12_flowline_db, 'select min(streamleve) from nhdflowline_network')
+
+
+def get_geography_stream_characteristics(geometry: dict, flowline_db: str, huc_geometry_str: str=None,
+                                         flowline_index: FlowlineIndex = None) -> (float, float, float):
     """
     Query NHD flowlines that intersect a geometry, returning the following attributes:
-    max(stream order), min(stream level), and max(mean annual streamflow).
+    max(stream order), min(stream level), and max(mean annual streamflow). Results are
+    looked up in, and added to, the derived attribute cache.
     :param geometry: A Python object that represents a GeoJSON geometry
     :param flowline_db: File path to NHDFlowline Spatialite database
     :param huc_geometry_str: A string that represents a GeoJSON HUC12 geometry
+    :param flowline_index: Optional in-memory index of the flowlines around geometry (and the HUC12),
+        see get_flowline_index, used instead of querying flowline_db
     :return: Tuple consisting of: max(stream order), min(stream level), and max(mean annual streamflow)
     """
-    max_stream_order = 0.0
-    min_stream_level = 0.0
-    max_mean_ann_flow = 0.0
+    return get_geographies_stream_characteristics([geometry], flowline_db, huc_geometry_str, flowline_index)[0]
 
-    conn = sqlite3.connect(flowline_db)
-    # Enable Spatialite extension (so that we can do spatial queries)
-    conn.enable_load_extension(True)
-    conn.execute('SELECT load_extension("mod_spatialite")')
-    conn.enable_load_extension(False)
-    cur = conn.cursor()
 
-    # Query NHD Flowlines that intersect with the county geometry
-    geometry_str = json.dumps(geometry)
-    cur.execute(
-        "select max(streamorde), min(streamleve), max(qe_ma) from nhdflowline_network where ST_Intersects(GeomFromGeoJSON(?), shape)",
-        (geometry_str,))
-    record = cur.fetchone()
-    if record[0]:
-        max_stream_order, min_stream_level, max_mean_ann_flow = record
-    elif huc_geometry_str:
-        logger.debug("No stream flowline found in sub-HUC12 boundary, looking for nearest flowline in the HUC12...")
-        # No stream was found in sub-HUC12 polygon.
-        # Use stream stats from flowline inside of HUC12 nearest to the sub-HUC12 polygon.
-        # Define view of flowlines in the HUC12 boundary (can't use parameters with views so we are doing unsafe things)
-        cur.execute(f"create temporary view huc12flow as select * from nhdflowline_network where ST_Intersects(GeomFromGeoJSON('{huc_geometry_str}'), shape)")
-        # Select the flowline in the HUC12 boundary nearest to the sub-HUC12 boundary
-        cur.execute(
-            "select streamorde, streamleve, qe_ma, min(st_distance(shape, GeomFromGeoJSON(?))) from huc12flow",
-            (geometry_str,))
-        record = cur.fetchone()
-        if record[0]:
-            max_stream_order, min_stream_level, max_mean_ann_flow, _ = record
-        else:
-            logger.warning("No stream flowline found in or near sub-HUC12 boundary. This should never happen.")
+def get_geographies_stream_characteristics(geometries: List[dict], flowline_db: str, huc_geometry_str: str=None,
+                                           flowline_index: FlowlineIndex = None) -> List[Tuple[float, float, float]]:
+    """
+    Get stream characteristics of several geometries (e.g. the sub-HUC12s of a HUC12), see
+    get_geography_stream_characteristics. Geometries without flowlines get the stream characteristics of the
+    flowline in the HUC12 nearest to them, found for all of them at once.
+    :param geometries: Python objects that represent GeoJSON geometries
+    :param flowline_db: File path to NHDFlowline Spatialite database
+    :param huc_geometry_str: A string that represents a GeoJSON HUC12 geometry
+    :param flowline_index: Optional in-memory index of the flowlines around geometries (and the HUC12),
+        see get_flowline_index, used instead of querying flowline_db
+    :return: List of tuple consisting of: max(stream order), min(stream level), and max(mean annual streamflow)
+    """
+    huc_geometry = json.loads(huc_geometry_str) if huc_geometry_str else None
+    huc_geometry_key = geometry_hash(huc_geometry) if huc_geometry else None
+
+    def _compute(missing: List[dict]) -> List[tuple]:
+        if flowline_index is not None:
+            return flowline_index.stream_characteristics(missing, huc_geometry)
+        return _get_geographies_stream_characteristics(missing, flowline_db, huc_geometry)
+
+    return memoize_many('stream_characteristics', geometries, flowline_db, _compute, huc_geometry_key)
 
-    return max_stream_order, min_stream_level, max_mean_ann_flow
+
+def _get_geographies_stream_characteristics(geometries: List[dict], flowline_db: str,
+                                            huc_geometry: dict = None) -> List[Tuple[float, float, float]]:
+    conn = get_connection(flowline_db)
+    characteristics = []
+    for geometry in geometries:
+        # Query NHD Flowlines that intersect with the geometry
+        where, params = flowline_filter(conn, geometry)
+        characteristics.append(tuple(conn.execute(STREAM_CHARACTERISTICS_QUERY + where, params).fetchone()))
+    # Flowlines near the HUC12 are only loaded if some geometries have no flowlines
+    return _fill_stream_less(characteristics, geometries, huc_geometry,
+                             lambda: FlowlineIndex.load(flowline_db, shape(huc_geometry).bounds))
 
 
 def get_huc12_stream_characteristics(huc_geometry: dict, flowline_db: str) -> (float, float, float):
@@ -105,19 +441,10 @@ def get_huc12_stream_characteristics(huc_geometry: dict, flowline_db: str) -> (f
     min_stream_level = None
     max_mean_ann_flow = None
 
-    conn = sqlite3.connect(flowline_db)
-    # Enable Spatialite extension (so that we can do spatial queries)
-    conn.enable_load_extension(True)
-    conn.execute('SELECT load_extension("mod_spatialite")')
-    conn.enable_load_extension(False)
-    cur = conn.cursor()
-
     # Query NHD Flowlines that intersect with the county geometry
-    geometry_str = json.dumps(huc_geometry)
-    cur.execute(
-        "select max(streamorde), min(streamleve), max(qe_ma) from nhdflowline_network where ST_Intersects(GeomFromGeoJSON(?), shape)",
-        (geometry_str,))
-    record = cur.fetchone()
+    conn = get_connection(flowline_db)
+    where, params = flowline_filter(conn, huc_geometry)
+    record = conn.execute(STREAM_CHARACTERISTICS_QUERY + where, params).fetchone()
     if record[0]:
         max_stream_order, min_stream_level, max_mean_ann_flow = record
     else:
@@ -1,24 +1,100 @@
 # Copyright (C) 2021-present University of Louisiana at Lafayette.
 # All rights reserved. Licensed under the GPLv3 License. See LICENSE.txt in the project root for license information.
 
-from typing import Tuple
+from typing import Tuple, List, Sequence
 import logging
 
-import rasterstats
+import numpy as np
+
+from .. zonal import get_zone_geometry, cached_zone_histogram, histogram_to_counts
+from .. zonal.datasets import get_dataset
+from .. zonal.overview import select_overview, proportion_standard_error
+from .. zonal.batch import batch_categorical_histograms
 
 
 NLCD_HIGHLY_DEVELOPED_DN = 24
+# NLCD classes counted as developed area. Full NLCD histograms are kept next to CARMA documents,
+# so developed area can be recomputed for other classes (e.g. also medium intensity, 23) without
+# reading rasters again, see carma-developed-area-recompute.
+NLCD_DEVELOPED_CLASSES = (NLCD_HIGHLY_DEVELOPED_DN,)
+
+NLCD_RASTER_VALUE_TO_NAME = {
+    11: "Open Water",
+    12: "Perennial Ice/Snow",
+    21: "Developed, Open Space",
+    22: "Developed, Low Intensity",
+    23: "Developed, Medium Intensity",
+    24: "Developed, High Intensity",
+    31: "Barren Land",
+    41: "Deciduous Forest",
+    42: "Evergreen Forest",
+    43: "Mixed Forest",
+    51: "Dwarf Scrub",
+    52: "Shrub/Scrub",
+    71: "Grassland/Herbaceous",
+    72: "Sedge/Herbaceous",
+    73: "Lichens",
+    74: "Moss",
+    81: "Pasture/Hay",
+    82: "Cultivated Crops",
+    90: "Woody Wetlands",
+    95: "Emergent Herbaceous Wetlands"
+}
 
 
 logger = logging.getLogger(__name__)
 
 
-def get_percent_highly_developed_land(zone_features: dict,
-                                      nlcd_raster_path: str) -> Tuple[float, float]:
-    stats = rasterstats.zonal_stats(zone_features, nlcd_raster_path,
-                                    categorical=True)[0]
-    logger.debug(f"NLCD zonal stats: {stats}")
-    total_nlcd_cells = sum(stats.values())
-    # Should this also include NLCD medium-intensity?
-    developed_nlcd_cells = stats.get(NLCD_HIGHLY_DEVELOPED_DN, 0.0)
+def developed_cells_from_histogram(histogram: np.ndarray,
+                                   developed_classes: Sequence[int] = NLCD_DEVELOPED_CLASSES) -> Tuple[float, float]:
+    """
+    Get developed and total cell counts from an NLCD histogram.
+    :param histogram: Array of length 256 of pixel counts (or summed coverage fractions, see
+        zonal.zone_weights) indexed by NLCD raster value
+    :param developed_classes: NLCD classes counted as developed
+    :return: Tuple consisting of: number of developed cells, total number of cells
+    """
+    total_nlcd_cells = histogram.sum().item()
+    developed_nlcd_cells = histogram[list(developed_classes)].sum().item()
     return developed_nlcd_cells, total_nlcd_cells
+
+
+def developed_area_standard_error(histogram: np.ndarray, geography_area: float, factor: int) -> float:
+    """
+    Estimate the standard error of the developed area of a geography computed from a raster overview.
+    :param histogram: NLCD histogram of the geography, computed from an overview
+    :param geography_area: Area of the geography
+    :param factor: Decimation factor of the overview, see zonal.overview.select_overview
+    :return: Standard error of developed area; 0.0 at full resolution
+    """
+    return geography_area * proportion_standard_error(*developed_cells_from_histogram(histogram), factor)
+
+
+def get_percent_highly_developed_land(zone_features: dict,
+                                      nlcd_raster_path: str,
+                                      zonal_resolution: int = 1) -> Tuple[float, float]:
+    """
+    :param zonal_resolution: Count cells of an overview up to this many times coarser than
+        full resolution, see zonal.overview.select_overview
+    """
+    level, _ = select_overview(nlcd_raster_path, zonal_resolution)
+    histogram = cached_zone_histogram(nlcd_raster_path, get_zone_geometry(zone_features), overview_level=level)
+    logger.debug(f"NLCD zonal stats: {histogram_to_counts(histogram)}")
+    return developed_cells_from_histogram(histogram)
+
+
+def get_percent_highly_developed_land_batch(zone_features: list,
+                                            nlcd_raster_path: str,
+                                            show_progress: bool = False) -> List[Tuple[float, float]]:
+    """
+    Get highly developed and total cell counts for many geographies at once. Equivalent to calling
+    get_percent_highly_developed_land for each geography, but raster windows shared by
+    neighboring geographies are only read once.
+    :param zone_features: List of geographies
+    :param nlcd_raster_path: Path of NLCD raster
+    :param show_progress: Display a progress bar
+    :return: List of tuples consisting of: number of highly developed cells, total number of cells
+    """
+    histograms = batch_categorical_histograms(zone_features, get_dataset(nlcd_raster_path),
+                                              show_progress=show_progress)
+    return [developed_cells_from_histogram(h) for h in histograms]
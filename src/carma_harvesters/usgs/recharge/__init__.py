@@ -1,11 +1,58 @@
 # Copyright (C) 2021-present University of Louisiana at Lafayette.
 # All rights reserved. Licensed under the GPLv3 License. See LICENSE.txt in the project root for license information.
 
-import rasterstats
+from typing import List
+
+from ... cache import memoize_many, geometry_hash
+from ... zonal import get_zone_geometry, cached_zone_mean, cache_extra, get_zonal_backend, COVERAGE_BACKEND
+from ... zonal.datasets import get_dataset
+from ... zonal.batch import batch_continuous_stats
 
 
 def calculate_huc12_mean_recharge(zone_features: dict,
                                   recharge_raster_path: str) -> float:
-    stats = rasterstats.zonal_stats(zone_features,
-                                    recharge_raster_path)[0]
-    return stats['mean']
+    return cached_zone_mean(recharge_raster_path, get_zone_geometry(zone_features))
+
+
+def calculate_recharge_stats_batch(zone_features: list,
+                                   recharge_raster_path: str,
+                                   percentiles: List[float] = None,
+                                   show_progress: bool = False) -> List[dict]:
+    """
+    Compute groundwater recharge statistics for many non-overlapping geographies at once.
+    :param zone_features: List of geographies, each a GeoJSON-like geometry or feature, or object
+        implementing __geo_interface__
+    :param recharge_raster_path: Path of USGS groundwater recharge raster
+    :param percentiles: Optional percentiles (0-100) to compute in addition to count, sum, mean, min, and max
+    :param show_progress: Display a progress bar
+    :return: List of dicts of statistics, one for each geography, see zonal.batch.batch_continuous_stats
+    """
+    return batch_continuous_stats(zone_features, get_dataset(recharge_raster_path),
+                                  percentiles=percentiles, show_progress=show_progress)
+
+
+def calculate_huc12_mean_recharge_batch(zone_features: list,
+                                        recharge_raster_path: str,
+                                        show_progress: bool = False) -> List[float]:
+    """
+    Compute mean groundwater recharge for many non-overlapping geographies at once. Like
+    calculate_huc12_mean_recharge, means are looked up in, and added to, the derived attribute cache;
+    only those not cached are computed, together, and identical geometries are computed once.
+    With the coverage zonal backend, which batched statistics do not support, means are computed
+    one geography at a time.
+    :return: List of mean recharge of each geography, None for geographies without recharge data
+    """
+    geometries = [get_zone_geometry(z) for z in zone_features]
+    if get_zonal_backend() == COVERAGE_BACKEND:
+        return [cached_zone_mean(recharge_raster_path, g) for g in geometries]
+    # Duplicate geometries would share pixels in the batch, which assumes zones do not overlap
+    keys = [geometry_hash(g) for g in geometries]
+    unique = dict(zip(keys, geometries))
+
+    def _compute(missing: List[dict]) -> List[float]:
+        return [s['mean'] for s in calculate_recharge_stats_batch(missing, recharge_raster_path,
+                                                                  show_progress=show_progress)]
+
+    means = memoize_many('zone_mean', list(unique.values()), recharge_raster_path, _compute, *cache_extra(1, None))
+    means = dict(zip(unique.keys(), means))
+    return [means[key] for key in keys]
@@ -0,0 +1,544 @@
+# Copyright (C) 2021-present University of Louisiana at Lafayette.
+# All rights reserved. Licensed under the GPLv3 License. See LICENSE.txt in the project root for license information.
+
+import os
+import math
+from typing import List, Tuple
+import logging
+
+import numpy as np
+
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.features import geometry_mask
+from rasterio.warp import transform_geom
+from rasterio.windows import Window
+from rasterio.windows import transform as window_transform, bounds as window_bounds, intersection
+from shapely.geometry import shape, box
+from shapely.prepared import prep
+
+from . blockcache import get_block_cache
+from . maskcache import get_mask_cache
+from . datasets import get_dataset, get_thread_pool, get_num_threads
+from . tilehistograms import get_tile_histograms, TileHistograms
+from . rawraster import get_raw_raster
+from . coverage import coverage_fraction
+from .. cache import memoize, geometry_hash
+
+
+# Number of classes of uint8 categorical rasters (CDL, NLCD)
+NUM_CATEGORICAL_CLASSES = 256
+# Memory limit of the raster windows read to compute zonal statistics of one zone, in megabytes;
+# larger zones are computed in tile-aligned chunks, spread across the threads of the thread pool
+ZONAL_MAX_MB_ENV = 'CARMA_ZONAL_MAX_MB'
+DEFAULT_ZONAL_MAX_MB = 256
+# Zonal statistics backend: 'center' counts pixels whose centers fall inside a zone (like rasterstats);
+# 'coverage' weights each pixel by the exact fraction of it covered by the zone, see zonal.coverage
+ZONAL_BACKEND_ENV = 'CARMA_ZONAL_BACKEND'
+CENTER_BACKEND = 'center'
+COVERAGE_BACKEND = 'coverage'
+ZONAL_BACKENDS = (CENTER_BACKEND, COVERAGE_BACKEND)
+# CRS of CARMA geometries; zones are reprojected into the native CRS of rasters in any other CRS
+# (e.g. the Albers equal area CRS of CDL and NLCD as distributed), see dataset_zone
+GEOMETRY_CRS = CRS.from_epsg(4326)
+
+logger = logging.getLogger(__name__)
+
+
+def get_zone_geometry(zone_features) -> dict:
+    """
+    Get the GeoJSON geometry of a zone. Zones may be given in any of the forms accepted by
+    rasterstats: a GeoJSON-like geometry, feature, or feature collection (in which case
+    only the first feature is used), or an object implementing __geo_interface__.
+    :param zone_features: Zone to get the geometry of
+    :return: GeoJSON-like geometry dict
+    """
+    if hasattr(zone_features, '__geo_interface__'):
+        zone_features = zone_features.__geo_interface__
+    zone_type = zone_features.get('type')
+    if zone_type == 'FeatureCollection':
+        zone_features = zone_features['features'][0]
+        zone_type = zone_features.get('type')
+    if zone_type == 'Feature':
+        return zone_features['geometry']
+    return zone_features
+
+
+def dataset_zone(dataset, geometry: dict, bounds: tuple = None) -> Tuple[dict, tuple]:
+    """
+    Get a zone geometry, and its bounds, in the CRS of a raster. Zones are reprojected from WGS84 into
+    the CRS of rasters in another CRS, and the reprojected geometry carries a GeoJSON 'crs' member naming
+    that CRS, so that passing it to this function again (e.g. from nested zonal helpers) leaves it as is.
+    :param dataset: Open rasterio dataset
+    :param geometry: GeoJSON-like zone geometry, in WGS84 or as returned by dataset_zone for the same CRS
+    :param bounds: Bounds of geometry, computed if not provided or if geometry is reprojected
+    :return: Tuple of: geometry and its bounds, in the CRS of dataset
+    :raises ValueError: if geometry was reprojected into a different CRS
+    """
+    crs = dataset.crs
+    target = None if crs is None or crs == GEOMETRY_CRS else crs.to_string()
+    source = geometry['crs']['properties']['name'] if 'crs' in geometry else None
+    if source != target:
+        if source is not None:
+            raise ValueError(f"Zone reprojected into {source} cannot be used with {dataset.name} in {target}.")
+        geometry = dict(transform_geom(GEOMETRY_CRS, crs, geometry), crs={'type': 'name',
+                                                                         'properties': {'name': target}})
+        bounds = None
+    if bounds is None:
+        bounds = shape(geometry).bounds
+    return geometry, bounds
+
+
+def _rowcol(x: float, y: float, transform: Affine, op=math.floor) -> Tuple[int, int]:
+    r = int(op((y - transform.f) / transform.e))
+    c = int(op((x - transform.c) / transform.a))
+    return r, c
+
+
+def bounds_window(bounds: tuple, transform: Affine) -> Window:
+    """
+    Compute the raster window covering bounds, snapping outward to whole pixels in the
+    same way as rasterstats so that results are comparable.
+    :param bounds: Tuple of (west, south, east, north)
+    :param transform: Affine transform of the raster
+    :return: Window, which may extend beyond the raster extent
+    """
+    west, south, east, north = bounds
+    row_start, col_start = _rowcol(west, north, transform)
+    row_stop, col_stop = _rowcol(east, south, transform, op=math.ceil)
+    return Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+
+
+def grid_signature(window: Window, transform: Affine) -> tuple:
+    """
+    Key identifying the pixel grid of a window. Windows of rasters with identical
+    signatures can share a rasterized zone mask.
+    """
+    return tuple(window_transform(window, transform))[:6], (int(window.height), int(window.width))
+
+
+def read_window(dataset, window: Window, band: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Read a window of a band, padding any part of the window that falls outside of
+    the raster extent. Pixels are sliced from the raw raster of the dataset if one has been
+    built (see zonal.rawraster), or read through the per-process block cache, if enabled.
+    :param dataset: Open rasterio dataset
+    :param window: Window to read, which may extend beyond the raster extent
+    :param band: Band to read
+    :return: Tuple of: window data (read-only if sliced from a raw raster), and boolean array
+        that is True where data are inside the raster extent and not nodata
+    """
+    height, width = int(window.height), int(window.width)
+    row_off, col_off = int(window.row_off), int(window.col_off)
+    r0, r1 = max(row_off, 0), min(row_off + height, dataset.height)
+    c0, c1 = max(col_off, 0), min(col_off + width, dataset.width)
+    raw = get_raw_raster(dataset.name) if band == 1 else None
+    if raw is not None and not raw.matches(dataset):
+        raw = None
+
+    if raw is not None and (r0, r1, c0, c1) == (row_off, row_off + height, col_off, col_off + width):
+        # Windows inside the raster extent are views of the memory-mapped raw raster
+        data = raw.data[r0:r1, c0:c1]
+        valid = np.ones((height, width), dtype=bool)
+    else:
+        data = np.zeros((height, width), dtype=dataset.dtypes[band - 1])
+        valid = np.zeros((height, width), dtype=bool)
+        if r0 < r1 and c0 < c1:
+            dest = (slice(r0 - row_off, r1 - row_off), slice(c0 - col_off, c1 - col_off))
+            inner = Window(c0, r0, c1 - c0, r1 - r0)
+            block_cache = get_block_cache()
+            if raw is not None:
+                data[dest] = raw.data[r0:r1, c0:c1]
+            elif block_cache is not None:
+                data[dest] = block_cache.read(dataset, inner, band)
+            else:
+                data[dest] = dataset.read(band, window=inner)
+            valid[dest] = True
+
+    nodata = dataset.nodatavals[band - 1]
+    if nodata is not None:
+        if np.isnan(nodata):
+            valid &= ~np.isnan(data)
+        else:
+            valid &= data != nodata
+    elif np.issubdtype(data.dtype, np.floating):
+        valid &= ~np.isnan(data)
+    return data, valid
+
+
+def rasterize_zone(geometry: dict, shape: tuple, transform: Affine, all_touched=False) -> np.ndarray:
+    """
+    Rasterize a zone geometry onto a pixel grid.
+    :return: Boolean array that is True for pixels inside the zone
+    """
+    return geometry_mask([geometry], out_shape=shape, transform=transform,
+                         all_touched=all_touched, invert=True)
+
+
+def zone_mask(geometry: dict, window: Window, transform: Affine, masks: dict = None,
+              geometry_key: str = None) -> np.ndarray:
+    """
+    Get the mask of a zone on the pixel grid of a raster window, rasterizing it if it is not
+    in masks or in the mask cache.
+    :param geometry: GeoJSON-like zone geometry
+    :param window: Raster window
+    :param transform: Affine transform of the raster
+    :param masks: Optional dict of zone masks by grid signature; masks rasterized for
+        this call are added so that later calls on the same grid can reuse them
+    :param geometry_key: Hash of geometry (see cache.geometry_hash), computed if needed and not provided
+    :return: Boolean array that is True for pixels whose centers fall inside the zone
+    """
+    key = grid_signature(window, transform)
+    mask = masks.get(key) if masks is not None else None
+    if mask is None:
+        # Masks are also shared between calls (e.g. for other layers and years) through the mask cache
+        mask_cache = get_mask_cache()
+        if mask_cache is not None:
+            if geometry_key is None:
+                geometry_key = geometry_hash(geometry)
+            mask = mask_cache.get(geometry_key, key)
+        if mask is None:
+            mask = rasterize_zone(geometry, key[1], window_transform(window, transform))
+            if mask_cache is not None:
+                mask_cache.put(geometry_key, key, mask)
+        if masks is not None:
+            masks[key] = mask
+    return mask
+
+
+def get_zonal_backend() -> str:
+    """
+    :return: Zonal statistics backend, read from the CARMA_ZONAL_BACKEND environment variable,
+        see ZONAL_BACKENDS
+    """
+    backend = os.environ.get(ZONAL_BACKEND_ENV, CENTER_BACKEND)
+    if backend not in ZONAL_BACKENDS:
+        raise ValueError(f"{ZONAL_BACKEND_ENV} must be one of {ZONAL_BACKENDS}, not '{backend}'.")
+    return backend
+
+
+def zone_weights(geometry: dict, window: Window, transform: Affine, masks: dict = None,
+                 geometry_key: str = None) -> np.ndarray:
+    """
+    Get the weights of the pixels of a raster window in a zone, according to the zonal statistics backend:
+    the fraction of each pixel covered by the zone (see zonal.coverage.coverage_fraction), or the mask of
+    pixels whose centers fall inside the zone (see zone_mask).
+    :param geometry: GeoJSON-like zone geometry
+    :param window: Raster window
+    :param transform: Affine transform of the raster
+    :param masks: Optional dict of zone masks by grid signature, see zone_mask; coverage fractions
+        are added to it too
+    :param geometry_key: Hash of geometry, see zone_mask
+    :return: Float array of coverage fractions, or boolean zone mask
+    """
+    if get_zonal_backend() != COVERAGE_BACKEND:
+        return zone_mask(geometry, window, transform, masks, geometry_key)
+    key = (COVERAGE_BACKEND,) + grid_signature(window, transform)
+    coverage = masks.get(key) if masks is not None else None
+    if coverage is None:
+        coverage = coverage_fraction(geometry, key[2], window_transform(window, transform))
+        if masks is not None:
+            masks[key] = coverage
+    return coverage
+
+
+def zone_window(dataset, geometry: dict, bounds: tuple = None, masks: dict = None,
+                band: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Read the raster window covering a zone.
+    :param dataset: Open rasterio dataset
+    :param geometry: GeoJSON-like zone geometry, reprojected into the CRS of dataset if needed (see dataset_zone)
+    :param bounds: Bounds of geometry, computed if not provided
+    :param masks: Optional dict of zone masks by grid signature, see zone_mask
+    :param band: Band to read
+    :return: Tuple of: window data, and weights of valid pixels in the zone (see zone_weights),
+        which are 0 or False for other pixels
+    """
+    geometry, bounds = dataset_zone(dataset, geometry, bounds)
+    window = bounds_window(bounds, dataset.transform)
+    weights = zone_weights(geometry, window, dataset.transform, masks)
+    data, valid = read_window(dataset, window, band)
+    return data, weights * valid
+
+
+def zone_values(dataset, geometry: dict, bounds: tuple = None, masks: dict = None,
+                band: int = 1) -> np.ndarray:
+    """
+    Read the valid raster values inside a zone, see zone_window.
+    :return: 1D array of the values of valid pixels in the zone
+    """
+    data, weights = zone_window(dataset, geometry, bounds, masks, band)
+    return data[weights > 0]
+
+
+def weighted_sum_count(data: np.ndarray, weights: np.ndarray) -> Tuple[float, float]:
+    """
+    Sum the values of a raster window weighted by zone weights, see zone_weights.
+    :return: Tuple of: weighted sum of values, and sum of weights (the number of pixels for zone masks)
+    """
+    inside = weights > 0
+    if weights.dtype == bool:
+        return float(data[inside].sum(dtype=np.float64)), int(np.count_nonzero(inside))
+    return float(np.dot(data[inside].astype(np.float64), weights[inside])), float(weights[inside].sum())
+
+
+def empty_histogram() -> np.ndarray:
+    """
+    :return: Array of length 256 of zeros, of integer counts, or of summed coverage fractions
+        with the coverage backend
+    """
+    dtype = np.float64 if get_zonal_backend() == COVERAGE_BACKEND else np.int64
+    return np.zeros(NUM_CATEGORICAL_CLASSES, dtype=dtype)
+
+
+def categorical_histogram(data: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """
+    Count the occurrences of each value of a uint8 categorical raster window where mask is True.
+    If mask holds float weights (e.g. coverage fractions, see zone_weights), sum them instead.
+    :return: Array of length 256 of counts (or summed weights) indexed by raster value
+    """
+    if data.dtype != np.uint8:
+        raise ValueError(f"Categorical histograms require uint8 raster data, not {data.dtype}.")
+    if mask.dtype == bool:
+        return np.bincount(data[mask], minlength=NUM_CATEGORICAL_CLASSES)
+    inside = mask > 0
+    return np.bincount(data[inside], weights=mask[inside], minlength=NUM_CATEGORICAL_CLASSES)
+
+
+def zone_histogram(dataset, geometry: dict, bounds: tuple = None, masks: dict = None,
+                   band: int = 1) -> np.ndarray:
+    """
+    Compute the categorical histogram of a uint8 raster inside a zone, see zone_window.
+    :return: Array of length 256 of pixel counts indexed by raster value
+    """
+    return categorical_histogram(*zone_window(dataset, geometry, bounds, masks, band))
+
+
+def histogram_to_counts(histogram: np.ndarray) -> dict:
+    """
+    Convert a histogram indexed by raster value into a dict of value to count, omitting
+    values that do not occur, like rasterstats categorical zonal statistics.
+    """
+    values = np.flatnonzero(histogram)
+    return dict(zip(values.tolist(), histogram[values].tolist()))
+
+
+def get_zonal_max_bytes() -> int:
+    """
+    :return: Memory limit of the raster windows read for one zone, in bytes, read from the
+        CARMA_ZONAL_MAX_MB environment variable
+    """
+    return int(os.environ.get(ZONAL_MAX_MB_ENV, DEFAULT_ZONAL_MAX_MB)) * 1024 * 1024
+
+
+def window_nbytes(dataset, window: Window, band: int = 1) -> int:
+    """
+    Estimate the memory needed to compute zonal statistics over a window: its data, plus the masks
+    and the masked copy of the data made while computing statistics.
+    """
+    itemsize = np.dtype(dataset.dtypes[band - 1]).itemsize
+    return int(window.height) * int(window.width) * (2 * itemsize + 3)
+
+
+def _aligned_edges(start: int, stop: int, step: int) -> List[int]:
+    return [start] + list(range((start // step + 1) * step, stop, step)) + [stop]
+
+
+def split_window(dataset, window: Window, max_bytes: int, band: int = 1) -> List[Window]:
+    """
+    Split a window into chunks, aligned to the tiles (or strips) of the raster so that no block is
+    decoded for more than one chunk, each needing at most about max_bytes (see window_nbytes).
+    :param dataset: Open rasterio dataset
+    :param window: Window to split, which may extend beyond the raster extent
+    :param max_bytes: Memory limit of each chunk
+    :return: List of windows covering window
+    """
+    block_height, block_width = dataset.block_shapes[band - 1]
+    max_pixels = max(1, max_bytes // (2 * np.dtype(dataset.dtypes[band - 1]).itemsize + 3))
+    row_start, col_start = int(window.row_off), int(window.col_off)
+    row_stop, col_stop = row_start + int(window.height), col_start + int(window.width)
+    if block_width >= dataset.width:
+        # Striped raster: chunks are runs of whole strips
+        chunk_height = max(block_height, max_pixels // max(1, col_stop - col_start) // block_height * block_height)
+        col_edges = [col_start, col_stop]
+    else:
+        side = int(math.sqrt(max_pixels))
+        chunk_height = max(block_height, side // block_height * block_height)
+        chunk_width = max(block_width, side // block_width * block_width)
+        col_edges = _aligned_edges(col_start, col_stop, chunk_width)
+    row_edges = _aligned_edges(row_start, row_stop, chunk_height)
+    return [Window(c0, r0, c1 - c0, r1 - r0)
+            for r0, r1 in zip(row_edges[:-1], row_edges[1:])
+            for c0, c1 in zip(col_edges[:-1], col_edges[1:])]
+
+
+def _chunk_histogram(raster_path: str, overview_level: int, geometry: dict, geometry_key: str,
+                     window: Window, band: int) -> np.ndarray:
+    dataset = get_dataset(raster_path, overview_level)
+    weights = zone_weights(geometry, window, dataset.transform, geometry_key=geometry_key)
+    if not weights.any():
+        return empty_histogram()
+    data, valid = read_window(dataset, window, band)
+    return categorical_histogram(data, weights * valid)
+
+
+def _chunk_sum_count(raster_path: str, overview_level: int, geometry: dict, geometry_key: str,
+                     window: Window, band: int) -> Tuple[float, float]:
+    dataset = get_dataset(raster_path, overview_level)
+    weights = zone_weights(geometry, window, dataset.transform, geometry_key=geometry_key)
+    if not weights.any():
+        return 0.0, 0
+    data, valid = read_window(dataset, window, band)
+    return weighted_sum_count(data, weights * valid)
+
+
+def map_zone_chunks(chunk_function, raster_path: str, overview_level: int, geometry: dict, bounds: tuple,
+                    band: int):
+    """
+    Apply chunk_function to each chunk of the window covering a zone, using the thread pool,
+    so that at most about the zonal memory limit is used at once (see split_window).
+    :param chunk_function: Function of (raster_path, overview_level, geometry, geometry_key, window, band)
+        computing the statistics of one chunk window
+    :return: Iterator of chunk results, or None if the window fits in the memory limit
+    """
+    dataset = get_dataset(raster_path, overview_level)
+    geometry, bounds = dataset_zone(dataset, geometry, bounds)
+    window = bounds_window(bounds, dataset.transform)
+    max_bytes = get_zonal_max_bytes()
+    if window_nbytes(dataset, window, band) <= max_bytes:
+        return None
+    chunks = split_window(dataset, window, max_bytes // get_num_threads(), band)
+    logger.debug(f"Computing zonal statistics of {raster_path} over {window} in {len(chunks)} chunks")
+    geometry_key = geometry_hash(geometry) if get_mask_cache() is not None else None
+    return get_thread_pool().map(lambda w: chunk_function(raster_path, overview_level, geometry,
+                                                          geometry_key, w, band), chunks)
+
+
+def tile_zone_histogram(raster_path: str, tiles: TileHistograms, geometry: dict, bounds: tuple = None,
+                        band: int = 1) -> np.ndarray:
+    """
+    Compute the categorical histogram of a raster inside a zone from its tile histograms: stored
+    counts are used for tiles entirely inside the zone, and only the pixels of tiles crossed by
+    the zone boundary are read (across the thread pool). Equivalent to zone_histogram.
+    :param raster_path: Path of uint8 raster
+    :param tiles: Tile histograms of the raster, see zonal.tilehistograms
+    :return: Array of length 256 of pixel counts indexed by raster value
+    """
+    dataset = get_dataset(raster_path)
+    geometry, bounds = dataset_zone(dataset, geometry, bounds)
+    window = bounds_window(bounds, dataset.transform)
+    size = tiles.tile_size
+    row_start, col_start = max(0, int(window.row_off) // size), max(0, int(window.col_off) // size)
+    row_stop = min(tiles.num_rows, math.ceil((window.row_off + window.height) / size))
+    col_stop = min(tiles.num_cols, math.ceil((window.col_off + window.width) / size))
+
+    zone = prep(shape(geometry))
+    histogram = empty_histogram()
+    boundary = []
+    for row in range(row_start, row_stop):
+        run_start = None
+        for col in range(col_start, col_stop + 1):
+            tile = tiles.tile_window(row, col) if col < col_stop else None
+            # Pixel centers of tiles that lie entirely inside the zone are all inside it
+            if tile is not None and zone.contains(box(*window_bounds(tile, dataset.transform))):
+                if run_start is None:
+                    run_start = col
+                continue
+            if run_start is not None:
+                histogram += tiles.run_counts(row, run_start, col)
+                run_start = None
+            if tile is not None:
+                boundary.append(intersection(tile, window))
+    logger.debug(f"Reading {len(boundary)} boundary tiles of {(row_stop - row_start) * (col_stop - col_start)} "
+                 f"tiles of {raster_path}")
+
+    geometry_key = geometry_hash(geometry) if get_mask_cache() is not None else None
+    for chunk_histogram in get_thread_pool().map(lambda w: _chunk_histogram(raster_path, None, geometry,
+                                                                            geometry_key, w, band), boundary):
+        histogram += chunk_histogram
+    return histogram
+
+
+def raster_zone_histogram(raster_path: str, geometry: dict, bounds: tuple = None, masks: dict = None,
+                          band: int = 1, overview_level: int = None) -> np.ndarray:
+    """
+    Compute the categorical histogram of a raster inside a zone, see zone_histogram. Tile histograms
+    of the raster are used if they have been built (see tile_zone_histogram); otherwise, zones whose
+    raster window exceeds the zonal memory limit are computed in chunks across the thread pool.
+    :param raster_path: Path of uint8 raster
+    :param overview_level: Index of overview to compute the histogram from, see zonal.overview;
+        None for full resolution
+    :return: Array of length 256 of pixel counts indexed by raster value
+    """
+    # Reproject the zone once for the tile, chunked, or single window histogram
+    geometry, bounds = dataset_zone(get_dataset(raster_path, overview_level), geometry, bounds)
+    if overview_level is None and band == 1:
+        tiles = get_tile_histograms(raster_path)
+        if tiles is not None:
+            return tile_zone_histogram(raster_path, tiles, geometry, bounds, band)
+    results = map_zone_chunks(_chunk_histogram, raster_path, overview_level, geometry, bounds, band)
+    if results is None:
+        return zone_histogram(get_dataset(raster_path, overview_level), geometry, bounds, masks, band)
+    histogram = empty_histogram()
+    for chunk_histogram in results:
+        histogram += chunk_histogram
+    return histogram
+
+
+def raster_zone_mean(raster_path: str, geometry: dict, bounds: tuple = None, masks: dict = None,
+                     band: int = 1) -> float:
+    """
+    Compute the mean of a raster inside a zone, computing large zones in chunks (see raster_zone_histogram).
+    :param raster_path: Path of raster
+    :return: Mean of valid pixels in the zone (weighted by coverage with the coverage backend),
+        or None if there are none
+    """
+    geometry, bounds = dataset_zone(get_dataset(raster_path), geometry, bounds)
+    results = map_zone_chunks(_chunk_sum_count, raster_path, None, geometry, bounds, band)
+    if results is None:
+        total, count = weighted_sum_count(*zone_window(get_dataset(raster_path), geometry, bounds, masks, band))
+    else:
+        total, count = 0.0, 0
+        for chunk_total, chunk_count in results:
+            total += chunk_total
+            count += chunk_count
+    if count == 0:
+        return None
+    return total / count
+
+
+def cache_extra(band: int, overview_level: int) -> tuple:
+    """
+    :return: Parameters, besides geometry and raster, that cached zonal statistics depend on, see cache.memoize
+    """
+    # Full resolution values computed with the center backend keep the cache keys they had
+    # before overviews and other backends were supported
+    extra = (band,) if overview_level is None else (band, overview_level)
+    backend = get_zonal_backend()
+    return extra if backend == CENTER_BACKEND else extra + (backend,)
+
+
+def cached_zone_histogram(raster_path: str, geometry: dict, bounds: tuple = None, masks: dict = None,
+                          band: int = 1, overview_level: int = None) -> np.ndarray:
+    """
+    Compute the categorical histogram of a raster inside a zone (see raster_zone_histogram), using
+    the derived attribute cache so that histograms of unchanged geometries and rasters are reused.
+    :param raster_path: Path of uint8 raster
+    :param overview_level: Index of overview to compute the histogram from, see zonal.overview;
+        None for full resolution
+    :return: Array of length 256 of pixel counts indexed by raster value
+    """
+    return memoize('zone_histogram', geometry, raster_path,
+                   lambda: raster_zone_histogram(raster_path, geometry, bounds, masks, band, overview_level),
+                   *cache_extra(band, overview_level))
+
+
+def cached_zone_mean(raster_path: str, geometry: dict, bounds: tuple = None, masks: dict = None,
+                     band: int = 1) -> float:
+    """
+    Compute the mean of a raster inside a zone (see raster_zone_mean), using the derived attribute cache.
+    :param raster_path: Path of raster
+    :return: Mean of valid pixels whose centers fall inside the zone, or None if there are none
+    """
+    return memoize('zone_mean', geometry, raster_path,
+                   lambda: raster_zone_mean(raster_path, geometry, bounds, masks, band), *cache_extra(band, None))
@@ -0,0 +1,212 @@
+# Copyright (C) 2021-present University of Louisiana at Lafayette.
+# All rights reserved. Licensed under the GPLv3 License. See LICENSE.txt in the project root for license information.
+
+from collections import defaultdict
+from typing import List, Tuple
+import logging
+import math
+
+import numpy as np
+
+from rasterio.features import rasterize
+from rasterio.windows import Window
+from rasterio.windows import transform as window_transform
+from tqdm import tqdm
+
+from . import get_zone_geometry, dataset_zone, bounds_window, read_window, get_zonal_backend, \
+    NUM_CATEGORICAL_CLASSES, COVERAGE_BACKEND
+
+
+# Size (in pixels) of the raster windows that zones are rasterized into and counted over,
+# rounded up to whole tiles for tiled rasters
+BATCH_WINDOW_SIZE = 2048
+
+logger = logging.getLogger(__name__)
+
+
+def _num_classes(dataset) -> int:
+    dtype = np.dtype(dataset.dtypes[0])
+    if dtype != np.uint8:
+        raise ValueError(f"Batched categorical zonal statistics require a uint8 raster, "
+                         f"but {dataset.name} is {dtype}.")
+    return NUM_CATEGORICAL_CLASSES
+
+
+def tile_aligned_window_shape(dataset, window_size: int = BATCH_WINDOW_SIZE) -> Tuple[int, int]:
+    """
+    Round a window size up to a whole number of raster tiles, so that windows laid out on
+    a grid from the raster origin never split a tile. Striped (untiled) rasters are not aligned.
+    :return: Tuple of window height and width, in pixels
+    """
+    block_height, block_width = dataset.block_shapes[0]
+    if block_width >= dataset.width:
+        return window_size, window_size
+    return (math.ceil(window_size / block_height) * block_height,
+            math.ceil(window_size / block_width) * block_width)
+
+
+def assign_zones_to_windows(zone_windows: List[Window],
+                            window_shape: Tuple[int, int] = (BATCH_WINDOW_SIZE, BATCH_WINDOW_SIZE)) -> dict:
+    """
+    Group zones by the fixed-size, grid-aligned raster windows that their bounds touch.
+    :param zone_windows: Bounds window of each zone
+    :param window_shape: Height and width of windows, in pixels
+    :return: Dict mapping (window row, window column) to list of indices of zones that touch the window
+    """
+    window_height, window_width = window_shape
+    windows = defaultdict(list)
+    for i, w in enumerate(zone_windows):
+        if w.height <= 0 or w.width <= 0:
+            continue
+        row_start, col_start = int(w.row_off), int(w.col_off)
+        row_stop, col_stop = row_start + int(w.height), col_start + int(w.width)
+        for wr in range(row_start // window_height, (row_stop - 1) // window_height + 1):
+            for wc in range(col_start // window_width, (col_stop - 1) // window_width + 1):
+                windows[(wr, wc)].append(i)
+    return windows
+
+
+def batch_categorical_histograms(zone_features: list, dataset, window_size: int = BATCH_WINDOW_SIZE,
+                                 show_progress: bool = False) -> np.ndarray:
+    """
+    Compute categorical zonal statistics for many zones at once, see batch_categorical_histogram_stack.
+    :param dataset: Open rasterio dataset of a uint8 categorical raster
+    :return: Array of shape (number of zones, 256) of pixel counts by zone and raster value
+    """
+    return batch_categorical_histogram_stack(zone_features, [dataset], window_size, show_progress)[0]
+
+
+def _iter_zone_windows(geometries: List[dict], dataset, window_size: int = BATCH_WINDOW_SIZE,
+                       show_progress: bool = False):
+    """
+    Iterate over the grid-aligned windows of a raster touched by zones, rasterizing the zones
+    (reprojected into the CRS of the raster if needed, see zonal.dataset_zone) in each window as labels.
+    :return: Generator of tuples of: indices of zones touching the window, Window, and int32 array of
+        the (1-based) position of each pixel's zone in the indices (0 outside all zones)
+    """
+    zones = [dataset_zone(dataset, g) for g in geometries]
+    geometries = [g for g, _ in zones]
+    zone_windows = [bounds_window(bounds, dataset.transform) for _, bounds in zones]
+    window_height, window_width = tile_aligned_window_shape(dataset, window_size)
+    windows = assign_zones_to_windows(zone_windows, (window_height, window_width))
+    logger.debug(f"Computing statistics for {len(geometries)} zones over {len(windows)} windows")
+    for (wr, wc), zone_idx in tqdm(sorted(windows.items()), disable=not show_progress,
+                                   desc='Computing zonal statistics'):
+        # Only read the part of the window covered by its zones
+        row_start = max(wr * window_height, min(int(zone_windows[i].row_off) for i in zone_idx))
+        col_start = max(wc * window_width, min(int(zone_windows[i].col_off) for i in zone_idx))
+        row_stop = min((wr + 1) * window_height,
+                       max(int(zone_windows[i].row_off + zone_windows[i].height) for i in zone_idx))
+        col_stop = min((wc + 1) * window_width,
+                       max(int(zone_windows[i].col_off + zone_windows[i].width) for i in zone_idx))
+        window = Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+
+        labels = rasterize([(geometries[i], label) for label, i in enumerate(zone_idx, start=1)],
+                           out_shape=(int(window.height), int(window.width)),
+                           transform=window_transform(window, dataset.transform),
+                           fill=0, dtype='int32')
+        yield zone_idx, window, labels
+
+
+def batch_categorical_histogram_stack(zone_features: list, datasets: list, window_size: int = BATCH_WINDOW_SIZE,
+                                      show_progress: bool = False) -> np.ndarray:
+    """
+    Compute categorical zonal statistics for many zones at once, over one or more rasters that share
+    a pixel grid (e.g. several years of CDL). Zones are rasterized together as labels into shared
+    raster windows, once for all rasters, and (zone, class) counts for each window and raster are
+    computed with a single numpy.bincount, so that raster blocks shared by neighboring zones are read once.
+    Zones are assumed not to overlap (as is the case for HUC12s, counties, and sub-HUC12s);
+    where they do, overlapping pixels are counted for only one of the zones.
+    :param zone_features: List of zones, each in any form accepted by get_zone_geometry
+    :param datasets: Open rasterio datasets of uint8 categorical rasters with the same transform and shape
+    :param window_size: Size of windows, in pixels, before rounding up to whole tiles of the first raster
+    :param show_progress: Display a progress bar while processing windows
+    :return: Array of shape (number of rasters, number of zones, 256) of pixel counts by raster, zone,
+        and raster value
+    :raises ValueError: with the coverage zonal backend, since zones are rasterized by pixel center
+    """
+    if get_zonal_backend() == COVERAGE_BACKEND:
+        raise ValueError(f"Batched categorical zonal statistics do not support the {COVERAGE_BACKEND} backend; "
+                         "compute histograms one zone at a time instead.")
+    num_classes = max(_num_classes(d) for d in datasets)
+    dataset = datasets[0]
+    for d in datasets[1:]:
+        if d.transform != dataset.transform or d.shape != dataset.shape:
+            raise ValueError(f"Raster {d.name} is not on the same pixel grid as {dataset.name}.")
+    geometries = [get_zone_geometry(z) for z in zone_features]
+    histograms = np.zeros((len(datasets), len(geometries), num_classes), dtype=np.int64)
+
+    for zone_idx, window, labels in _iter_zone_windows(geometries, dataset, window_size, show_progress):
+        in_zone = labels > 0
+        for k, d in enumerate(datasets):
+            data, valid = read_window(d, window)
+            valid &= in_zone
+            codes = labels[valid].astype(np.int64) * num_classes + data[valid]
+            counts = np.bincount(codes, minlength=(len(zone_idx) + 1) * num_classes)
+            histograms[k, zone_idx] += counts.reshape(-1, num_classes)[1:]
+
+    return histograms
+
+
+def batch_continuous_stats(zone_features: list, dataset, percentiles: List[float] = None,
+                           window_size: int = BATCH_WINDOW_SIZE, show_progress: bool = False) -> List[dict]:
+    """
+    Compute statistics of a continuous raster (e.g. groundwater recharge) for many zones at once.
+    Zones are rasterized together as labels into shared raster windows, and per-zone sums and counts
+    are computed with numpy.bincount over the raster's native (e.g. float32) values, rather than
+    full masked float64 arrays for each zone. Zones are assumed not to overlap, see
+    batch_categorical_histogram_stack.
+    :param zone_features: List of zones, each in any form accepted by get_zone_geometry
+    :param dataset: Open rasterio dataset
+    :param percentiles: Optional percentiles (0-100) to compute; this requires keeping the values
+        of each zone until all windows have been read
+    :param window_size: Size of windows, in pixels, before rounding up to whole raster tiles
+    :param show_progress: Display a progress bar while processing windows
+    :return: List, with an entry for each zone, of dicts with 'count', 'sum', 'mean', 'min', and 'max'
+        (None if the zone has no valid pixels), and 'percentile_<q>' for each requested percentile
+    :raises ValueError: with the coverage zonal backend, since zones are rasterized by pixel center
+    """
+    if get_zonal_backend() == COVERAGE_BACKEND:
+        raise ValueError(f"Batched continuous zonal statistics do not support the {COVERAGE_BACKEND} backend; "
+                         "compute statistics one zone at a time instead.")
+    geometries = [get_zone_geometry(z) for z in zone_features]
+    num_zones = len(geometries)
+    counts = np.zeros(num_zones, dtype=np.int64)
+    sums = np.zeros(num_zones, dtype=np.float64)
+    mins = np.full(num_zones, np.inf)
+    maxs = np.full(num_zones, -np.inf)
+    values = [[] for _ in range(num_zones)] if percentiles else None
+
+    for zone_idx, window, labels in _iter_zone_windows(geometries, dataset, window_size, show_progress):
+        data, valid = read_window(dataset, window)
+        valid &= labels > 0
+        zone_labels = labels[valid]
+        zone_data = data[valid]
+        # Position 0 of the bincounts is for pixels outside all zones, which are not valid
+        counts[zone_idx] += np.bincount(zone_labels, minlength=len(zone_idx) + 1)[1:]
+        sums[zone_idx] += np.bincount(zone_labels, weights=zone_data, minlength=len(zone_idx) + 1)[1:]
+        window_mins = np.full(len(zone_idx) + 1, np.inf)
+        np.minimum.at(window_mins, zone_labels, zone_data)
+        mins[zone_idx] = np.minimum(mins[zone_idx], window_mins[1:])
+        window_maxs = np.full(len(zone_idx) + 1, -np.inf)
+        np.maximum.at(window_maxs, zone_labels, zone_data)
+        maxs[zone_idx] = np.maximum(maxs[zone_idx], window_maxs[1:])
+        if percentiles:
+            order = np.argsort(zone_labels, kind='stable')
+            splits = np.searchsorted(zone_labels[order], np.arange(1, len(zone_idx) + 1))
+            for i, zone_values in zip(zone_idx, np.split(zone_data[order], splits[1:])):
+                if zone_values.size > 0:
+                    values[i].append(zone_values)
+
+    stats = []
+    for i in range(num_zones):
+        count = int(counts[i])
+        zone_stats = {'count': count,
+                      'sum': float(sums[i]),
+                      'mean': float(sums[i] / count) if count else None,
+                      'min': float(mins[i]) if count else None,
+                      'max': float(maxs[i]) if count else None}
+        for q in percentiles or []:
+            zone_stats[f"percentile_{q:g}"] = float(np.percentile(np.concatenate(values[i]), q)) if count else None
+        stats.append(zone_stats)
+    return stats
@@ -0,0 +1,121 @@
+# Copyright (C) 2021-present University of Louisiana at Lafayette.
+# All rights reserved. Licensed under the GPLv3 License. See LICENSE.txt in the project root for license information.
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from rasterio.windows import Window
+
+
+# Memory limit of the per-process block cache, in megabytes; 0 disables the cache
+BLOCK_CACHE_MB_ENV = 'CARMA_BLOCK_CACHE_MB'
+DEFAULT_BLOCK_CACHE_MB = 512
+
+logger = logging.getLogger(__name__)
+
+
+class BlockCache:
+    """
+    Least-recently-used cache of decoded raster blocks, keyed by (raster, raster shape, band, block row,
+    block column); overviews opened as datasets share the name of their raster, but not its shape.
+    Zonal statistics of neighboring geometries (e.g. the sub-HUC12s of a HUC12) read many of the same
+    blocks; caching them avoids decompressing each block again for every geometry. The cache may be
+    shared by threads reading different datasets (see zonal.datasets.get_dataset).
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return (f"BlockCache(blocks={len(self._blocks)}, nbytes={self.nbytes}, max_bytes={self.max_bytes}, "
+                f"hits={self.hits}, misses={self.misses})")
+
+    def stats(self) -> dict:
+        return {'blocks': len(self._blocks),
+                'nbytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses}
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self.nbytes = 0
+
+    def get_block(self, dataset, band: int, block_row: int, block_col: int) -> np.ndarray:
+        key = (dataset.name, dataset.shape, band, block_row, block_col)
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is not None:
+                self.hits += 1
+                self._blocks.move_to_end(key)
+                return block
+            self.misses += 1
+
+        # Decode outside of the lock so that threads can read blocks concurrently
+        block = dataset.read(band, window=dataset.block_window(band, block_row, block_col))
+        if block.nbytes <= self.max_bytes:
+            with self._lock:
+                previous = self._blocks.pop(key, None)
+                if previous is not None:
+                    self.nbytes -= previous.nbytes
+                self._blocks[key] = block
+                self.nbytes += block.nbytes
+                while self.nbytes > self.max_bytes:
+                    _, evicted = self._blocks.popitem(last=False)
+                    self.nbytes -= evicted.nbytes
+        return block
+
+    def read(self, dataset, window: Window, band: int = 1) -> np.ndarray:
+        """
+        Read a window, which must lie within the raster extent, assembling it from cached blocks.
+        """
+        row_start, col_start = int(window.row_off), int(window.col_off)
+        row_stop, col_stop = row_start + int(window.height), col_start + int(window.width)
+        block_height, block_width = dataset.block_shapes[band - 1]
+        data = np.empty((row_stop - row_start, col_stop - col_start), dtype=dataset.dtypes[band - 1])
+        for block_row in range(row_start // block_height, (row_stop - 1) // block_height + 1):
+            block_row_start = block_row * block_height
+            r0, r1 = max(row_start, block_row_start), min(row_stop, block_row_start + block_height)
+            for block_col in range(col_start // block_width, (col_stop - 1) // block_width + 1):
+                block_col_start = block_col * block_width
+                c0, c1 = max(col_start, block_col_start), min(col_stop, block_col_start + block_width)
+                block = self.get_block(dataset, band, block_row, block_col)
+                data[r0 - row_start:r1 - row_start, c0 - col_start:c1 - col_start] = \
+                    block[r0 - block_row_start:r1 - block_row_start, c0 - block_col_start:c1 - block_col_start]
+        return data
+
+
+_block_cache = None
+
+
+def get_block_cache() -> BlockCache:
+    """
+    Get the block cache for this process, creating it if needed. Its memory limit is
+    read from the CARMA_BLOCK_CACHE_MB environment variable.
+    :return: BlockCache, or None if the block cache is disabled
+    """
+    global _block_cache
+    if _block_cache is None:
+        max_mb = int(os.environ.get(BLOCK_CACHE_MB_ENV, DEFAULT_BLOCK_CACHE_MB))
+        _block_cache = BlockCache(max_mb * 1024 * 1024)
+    if _block_cache.max_bytes <= 0:
+        return None
+    return _block_cache
+
+
+def set_block_cache_size(max_mb: int):
+    """
+    Set the memory limit of the block cache for this process, discarding any cached blocks.
+    :param max_mb: Memory limit in megabytes; 0 disables the cache
+    """
+    global _block_cache
+    _block_cache = BlockCache(max_mb * 1024 * 1024)
@@ -0,0 +1,110 @@
+# Copyright (C) 2021-present University of Louisiana at Lafayette.
+# All rights reserved. Licensed under the GPLv3 License. See LICENSE.txt in the project root for license information.
+
+from typing import Iterator, Tuple
+
+import numpy as np
+
+from affine import Affine
+from shapely.geometry import shape as to_shape, Polygon
+from shapely.geometry.polygon import orient
+
+
+# Coverage fractions below this are round-off of the accumulation, and are set to 0
+COVERAGE_EPSILON = 1e-9
+
+
+def _polygons(geom) -> Iterator[Polygon]:
+    if isinstance(geom, Polygon):
+        yield geom
+    elif hasattr(geom, 'geoms'):
+        for part in geom.geoms:
+            yield from _polygons(part)
+
+
+def zone_edges(geometry: dict, transform: Affine) -> np.ndarray:
+    """
+    Get the edges of the rings of a polygonal zone in pixel coordinates. Rings are oriented so that
+    edges of exteriors and interiors (holes) wind in opposite directions.
+    :param geometry: GeoJSON-like geometry; parts that are not polygons are ignored
+    :param transform: Affine transform of the pixel grid
+    :return: Array of shape (N, 4) of edges (col0, row0, col1, row1)
+    """
+    inverse = ~transform
+    edges = []
+    for polygon in _polygons(to_shape(geometry)):
+        if polygon.is_empty:
+            continue
+        polygon = orient(polygon, sign=1.0)
+        for ring in [polygon.exterior, *polygon.interiors]:
+            coords = np.asarray(ring.coords)
+            cols, rows = inverse * (coords[:, 0], coords[:, 1])
+            edges.append(np.column_stack([cols[:-1], rows[:-1], cols[1:], rows[1:]]))
+    if not edges:
+        return np.empty((0, 4))
+    return np.concatenate(edges)
+
+
+def _grid_crossings(a0: np.ndarray, a1: np.ndarray, low: int, high: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find where segments from a0 to a1 cross the integer grid lines from low to high.
+    :return: Tuple of: index of the segment of each crossing, and its parameter t in (0, 1) along the segment
+    """
+    first = np.maximum(np.floor(np.minimum(a0, a1)) + 1, low)
+    last = np.minimum(np.ceil(np.maximum(a0, a1)) - 1, high)
+    counts = np.maximum(last - first + 1, 0).astype(np.int64)
+    index = np.repeat(np.arange(a0.size), counts)
+    lines = first[index] + (np.arange(index.size) - np.repeat(np.cumsum(counts) - counts, counts))
+    return index, (lines - a0[index]) / (a1[index] - a0[index])
+
+
+def coverage_fraction(geometry: dict, out_shape: tuple, transform: Affine) -> np.ndarray:
+    """
+    Compute the exact fraction of each pixel of a grid covered by a polygonal zone, in one sweep over
+    its edges (in the style of exactextract, and of the signed-area accumulation of font rasterizers).
+    Edges are cut where they cross pixel boundaries, so that each piece lies within one row and one
+    column; a piece adds its signed height, split by the position of its midpoint, to the accumulators
+    of its pixel and of the next one. The running sum of accumulators along each row is then the area
+    of the pixels covered by the zone, including pixels crossed by edges. Unlike rasterizing pixel
+    centers, zones narrower than a pixel (e.g. sub-HUC12 slivers) are not lost.
+    :param geometry: GeoJSON-like polygonal zone geometry
+    :param out_shape: Shape (height, width) of the pixel grid
+    :param transform: Affine transform of the pixel grid
+    :return: Array of out_shape of coverage fractions between 0 and 1
+    """
+    height, width = int(out_shape[0]), int(out_shape[1])
+    coverage = np.zeros((height, width))
+    edges = zone_edges(geometry, transform)
+    if edges.size == 0 or height == 0 or width == 0:
+        return coverage
+    x0, y0, x1, y1 = edges.T
+
+    # Cut edges at the start and end of each edge, and where they cross pixel boundaries in the grid
+    col_index, col_t = _grid_crossings(x0, x1, 0, width)
+    row_index, row_t = _grid_crossings(y0, y1, 0, height)
+    num_edges = x0.size
+    index = np.concatenate([np.arange(num_edges), np.arange(num_edges), col_index, row_index])
+    t = np.concatenate([np.zeros(num_edges), np.ones(num_edges), col_t, row_t])
+    order = np.lexsort((t, index))
+    index, t = index[order], t[order]
+    same_edge = index[1:] == index[:-1]
+    e, t0, t1 = index[:-1][same_edge], t[:-1][same_edge], t[1:][same_edge]
+
+    t_mid = (t0 + t1) / 2
+    x_mid = x0[e] + t_mid * (x1[e] - x0[e])
+    y_mid = y0[e] + t_mid * (y1[e] - y0[e])
+    dy = (t1 - t0) * (y1[e] - y0[e])
+    # Pieces above, below or right of the grid cover none of its pixels; pieces left of it
+    # cover whole rows, and are accumulated as if they were on its left boundary
+    inside = (dy != 0) & (y_mid >= 0) & (y_mid < height) & (x_mid < width)
+    x_mid, y_mid, dy = np.maximum(x_mid[inside], 0), y_mid[inside], dy[inside]
+    cols = x_mid.astype(np.int64)
+    frac = x_mid - cols
+    cells = y_mid.astype(np.int64) * (width + 1) + cols
+
+    accumulated = np.bincount(np.concatenate([cells, cells + 1]),
+                              weights=np.concatenate([dy * (1 - frac), dy * frac]),
+                              minlength=height * (width + 1)).reshape(height, width + 1)
+    np.abs(np.cumsum(accumulated, axis=1)[:, :width], out=coverage)
+    coverage[coverage < COVERAGE_EPSILON] = 0
+    return np.minimum(coverage, 1.0, out=coverage)
@@ -0,0 +1,127 @@
+# Copyright (C) 2021-present University of Louisiana at Lafayette.
+# All rights reserved. Licensed under the GPLv3 License. See LICENSE.txt in the project root for license information.
+
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import rasterio
+from rasterio.env import set_gdal_config
+
+
+# Size of the GDAL raster block cache, in megabytes (or with a '%' suffix, a percentage of RAM),
+# applied to each process that opens datasets through the pool
+GDAL_CACHEMAX_ENV = 'CARMA_GDAL_CACHEMAX'
+# Number of threads each process uses to compute zonal statistics of large zones in chunks
+ZONAL_THREADS_ENV = 'CARMA_ZONAL_THREADS'
+DEFAULT_ZONAL_THREADS = 4
+
+logger = logging.getLogger(__name__)
+
+_datasets = {}
+_datasets_pid = None
+_thread_pool = None
+
+
+def set_gdal_cache_max(cache_max: str):
+    """
+    Set the size of the GDAL block cache for this process.
+    :param cache_max: Size in megabytes, or a percentage of RAM (e.g. '25%')
+    """
+    logger.debug(f"Setting GDAL_CACHEMAX to {cache_max}")
+    set_gdal_config('GDAL_CACHEMAX', str(cache_max))
+
+
+def _reset_after_fork():
+    # Dataset handles inherited from the parent share file offsets with it, so they
+    # must never be used in a child. Forget them without closing so that the parent's
+    # GDAL state is left untouched; the child will open its own handles on demand.
+    # Likewise, the threads of the parent's thread pool do not exist in the child.
+    global _datasets_pid, _thread_pool
+    _datasets.clear()
+    _datasets_pid = None
+    _thread_pool = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _ensure_process():
+    global _datasets_pid
+    pid = os.getpid()
+    if _datasets_pid != pid:
+        if _datasets_pid is not None:
+            _reset_after_fork()
+        _datasets_pid = pid
+        cache_max = os.environ.get(GDAL_CACHEMAX_ENV)
+        if cache_max:
+            set_gdal_cache_max(cache_max)
+
+
+def get_dataset(path: str, overview_level: int = None):
+    """
+    Get an open rasterio dataset for path from the per-process dataset pool, opening it if needed.
+    Handles are keyed by the paths returned by common.verify_raw_data (and overview level) and
+    stay open until close_datasets is called or the process exits. Each thread gets its own handles,
+    since rasterio datasets must not be used by several threads at once.
+    :param path: Path of raster dataset
+    :param overview_level: Index of overview to open in place of the full resolution raster
+    :return: Open rasterio dataset
+    """
+    _ensure_process()
+    key = (threading.get_ident(), path, overview_level)
+    dataset = _datasets.get(key)
+    if dataset is None or dataset.closed:
+        logger.debug(f"Opening raster dataset {path} (overview level {overview_level}) in process {_datasets_pid}")
+        # Passing overview_level=None would hide the overviews of the full resolution raster
+        if overview_level is None:
+            dataset = rasterio.open(path)
+        else:
+            dataset = rasterio.open(path, overview_level=overview_level)
+        _datasets[key] = dataset
+    return dataset
+
+
+def init_worker(cache_max: str = None, paths: list = None):
+    """
+    Initializer for multiprocessing.Pool workers: optionally set the GDAL block cache size
+    and open datasets up front so that tasks run by the worker share the same handles.
+    :param cache_max: GDAL block cache size, see set_gdal_cache_max
+    :param paths: Raster dataset paths to open
+    """
+    _ensure_process()
+    if cache_max:
+        set_gdal_cache_max(cache_max)
+    if paths:
+        for path in paths:
+            get_dataset(path)
+
+
+def get_num_threads() -> int:
+    """
+    :return: Number of threads of the thread pool, read from the CARMA_ZONAL_THREADS environment variable
+    """
+    return max(1, int(os.environ.get(ZONAL_THREADS_ENV, DEFAULT_ZONAL_THREADS)))
+
+
+def get_thread_pool() -> ThreadPoolExecutor:
+    """
+    Get the thread pool of this process, creating it if needed.
+    """
+    global _thread_pool
+    _ensure_process()
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(get_num_threads(), thread_name_prefix='carma-zonal')
+    return _thread_pool
+
+
+def close_datasets():
+    """
+    Close all datasets opened by this process.
+    """
+    if _datasets_pid == os.getpid():
+        for dataset in _datasets.values():
+            dataset.close()
+    _datasets.clear()
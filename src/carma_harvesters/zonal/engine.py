@@ -0,0 +1,115 @@
+# Copyright (C) 2021-present University of Louisiana at Lafayette.
+# All rights reserved. Licensed under the GPLv3 License. See LICENSE.txt in the project root for license information.
+
+from dataclasses import dataclass, field
+from collections import OrderedDict
+from typing import List, Tuple, Union
+import logging
+
+import numpy as np
+
+from shapely.geometry import shape
+
+from . import get_zone_geometry, cached_zone_histogram, cached_zone_mean, histogram_to_counts
+from . overview import select_overview
+from .. crops.cropscape import crop_areas_from_histogram, crop_area_standard_error
+from .. nlcd import developed_cells_from_histogram, developed_area_standard_error
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ZonalStatsResult:
+    total_crop_area: float = 0.0
+    crop_areas: OrderedDict = field(default_factory=OrderedDict)
+    developed_nlcd_cells: float = 0.0
+    total_nlcd_cells: float = 0.0
+    recharge: float = None
+    cdl_histogram: np.ndarray = None
+    nlcd_histogram: np.ndarray = None
+    cdl_histograms: OrderedDict = field(default_factory=OrderedDict)
+    nlcd_histograms: OrderedDict = field(default_factory=OrderedDict)
+    crop_area_errors: OrderedDict = field(default_factory=OrderedDict)
+    developed_area_errors: OrderedDict = field(default_factory=OrderedDict)
+
+
+def _as_rasters(rasters: Union[str, List[Tuple[int, str]]]) -> List[Tuple[int, str]]:
+    if rasters is None:
+        return []
+    if isinstance(rasters, str):
+        return [(None, rasters)]
+    return list(rasters)
+
+
+class ZonalStatsEngine:
+    """
+    Compute CDL crop area, NLCD developed area, and mean groundwater recharge (each optional)
+    for a geography in a single pass. Raster handles come from the per-process dataset pool,
+    and each geometry is rasterized once per distinct pixel grid (rasters sharing a grid,
+    e.g. multiple CDL years, reuse the same zone mask). Histograms and means are looked up in,
+    and added to, the derived attribute cache.
+
+    CDL and NLCD rasters may each be given as a single path, or as a list of (year, path) tuples
+    to compute several years at once. With a zonal_resolution greater than 1, CDL and NLCD
+    histograms are computed from raster overviews (see zonal.overview.select_overview), and
+    the standard errors this adds to crop and developed areas are estimated.
+    """
+    def __init__(self, cdl_raster_path: Union[str, List[Tuple[int, str]]] = None,
+                 nlcd_raster_path: Union[str, List[Tuple[int, str]]] = None,
+                 recharge_raster_path: str = None,
+                 zonal_resolution: int = 1):
+        self.cdl_rasters = _as_rasters(cdl_raster_path)
+        self.nlcd_rasters = _as_rasters(nlcd_raster_path)
+        self.recharge_raster_path = recharge_raster_path
+        self.zonal_resolution = zonal_resolution
+        self._overviews = {}
+
+    def _overview(self, path: str) -> Tuple[int, int]:
+        if path not in self._overviews:
+            self._overviews[path] = select_overview(path, self.zonal_resolution)
+        return self._overviews[path]
+
+    def compute(self, zone_features, geography_area: float) -> ZonalStatsResult:
+        """
+        Compute zonal statistics for a geography.
+        :param zone_features: GeoJSON-like geometry or feature, or object implementing __geo_interface__
+        :param geography_area: Area of the geography, used to scale crop pixel proportions to areas
+        :return: ZonalStatsResult, including the CDL and NLCD histograms (arrays of length 256 of
+            pixel counts by raster value) that the areas were derived from; statistics for rasters
+            the engine was not given are left at their defaults, and recharge will also be None
+            if there are no recharge data in the geography. Areas, cell counts, and cdl_histogram
+            and nlcd_histogram are for the first year; cdl_histograms and nlcd_histograms map
+            each year to its histogram. crop_area_errors and developed_area_errors map each
+            year to the standard error of its area, which is 0.0 at full resolution.
+        """
+        geometry = get_zone_geometry(zone_features)
+        bounds = shape(geometry).bounds
+        masks = {}
+        result = ZonalStatsResult()
+
+        for year, path in self.cdl_rasters:
+            level, factor = self._overview(path)
+            result.cdl_histograms[year] = cached_zone_histogram(path, geometry, bounds, masks, overview_level=level)
+            result.crop_area_errors[year] = crop_area_standard_error(result.cdl_histograms[year],
+                                                                     geography_area, factor)
+        if self.cdl_rasters:
+            result.cdl_histogram = next(iter(result.cdl_histograms.values()))
+            result.total_crop_area, result.crop_areas = crop_areas_from_histogram(result.cdl_histogram,
+                                                                                  geography_area)
+
+        for year, path in self.nlcd_rasters:
+            level, factor = self._overview(path)
+            result.nlcd_histograms[year] = cached_zone_histogram(path, geometry, bounds, masks, overview_level=level)
+            result.developed_area_errors[year] = developed_area_standard_error(result.nlcd_histograms[year],
+                                                                               geography_area, factor)
+        if self.nlcd_rasters:
+            result.nlcd_histogram = next(iter(result.nlcd_histograms.values()))
+            logger.debug(f"NLCD zonal stats: {histogram_to_counts(result.nlcd_histogram)}")
+            result.developed_nlcd_cells, result.total_nlcd_cells = \
+                developed_cells_from_histogram(result.nlcd_histogram)
+
+        if self.recharge_raster_path:
+            result.recharge = cached_zone_mean(self.recharge_raster_path, geometry, bounds, masks)
+
+        return result
@@ -0,0 +1,68 @@
+# Copyright (C) 2021-present University of Louisiana at Lafayette.
+# All rights reserved. Licensed under the GPLv3 License. See LICENSE.txt in the project root for license information.
+
+from typing import List
+
+import numpy as np
+
+from shapely.geometry import shape
+
+
+# Number of bits per axis of the grid onto which centroids are snapped before computing their Hilbert index,
+# i.e. a grid of 2**16 by 2**16 cells over the extent of the centroids
+HILBERT_ORDER = 16
+
+
+def hilbert_index(x: np.ndarray, y: np.ndarray, order: int = HILBERT_ORDER) -> np.ndarray:
+    """
+    Compute the distance along a Hilbert curve of grid cells. Cells that are close along the curve
+    are close in space, so visiting cells in order of their index keeps neighboring cells together.
+    :param x: Array of integer column of each cell, in [0, 2**order)
+    :param y: Array of integer row of each cell, in [0, 2**order)
+    :param order: Number of bits per axis of the grid
+    :return: Array of int64 Hilbert index of each cell
+    """
+    n = 1 << order
+    x = np.asarray(x, dtype=np.int64)
+    y = np.asarray(y, dtype=np.int64)
+    index = np.zeros(np.broadcast(x, y).shape, dtype=np.int64)
+    s = n >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        index += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant so that the curve within it starts and ends next to its neighbors
+        flip = rx & ~ry
+        x = np.where(flip, n - 1 - x, x)
+        y = np.where(flip, n - 1 - y, y)
+        x, y = np.where(ry, x, y), np.where(ry, y, x)
+        s >>= 1
+    return index
+
+
+def hilbert_order(points: np.ndarray, order: int = HILBERT_ORDER) -> np.ndarray:
+    """
+    Sort points by their Hilbert index on a grid covering the extent of the points.
+    :param points: Array of shape (number of points, 2) of x and y coordinates
+    :param order: Number of bits per axis of the grid, see hilbert_index
+    :return: Array of indices of points in Hilbert order (ties keep the order of points)
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(points) < 2:
+        return np.arange(len(points))
+    lower = points.min(axis=0)
+    extent = points.max(axis=0) - lower
+    extent[extent == 0] = 1.0
+    cells = np.minimum(((points - lower) / extent * (1 << order)).astype(np.int64), (1 << order) - 1)
+    return np.argsort(hilbert_index(cells[:, 0], cells[:, 1], order), kind='stable')
+
+
+def entity_hilbert_order(entities: List[dict]) -> np.ndarray:
+    """
+    Order CARMA entities (HUC12s, counties, sub-HUC12s) by the Hilbert index of their centroids, so that
+    entities processed one after another, or together by the same worker, read the same raster blocks.
+    :param entities: CARMA entities with a 'geometry' attribute
+    :return: Array of indices of entities in Hilbert order
+    """
+    centroids = [shape(e['geometry']).centroid for e in entities]
+    return hilbert_order(np.array([(c.x, c.y) if not c.is_empty else (0.0, 0.0) for c in centroids]))
@@ -0,0 +1,78 @@
+# Copyright (C) 2021-present University of Louisiana at Lafayette.
+# All rights reserved. Licensed under the GPLv3 License. See LICENSE.txt in the project root for license information.
+
+import os
+import json
+
+import numpy as np
+
+from . import NUM_CATEGORICAL_CLASSES
+from . overview import entity_key
+
+
+# Suffix of the sidecar file, stored next to a CARMA document, holding class histograms of its entities
+HISTOGRAM_SIDECAR_SUFFIX = '-histograms.json'
+
+CDL_LAYER = 'cdl'
+NLCD_LAYER = 'nlcd'
+
+
+def get_histogram_sidecar_path(document_path: str) -> str:
+    return f"{os.path.splitext(document_path)[0]}{HISTOGRAM_SIDECAR_SUFFIX}"
+
+
+class HistogramStore:
+    """
+    Class histograms (arrays of length 256 of pixel counts, or of summed coverage fractions, by raster value)
+    of entities, keyed by layer (e.g. 'cdl'), year, and entity key. Stored as sparse JSON so that
+    derived values can be recomputed, or summed to parent geographies, without re-reading rasters.
+    """
+    def __init__(self):
+        self.histograms = {}
+
+    def put(self, layer: str, year: int, key: str, histogram: np.ndarray):
+        self.histograms.setdefault(layer, {}).setdefault(str(year), {})[key] = histogram
+
+    def get(self, layer: str, year: int, key: str) -> np.ndarray:
+        return self.histograms.get(layer, {}).get(str(year), {}).get(key)
+
+    def put_entity(self, layer: str, entity: dict, histograms: dict):
+        """
+        Store the histograms of a CARMA entity (HUC12, county, sub-HUC12), keyed by zonal.overview.entity_key.
+        :param histograms: Dict mapping year to histogram
+        """
+        for year, histogram in histograms.items():
+            self.put(layer, year, entity_key(entity), histogram)
+
+    def get_entity(self, layer: str, year: int, entity: dict) -> np.ndarray:
+        return self.get(layer, year, entity_key(entity))
+
+    def save(self, path: str):
+        sparse = {layer: {year: {key: {str(dn): h[dn].item() for dn in np.flatnonzero(h)}
+                                 for key, h in by_key.items()}
+                          for year, by_key in by_year.items()}
+                  for layer, by_year in self.histograms.items()}
+        with open(path, 'w') as f:
+            json.dump(sparse, f)
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Load histograms from a sidecar file.
+        :param path: Path of sidecar file
+        :return: HistogramStore, which will be empty if the sidecar file does not exist
+        """
+        store = cls()
+        if os.path.exists(path):
+            with open(path) as f:
+                sparse = json.load(f)
+            for layer, by_year in sparse.items():
+                for year, by_key in by_year.items():
+                    for key, counts in by_key.items():
+                        # Histograms computed with the coverage backend hold summed coverage fractions
+                        dtype = np.float64 if any(isinstance(c, float) for c in counts.values()) else np.int64
+                        histogram = np.zeros(NUM_CATEGORICAL_CLASSES, dtype=dtype)
+                        for dn, count in counts.items():
+                            histogram[int(dn)] = count
+                        store.put(layer, year, key, histogram)
+        return store
@@ -0,0 +1,107 @@
+# Copyright (C) 2021-present University of Louisiana at Lafayette.
+# All rights reserved. Licensed under the GPLv3 License. See LICENSE.txt in the project root for license information.
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+# Memory limit of the per-process zone mask cache, in megabytes; 0 disables the cache
+MASK_CACHE_MB_ENV = 'CARMA_MASK_CACHE_MB'
+DEFAULT_MASK_CACHE_MB = 256
+
+logger = logging.getLogger(__name__)
+
+
+class MaskCache:
+    """
+    Least-recently-used cache of rasterized zone masks, keyed by (geometry hash, raster grid signature).
+    Rasterizing complex geometries (e.g. coastal HUC12s and counties with thousands of vertices)
+    can cost more than reading pixels; rasters on identical grids (e.g. several years of CDL and NLCD)
+    share the same mask. Masks are stored bit-packed, using one bit per pixel. The cache may be shared by threads.
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._masks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return (f"MaskCache(masks={len(self._masks)}, nbytes={self.nbytes}, max_bytes={self.max_bytes}, "
+                f"hits={self.hits}, misses={self.misses})")
+
+    def stats(self) -> dict:
+        return {'masks': len(self._masks),
+                'nbytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses}
+
+    def clear(self):
+        with self._lock:
+            self._masks.clear()
+            self.nbytes = 0
+
+    def get(self, geometry_key: str, signature: tuple) -> np.ndarray:
+        """
+        :param geometry_key: Hash of zone geometry
+        :param signature: Grid signature of the mask, see zonal.grid_signature
+        :return: Boolean mask, or None if not cached
+        """
+        key = (geometry_key, signature)
+        with self._lock:
+            packed = self._masks.get(key)
+            if packed is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._masks.move_to_end(key)
+        height, width = signature[1]
+        return np.unpackbits(packed, count=height * width).reshape(height, width).view(bool)
+
+    def put(self, geometry_key: str, signature: tuple, mask: np.ndarray):
+        packed = np.packbits(mask)
+        if packed.nbytes > self.max_bytes:
+            return
+        key = (geometry_key, signature)
+        with self._lock:
+            previous = self._masks.pop(key, None)
+            if previous is not None:
+                self.nbytes -= previous.nbytes
+            self._masks[key] = packed
+            self.nbytes += packed.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._masks.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+
+_mask_cache = None
+
+
+def get_mask_cache() -> MaskCache:
+    """
+    Get the zone mask cache for this process, creating it if needed. Its memory limit is
+    read from the CARMA_MASK_CACHE_MB environment variable.
+    :return: MaskCache, or None if the mask cache is disabled
+    """
+    global _mask_cache
+    if _mask_cache is None:
+        max_mb = int(os.environ.get(MASK_CACHE_MB_ENV, DEFAULT_MASK_CACHE_MB))
+        _mask_cache = MaskCache(max_mb * 1024 * 1024)
+    if _mask_cache.max_bytes <= 0:
+        return None
+    return _mask_cache
+
+
+def set_mask_cache_size(max_mb: int):
+    """
+    Set the memory limit of the zone mask cache for this process, discarding any cached masks.
+    :param max_mb: Memory limit in megabytes; 0 disables the cache
+    """
+    global _mask_cache
+    _mask_cache = MaskCache(max_mb * 1024 * 1024)
@@ -0,0 +1,110 @@
+# Copyright (C) 2021-present University of Louisiana at Lafayette.
+# All rights reserved. Licensed under the GPLv3 License. See LICENSE.txt in the project root for license information.
+
+from collections import OrderedDict
+from typing import Optional, Tuple
+import os
+import math
+import logging
+
+import simplejson as json
+
+from . datasets import get_dataset
+
+
+# Suffix of the sidecar file, stored next to a CARMA document, holding standard errors of
+# crop and developed areas computed from raster overviews
+ZONAL_ERROR_SIDECAR_SUFFIX = '-zonal-error.json'
+
+logger = logging.getLogger(__name__)
+
+
+def select_overview(raster_path: str, zonal_resolution: int) -> Tuple[Optional[int], int]:
+    """
+    Choose the coarsest overview of a raster that is at most zonal_resolution times coarser than
+    the full resolution raster. Categorical rasters prepared with bin/prepare-cog.sh have mode
+    overviews with decimation factors of 2 to 64.
+    :param raster_path: Path of raster
+    :param zonal_resolution: Maximum decimation factor; 1 selects the full resolution raster
+    :return: Tuple consisting of: index of overview level (None for full resolution), and its decimation factor
+    """
+    if zonal_resolution <= 1:
+        return None, 1
+    factors = get_dataset(raster_path).overviews(1)
+    levels = [(level, f) for level, f in enumerate(factors) if f <= zonal_resolution]
+    if not levels:
+        logger.warning(f"Raster {raster_path} has no overview at most {zonal_resolution} times coarser than "
+                       f"full resolution (overviews: {factors}), using full resolution. "
+                       "Run bin/prepare-cog.sh to build overviews.")
+        return None, 1
+    level, factor = max(levels, key=lambda lf: lf[1])
+    logger.debug(f"Using overview level {level} ({factor}x coarser) of {raster_path}")
+    return level, factor
+
+
+def proportion_standard_error(count: int, total: int, factor: int) -> float:
+    """
+    Estimate the standard error of the proportion of a zone in a class (e.g. crops) when measured
+    from an overview rather than at full resolution. Each overview pixel is treated as a sample of
+    the factor x factor full resolution pixels it covers, with a finite population correction.
+    This ignores spatial autocorrelation, as well as the tendency of mode overviews to under-count
+    small, scattered patches of a class, so it should be read as an order of magnitude.
+    :param count: Number of overview pixels in the class
+    :param total: Number of overview pixels in the zone
+    :param factor: Decimation factor of the overview
+    :return: Standard error of the proportion; 0.0 at full resolution or if there are no pixels
+    """
+    if factor <= 1 or total == 0:
+        return 0.0
+    p = count / total
+    return math.sqrt(p * (1 - p) / total * (1 - 1 / (factor * factor)))
+
+
+def get_zonal_error_sidecar_path(document_path: str) -> str:
+    return f"{os.path.splitext(document_path)[0]}{ZONAL_ERROR_SIDECAR_SUFFIX}"
+
+
+def entity_key(entity: dict) -> str:
+    # Sub-HUC12s have no ID; key them by HUC12 and county, like rollup.subhuc12_key
+    if 'id' in entity:
+        return entity['id']
+    return f"{entity['huc12']}|{entity['county']}"
+
+
+class ZonalErrorReport:
+    """
+    Standard errors of the crop and developed areas of CARMA entities computed from raster overviews
+    (see select_overview), keyed by entity, attribute ('crops' or 'developedArea'), and year.
+    Saved as a sidecar file rather than in the CARMA document, so that documents still validate
+    against the CARMA schema.
+    """
+    def __init__(self, zonal_resolution: int):
+        self.zonal_resolution = zonal_resolution
+        self.errors = OrderedDict()
+        self.relative_errors = {}
+
+    def add(self, entity: dict, attribute: str, year: int, standard_error: float):
+        self.errors.setdefault(entity_key(entity), OrderedDict()).setdefault(attribute, OrderedDict())[str(year)] = \
+            standard_error
+        if entity['area'] > 0:
+            relative = standard_error / entity['area']
+            self.relative_errors[attribute] = max(relative, self.relative_errors.get(attribute, 0.0))
+
+    def add_zonal_stats(self, entity: dict, zonal_stats):
+        """
+        Add the standard errors of all years of a zonal.engine.ZonalStatsResult for entity.
+        """
+        for year, standard_error in zonal_stats.crop_area_errors.items():
+            self.add(entity, 'crops', year, standard_error)
+        for year, standard_error in zonal_stats.developed_area_errors.items():
+            self.add(entity, 'developedArea', year, standard_error)
+
+    def summary(self) -> str:
+        parts = [f"{attribute}: {100 * relative:.2f}%" for attribute, relative in self.relative_errors.items()]
+        return (f"Zonal statistics computed at up to {self.zonal_resolution}x coarser resolution; "
+                f"maximum standard error as percentage of entity area: {', '.join(parts) or 'none'}")
+
+    def save(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(OrderedDict([('zonalResolution', self.zonal_resolution),
+                                   ('standardErrors', self.errors)]), f)
@@ -0,0 +1,120 @@
+# Copyright (C) 2021-present University of Louisiana at Lafayette.
+# All rights reserved. Licensed under the GPLv3 License. See LICENSE.txt in the project root for license information.
+
+from typing import Optional
+import os
+import logging
+
+import numpy as np
+import rasterio
+import simplejson as json
+from affine import Affine
+from rasterio.windows import Window
+from tqdm import tqdm
+
+from .. cache import dataset_fingerprint
+
+
+# Suffixes of the files, stored next to a raster, holding its uncompressed pixels and their georeference
+RAW_RASTER_SUFFIX = '-raw.npy'
+RAW_RASTER_META_SUFFIX = '-raw.json'
+# Approximate size of the strips of rows decoded at once while writing raw rasters, in megabytes
+RAW_RASTER_STRIP_MB = 64
+
+logger = logging.getLogger(__name__)
+
+
+def get_raw_raster_path(raster_path: str) -> str:
+    return f"{os.path.splitext(raster_path)[0]}{RAW_RASTER_SUFFIX}"
+
+
+def get_raw_raster_meta_path(raster_path: str) -> str:
+    return f"{os.path.splitext(raster_path)[0]}{RAW_RASTER_META_SUFFIX}"
+
+
+class RawRaster:
+    """
+    Uncompressed copy of the first band of a raster (e.g. CDL, NLCD), stored as a .npy file and memory-mapped,
+    so that windows are read as array slices without decoding. Processes reading the same raw raster share
+    its pages through the OS page cache.
+    """
+    def __init__(self, data: np.ndarray, transform: Affine):
+        self.data = data
+        self.transform = transform
+
+    def matches(self, dataset) -> bool:
+        """
+        :return: True if the raw raster holds the pixels of dataset, i.e. dataset is not an overview
+        """
+        return self.data.shape == dataset.shape and self.transform == dataset.transform \
+            and self.data.dtype == np.dtype(dataset.dtypes[0])
+
+    @classmethod
+    def load(cls, raster_path: str):
+        """
+        Load the raw raster of a raster, memory-mapped, if it has been built and the raster has not changed since.
+        :return: RawRaster, or None if there is no up-to-date raw raster
+        """
+        meta_path = get_raw_raster_meta_path(raster_path)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        _, mtime_ns, size = dataset_fingerprint(raster_path)
+        if meta['source_mtime_ns'] != mtime_ns or meta['source_size'] != size:
+            logger.warning(f"Ignoring raw raster of {raster_path}, which has changed since it was built.")
+            return None
+        data = np.load(get_raw_raster_path(raster_path), mmap_mode='r')
+        return cls(data, Affine(*meta['transform']))
+
+
+def build_raw_raster(raster_path: str, show_progress: bool = True) -> str:
+    """
+    Write the first band of a raster uncompressed next to it, see RawRaster.
+    :param raster_path: Path of raster
+    :param show_progress: Display a progress bar
+    :return: Path of raw raster
+    """
+    with rasterio.open(raster_path) as dataset:
+        dtype = np.dtype(dataset.dtypes[0])
+        path = get_raw_raster_path(raster_path)
+        tmp_path = f"{path}.tmp"
+        data = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype, shape=(dataset.height, dataset.width))
+        # Decode whole blocks at once
+        block_height = dataset.block_shapes[0][0]
+        strip_rows = RAW_RASTER_STRIP_MB * 1024 * 1024 // max(1, dataset.width * dtype.itemsize)
+        strip_height = max(block_height, strip_rows // block_height * block_height)
+        for row in tqdm(range(0, dataset.height, strip_height), disable=not show_progress,
+                        desc=f"Writing raw raster of {raster_path}"):
+            height = min(strip_height, dataset.height - row)
+            data[row:row + height] = dataset.read(1, window=Window(0, row, dataset.width, height))
+        data.flush()
+        del data
+        os.replace(tmp_path, path)
+
+        _, mtime_ns, size = dataset_fingerprint(raster_path)
+        with open(get_raw_raster_meta_path(raster_path), 'w') as f:
+            json.dump({'transform': list(dataset.transform)[:6],
+                       'crs': dataset.crs.to_wkt() if dataset.crs else None,
+                       'nodata': dataset.nodatavals[0],
+                       'width': dataset.width,
+                       'height': dataset.height,
+                       'source_mtime_ns': mtime_ns,
+                       'source_size': size}, f)
+    # Forget any previous raw raster (or its absence) so that this process maps the new one
+    _raw_rasters.pop(raster_path, None)
+    logger.debug(f"Saved raw raster of {raster_path} to {path}")
+    return path
+
+
+_raw_rasters = {}
+
+
+def get_raw_raster(raster_path: str) -> Optional[RawRaster]:
+    """
+    Get the raw raster of a raster, memory-mapping it once per process.
+    :return: RawRaster, or None if there is no up-to-date raw raster
+    """
+    if raster_path not in _raw_rasters:
+        _raw_rasters[raster_path] = RawRaster.load(raster_path)
+    return _raw_rasters[raster_path]
@@ -0,0 +1,90 @@
+# Copyright (C) 2021-present University of Louisiana at Lafayette.
+# All rights reserved. Licensed under the GPLv3 License. See LICENSE.txt in the project root for license information.
+
+from collections import defaultdict
+from typing import List, Tuple
+import logging
+
+import numpy as np
+
+from . import NUM_CATEGORICAL_CLASSES
+from . engine import ZonalStatsEngine
+from . hilbert import entity_hilbert_order
+from . update import crops_entry, developed_area_entry, set_year_entry
+from . histograms import HistogramStore, CDL_LAYER, NLCD_LAYER, get_histogram_sidecar_path
+
+
+# Maximum relative difference between the area of a parent (HUC12 or county) and the summed area
+# of its sub-HUC12s for the parent to be considered covered, and its histograms rolled up
+ROLLUP_AREA_TOLERANCE = 0.005
+
+logger = logging.getLogger(__name__)
+
+
+def subhuc12_key(sub_huc: dict) -> str:
+    return f"{sub_huc['huc12']}|{sub_huc['county']}"
+
+
+def sum_histograms(store: HistogramStore, layer: str, year: int,
+                   sub_huc12s: List[dict], parent_attr: str) -> dict:
+    """
+    Sum sub-HUC12 histograms to their parent HUC12s or counties.
+    :param parent_attr: Sub-HUC12 attribute identifying the parent, either 'huc12' or 'county'
+    :return: Dict mapping parent ID to summed histogram
+    """
+    sums = defaultdict(lambda: np.zeros(NUM_CATEGORICAL_CLASSES, dtype=np.int64))
+    for sub_huc in sub_huc12s:
+        histogram = store.get(layer, year, subhuc12_key(sub_huc))
+        if histogram is None:
+            raise KeyError(f"No {layer} {year} histogram for sub-HUC12 {subhuc12_key(sub_huc)}.")
+        sums[sub_huc[parent_attr]] = sums[sub_huc[parent_attr]] + histogram
+    return sums
+
+
+def rollup_entities(entities: List[dict], parent_attr: str, sub_huc12s: List[dict], store: HistogramStore,
+                    cdl_years: List[int], nlcd_years: List[int], fallback_engine: ZonalStatsEngine,
+                    tolerance: float = ROLLUP_AREA_TOLERANCE) -> Tuple[int, int]:
+    """
+    Set crop and developed area for cdl_years and nlcd_years of HUC12s or counties from the sums of
+    the histograms of their sub-HUC12s. Sub-HUC12s partition a parent only if the parent is entirely
+    covered by the geographies of the other type (e.g. a county extending beyond the HUC12s of a
+    document is not); uncovered parents are computed directly from the rasters using fallback_engine.
+    :param entities: HUC12s or counties, with 'id', 'area', 'geometry', 'crops', and 'developedArea'
+    :param parent_attr: Sub-HUC12 attribute identifying the parent, either 'huc12' or 'county'
+    :param sub_huc12s: Sub-HUC12s whose histograms are in store
+    :param store: HistogramStore with CDL and NLCD histograms for sub-HUC12s; NLCD histograms of
+        entities are added to it
+    :param cdl_years: Years of CDL histograms
+    :param nlcd_years: Years of NLCD histograms
+    :param fallback_engine: ZonalStatsEngine, with CDL and NLCD rasters for cdl_years and nlcd_years,
+        for parents that are not covered
+    :param tolerance: Maximum relative difference between parent area and summed sub-HUC12 area
+    :return: Tuple consisting of: number of entities rolled up, number of entities computed directly
+    """
+    child_areas = defaultdict(float)
+    for sub_huc in sub_huc12s:
+        child_areas[sub_huc[parent_attr]] += sub_huc['area']
+    cdl_sums = {year: sum_histograms(store, CDL_LAYER, year, sub_huc12s, parent_attr) for year in cdl_years}
+    nlcd_sums = {year: sum_histograms(store, NLCD_LAYER, year, sub_huc12s, parent_attr) for year in nlcd_years}
+
+    num_rolled_up = 0
+    num_direct = 0
+    # Entities computed directly are visited in Hilbert order, so consecutive ones share raster blocks
+    for e in (entities[i] for i in entity_hilbert_order(entities)):
+        area = e['area']
+        if area > 0 and abs(child_areas[e['id']] - area) / area <= tolerance:
+            cdl_histograms = {year: cdl_sums[year][e['id']] for year in cdl_years}
+            nlcd_histograms = {year: nlcd_sums[year][e['id']] for year in nlcd_years}
+            num_rolled_up += 1
+        else:
+            logger.debug(f"Sub-HUC12s cover {child_areas[e['id']]} of {area} area of {e['id']}, "
+                         "computing zonal statistics directly.")
+            zonal_stats = fallback_engine.compute(e['geometry'], area)
+            cdl_histograms, nlcd_histograms = zonal_stats.cdl_histograms, zonal_stats.nlcd_histograms
+            num_direct += 1
+        store.put_entity(NLCD_LAYER, e, nlcd_histograms)
+        for year in cdl_years:
+            set_year_entry(e.setdefault('crops', []), crops_entry(year, cdl_histograms[year], area))
+        for year in nlcd_years:
+            set_year_entry(e.setdefault('developedArea', []), developed_area_entry(year, nlcd_histograms[year], area))
+    return num_rolled_up, num_direct
@@ -0,0 +1,152 @@
+# Copyright (C) 2021-present University of Louisiana at Lafayette.
+# All rights reserved. Licensed under the GPLv3 License. See LICENSE.txt in the project root for license information.
+
+from typing import Optional
+import os
+import math
+import logging
+
+import numpy as np
+import rasterio
+import simplejson as json
+from rasterio.windows import Window
+from tqdm import tqdm
+
+from .. cache import dataset_fingerprint
+
+
+# Suffixes of the files, stored next to a raster, holding its per-tile class counts and their metadata
+TILE_HISTOGRAMS_SUFFIX = '-tile-histograms.npy'
+TILE_HISTOGRAMS_META_SUFFIX = '-tile-histograms.json'
+# Size (in pixels) of tiles of rasters that are not internally tiled
+DEFAULT_TILE_SIZE = 512
+# Counts are kept for every value of uint8 rasters, like zonal.NUM_CATEGORICAL_CLASSES
+NUM_CLASSES = 256
+
+logger = logging.getLogger(__name__)
+
+
+def get_tile_histograms_path(raster_path: str) -> str:
+    return f"{os.path.splitext(raster_path)[0]}{TILE_HISTOGRAMS_SUFFIX}"
+
+
+def get_tile_histograms_meta_path(raster_path: str) -> str:
+    return f"{os.path.splitext(raster_path)[0]}{TILE_HISTOGRAMS_META_SUFFIX}"
+
+
+class TileHistograms:
+    """
+    Class counts of the square tiles of a uint8 categorical raster (e.g. CDL, NLCD), laid out on a grid
+    from the raster origin and excluding nodata. Counts are stored as a row-wise integral histogram:
+    integral[r, c] holds the summed counts of tiles 0 to c - 1 of tile row r, so that the counts of any
+    run of tiles in a row take one subtraction. Zonal statistics use stored counts for tiles entirely
+    inside a zone, and only read the pixels of tiles crossed by its boundary.
+    """
+    def __init__(self, integral: np.ndarray, tile_size: int, width: int, height: int):
+        self.integral = integral
+        self.tile_size = tile_size
+        self.width = width
+        self.height = height
+
+    @property
+    def num_rows(self) -> int:
+        return self.integral.shape[0]
+
+    @property
+    def num_cols(self) -> int:
+        return self.integral.shape[1] - 1
+
+    def tile_window(self, row: int, col: int) -> Window:
+        """
+        :return: Window of a tile, clipped to the raster extent
+        """
+        row_off, col_off = row * self.tile_size, col * self.tile_size
+        return Window(col_off, row_off, min(self.tile_size, self.width - col_off),
+                      min(self.tile_size, self.height - row_off))
+
+    def run_counts(self, row: int, col_start: int, col_stop: int) -> np.ndarray:
+        """
+        :return: Array of length 256 of summed class counts of tiles col_start to col_stop - 1 of a tile row
+        """
+        return self.integral[row, col_stop].astype(np.int64) - self.integral[row, col_start]
+
+    @classmethod
+    def load(cls, raster_path: str):
+        """
+        Load the tile histograms of a raster, memory-mapped, if they have been built and the raster
+        has not changed since.
+        :return: TileHistograms, or None if there are no up-to-date tile histograms
+        """
+        meta_path = get_tile_histograms_meta_path(raster_path)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        _, mtime_ns, size = dataset_fingerprint(raster_path)
+        if meta['source_mtime_ns'] != mtime_ns or meta['source_size'] != size:
+            logger.warning(f"Ignoring tile histograms of {raster_path}, which has changed since they were built.")
+            return None
+        integral = np.load(get_tile_histograms_path(raster_path), mmap_mode='r')
+        return cls(integral, meta['tile_size'], meta['width'], meta['height'])
+
+
+def build_tile_histograms(raster_path: str, tile_size: int = None, show_progress: bool = True) -> str:
+    """
+    Count the classes of each tile of a uint8 raster and save them next to it, see TileHistograms.
+    :param raster_path: Path of uint8 raster
+    :param tile_size: Size of tiles in pixels; defaults to the block size of internally tiled
+        rasters (so that boundary tiles can be read without decoding other blocks), or DEFAULT_TILE_SIZE
+    :param show_progress: Display a progress bar
+    :return: Path of tile histograms
+    """
+    with rasterio.open(raster_path) as dataset:
+        if np.dtype(dataset.dtypes[0]) != np.uint8:
+            raise ValueError(f"Tile histograms require a uint8 raster, but {raster_path} is {dataset.dtypes[0]}.")
+        if tile_size is None:
+            block_height, block_width = dataset.block_shapes[0]
+            tile_size = block_width if block_height == block_width and block_width < dataset.width \
+                else DEFAULT_TILE_SIZE
+        if dataset.width * tile_size >= 2 ** 32:
+            raise ValueError(f"Tile rows of {raster_path} are too large to count with tile size {tile_size}.")
+        num_rows, num_cols = math.ceil(dataset.height / tile_size), math.ceil(dataset.width / tile_size)
+        nodata = dataset.nodatavals[0]
+        path = get_tile_histograms_path(raster_path)
+        tmp_path = f"{path}.tmp"
+        integral = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint32,
+                                             shape=(num_rows, num_cols + 1, NUM_CLASSES))
+        tile_cols = (np.arange(dataset.width) // tile_size) * NUM_CLASSES
+        for row in tqdm(range(num_rows), disable=not show_progress, desc=f"Counting tiles of {raster_path}"):
+            window = Window(0, row * tile_size, dataset.width, min(tile_size, dataset.height - row * tile_size))
+            data = dataset.read(1, window=window)
+            keys = tile_cols[np.newaxis, :] + data
+            if nodata is not None:
+                keys = keys[data != nodata]
+            counts = np.bincount(keys.ravel(), minlength=num_cols * NUM_CLASSES).reshape(num_cols, NUM_CLASSES)
+            integral[row, 0] = 0
+            integral[row, 1:] = np.cumsum(counts, axis=0)
+        integral.flush()
+        del integral
+        os.replace(tmp_path, path)
+
+        _, mtime_ns, size = dataset_fingerprint(raster_path)
+        with open(get_tile_histograms_meta_path(raster_path), 'w') as f:
+            json.dump({'tile_size': tile_size,
+                       'width': dataset.width,
+                       'height': dataset.height,
+                       'source_mtime_ns': mtime_ns,
+                       'source_size': size}, f)
+    logger.debug(f"Saved {num_rows}x{num_cols} tile histograms of {raster_path} to {path}")
+    return path
+
+
+_tile_histograms = {}
+
+
+def get_tile_histograms(raster_path: str) -> Optional[TileHistograms]:
+    """
+    Get the tile histograms of a raster, loading them once per process.
+    :return: TileHistograms, or None if there are no up-to-date tile histograms
+    """
+    if raster_path not in _tile_histograms:
+        _tile_histograms[raster_path] = TileHistograms.load(raster_path)
+    return _tile_histograms[raster_path]
@@ -0,0 +1,151 @@
+# Copyright (C) 2021-present University of Louisiana at Lafayette.
+# All rights reserved. Licensed under the GPLv3 License. See LICENSE.txt in the project root for license information.
+
+from collections import OrderedDict
+from functools import partial
+from typing import Tuple
+import os
+import logging
+
+import numpy as np
+
+from rasterio.windows import Window
+
+from . import NUM_CATEGORICAL_CLASSES, bounds_window, read_window, zone_weights, map_zone_chunks, \
+    empty_histogram, get_zonal_backend, dataset_zone
+from . datasets import get_dataset
+from .. cache import memoize, dataset_fingerprint
+
+
+# Suffix of the sidecar file, stored next to a CARMA document, holding land cover transitions of its entities
+TRANSITIONS_SIDECAR_SUFFIX = '-transitions.json'
+# Maximum distance, in pixels, of the origin of a raster from the grid of the raster it is paired with
+GRID_ALIGNMENT_TOLERANCE = 1e-3
+
+logger = logging.getLogger(__name__)
+
+
+def get_transitions_sidecar_path(document_path: str) -> str:
+    return f"{os.path.splitext(document_path)[0]}{TRANSITIONS_SIDECAR_SUFFIX}"
+
+
+def grid_offset(from_dataset, to_dataset) -> Tuple[int, int]:
+    """
+    Get the offset between the pixel grids of two rasters, which must have the same pixel size and
+    be aligned to whole pixels (e.g. two years of CDL or NLCD).
+    :return: Tuple of (row, column) of pixel (0, 0) of from_dataset in to_dataset
+    :raises ValueError: if the grids are not aligned
+    """
+    from_transform, to_transform = from_dataset.transform, to_dataset.transform
+    col, row = ~to_transform * (from_transform.c, from_transform.f)
+    same_pixels = np.allclose([from_transform.a, from_transform.b, from_transform.d, from_transform.e],
+                              [to_transform.a, to_transform.b, to_transform.d, to_transform.e], rtol=1e-9, atol=0)
+    if not same_pixels or abs(col - round(col)) > GRID_ALIGNMENT_TOLERANCE \
+            or abs(row - round(row)) > GRID_ALIGNMENT_TOLERANCE:
+        raise ValueError(f"Pixel grids of {from_dataset.name} and {to_dataset.name} are not aligned.")
+    return int(round(row)), int(round(col))
+
+
+def transition_matrix(from_data: np.ndarray, to_data: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """
+    Count the pixels of each pair of values of two aligned windows of uint8 categorical rasters,
+    with a single bincount of combined (from, to) values.
+    :param from_data: Window of earlier raster
+    :param to_data: Window of later raster
+    :param weights: Zone mask, or coverage fractions, of the windows, see zonal.zone_weights
+    :return: Array of shape (256, 256) of pixel counts (or summed weights) indexed by (from value, to value)
+    """
+    if from_data.dtype != np.uint8 or to_data.dtype != np.uint8:
+        raise ValueError(f"Transition matrices require uint8 raster data, not {from_data.dtype} and {to_data.dtype}.")
+    inside = weights > 0
+    pairs = from_data[inside].astype(np.int64) * NUM_CATEGORICAL_CLASSES + to_data[inside]
+    counts = np.bincount(pairs, weights=None if weights.dtype == bool else weights[inside],
+                         minlength=NUM_CATEGORICAL_CLASSES * NUM_CATEGORICAL_CLASSES)
+    return counts.reshape(NUM_CATEGORICAL_CLASSES, NUM_CATEGORICAL_CLASSES)
+
+
+def _empty_matrix() -> np.ndarray:
+    return np.zeros((NUM_CATEGORICAL_CLASSES, NUM_CATEGORICAL_CLASSES), dtype=empty_histogram().dtype)
+
+
+def _window_transitions(from_dataset, to_dataset, window: Window, weights: np.ndarray) -> np.ndarray:
+    row_offset, col_offset = grid_offset(from_dataset, to_dataset)
+    from_data, from_valid = read_window(from_dataset, window)
+    to_data, to_valid = read_window(to_dataset, Window(window.col_off + col_offset, window.row_off + row_offset,
+                                                       window.width, window.height))
+    return transition_matrix(from_data, to_data, weights * from_valid * to_valid)
+
+
+def _chunk_transitions(to_path: str, raster_path: str, overview_level: int, geometry: dict, geometry_key: str,
+                       window: Window, band: int) -> np.ndarray:
+    from_dataset = get_dataset(raster_path)
+    weights = zone_weights(geometry, window, from_dataset.transform, geometry_key=geometry_key)
+    if not weights.any():
+        return _empty_matrix()
+    return _window_transitions(from_dataset, get_dataset(to_path), window, weights)
+
+
+def zone_transitions(from_path: str, to_path: str, geometry: dict, bounds: tuple = None,
+                     masks: dict = None) -> np.ndarray:
+    """
+    Compute the transition matrix of two aligned uint8 categorical rasters inside a zone, reading both rasters
+    window by window (in chunks across the thread pool for large zones, see zonal.map_zone_chunks).
+    Pixels that are nodata in either raster are not counted.
+    :param from_path: Path of earlier raster, e.g. CDL 2010
+    :param to_path: Path of later raster, e.g. CDL 2015
+    :param geometry: GeoJSON-like zone geometry
+    :param bounds: Bounds of geometry, computed if not provided
+    :param masks: Optional dict of zone masks by grid signature, see zonal.zone_mask
+    :return: Array of shape (256, 256) of pixel counts indexed by (from value, to value)
+    """
+    geometry, bounds = dataset_zone(get_dataset(from_path), geometry, bounds)
+    results = map_zone_chunks(partial(_chunk_transitions, to_path), from_path, None, geometry, bounds, 1)
+    if results is None:
+        from_dataset = get_dataset(from_path)
+        window = bounds_window(bounds, from_dataset.transform)
+        weights = zone_weights(geometry, window, from_dataset.transform, masks)
+        return _window_transitions(from_dataset, get_dataset(to_path), window, weights)
+    matrix = _empty_matrix()
+    for chunk_matrix in results:
+        matrix += chunk_matrix
+    return matrix
+
+
+def cached_zone_transitions(from_path: str, to_path: str, geometry: dict, bounds: tuple = None,
+                            masks: dict = None) -> np.ndarray:
+    """
+    Compute the transition matrix of two rasters inside a zone (see zone_transitions), using the derived
+    attribute cache. Matrices are cached sparse, since most pairs of values do not occur.
+    :return: Array of shape (256, 256) of pixel counts indexed by (from value, to value)
+    """
+    def _compute_sparse():
+        matrix = zone_transitions(from_path, to_path, geometry, bounds, masks).ravel()
+        pairs = np.flatnonzero(matrix)
+        return pairs, matrix[pairs]
+
+    pairs, counts = memoize('zone_transitions', geometry, from_path, _compute_sparse,
+                            dataset_fingerprint(to_path), get_zonal_backend())
+    matrix = np.zeros(NUM_CATEGORICAL_CLASSES * NUM_CATEGORICAL_CLASSES, dtype=counts.dtype)
+    matrix[pairs] = counts
+    return matrix.reshape(NUM_CATEGORICAL_CLASSES, NUM_CATEGORICAL_CLASSES)
+
+
+def transition_areas(matrix: np.ndarray, class_names: dict, geography_area: float) -> OrderedDict:
+    """
+    Convert a transition matrix for a geography into areas.
+    :param matrix: Transition matrix, see zone_transitions
+    :param class_names: Dict mapping raster value to class name (e.g. cropscape.CDL_RASTER_VALUE_TO_NAME);
+        values without names are named by their value, and values sharing a name are summed
+    :param geography_area: Area of the geography
+    :return: Dict mapping earlier class name to dict mapping later class name to area
+    """
+    total = matrix.sum().item()
+    areas = OrderedDict()
+    if total == 0:
+        return areas
+    for from_value, to_value in zip(*np.nonzero(matrix)):
+        from_name = class_names.get(from_value.item(), str(from_value))
+        to_name = class_names.get(to_value.item(), str(to_value))
+        by_to = areas.setdefault(from_name, OrderedDict())
+        by_to[to_name] = by_to.get(to_name, 0.0) + matrix[from_value, to_value].item() / total * geography_area
+    return areas
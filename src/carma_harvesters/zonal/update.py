@@ -0,0 +1,221 @@
+# Copyright (C) 2021-present University of Louisiana at Lafayette.
+# All rights reserved. Licensed under the GPLv3 License. See LICENSE.txt in the project root for license information.
+
+from collections import OrderedDict
+from multiprocessing import Pool
+from typing import List, Tuple, Sequence
+import logging
+import math
+
+import numpy as np
+from tqdm import tqdm
+
+from . import cached_zone_histogram, get_zonal_backend, COVERAGE_BACKEND
+from . datasets import get_dataset, init_worker
+from . batch import batch_categorical_histogram_stack
+from . overview import select_overview, ZonalErrorReport
+from . hilbert import entity_hilbert_order
+from . histograms import HistogramStore, NLCD_LAYER
+from .. util import Geometry
+from .. crops.cropscape import crop_areas_from_histogram, crop_area_standard_error
+from .. nlcd import developed_cells_from_histogram, developed_area_standard_error, NLCD_DEVELOPED_CLASSES
+
+
+# Number of chunks of entities per worker process, so that workers finishing early can pick up more work
+CHUNKS_PER_JOB = 4
+
+logger = logging.getLogger(__name__)
+
+
+def crops_entry(cdl_year: int, histogram: np.ndarray, area: float) -> OrderedDict:
+    """
+    Make the 'crops' entry of a CARMA entity for a year.
+    :param cdl_year: Year of CDL data
+    :param histogram: CDL histogram of the entity
+    :param area: Area of the entity
+    """
+    total_crop_area, crop_areas = crop_areas_from_histogram(histogram, area)
+    logger.debug(f"CDL total crop area: {total_crop_area}")
+    logger.debug(f"CDL individual crop areas: {crop_areas}")
+    return OrderedDict([
+        ('year', cdl_year),
+        ('cropArea', total_crop_area),
+        ('cropAreaDetail', crop_areas)
+    ])
+
+
+def developed_area_entry(nlcd_year: int, histogram: np.ndarray, area: float,
+                         developed_classes: Sequence[int] = NLCD_DEVELOPED_CLASSES) -> OrderedDict:
+    """
+    Make the 'developedArea' entry of a CARMA entity for a year.
+    :param nlcd_year: Year of NLCD data
+    :param histogram: NLCD histogram of the entity
+    :param area: Area of the entity
+    :param developed_classes: NLCD classes counted as developed
+    """
+    developed_nlcd_cells, total_nlcd_cells = developed_cells_from_histogram(histogram, developed_classes)
+    if total_nlcd_cells == 0:
+        developed_proportion = 0.0
+    else:
+        developed_proportion = developed_nlcd_cells / total_nlcd_cells
+    return OrderedDict([
+        ('year', nlcd_year),
+        ('area', area * developed_proportion)
+    ])
+
+
+def set_year_entry(entries: List[dict], entry: dict):
+    """
+    Replace the entry in entries for the same year as entry, or append entry if there is none.
+    """
+    for i, e in enumerate(entries):
+        if e['year'] == entry['year']:
+            entries[i] = entry
+            return
+    entries.append(entry)
+
+
+def batch_histograms_by_year(entities: List[dict], rasters: List[Tuple[int, str]],
+                             show_progress: bool = True, zonal_resolution: int = 1) -> OrderedDict:
+    """
+    Compute the histograms of many entities for several years of a uint8 raster. Zones are
+    rasterized once for all years whose rasters share a pixel grid. With the coverage zonal backend,
+    which batched histograms do not support, histograms are computed one entity at a time (see
+    zonal.cached_zone_histogram), so that they are weighted like those of the extract commands.
+    :param entities: CARMA entities with a 'geometry' attribute
+    :param rasters: List of (year, raster path) tuples
+    :param show_progress: Display a progress bar
+    :param zonal_resolution: Compute histograms from overviews up to this many times coarser than
+        full resolution, see zonal.overview.select_overview
+    :return: OrderedDict mapping year to array of shape (number of entities, 256) of pixel counts
+    """
+    if get_zonal_backend() == COVERAGE_BACKEND:
+        histograms = OrderedDict()
+        for year, path in rasters:
+            level, _ = select_overview(path, zonal_resolution)
+            histograms[year] = np.array([cached_zone_histogram(path, e['geometry'], overview_level=level)
+                                         for e in tqdm(entities, disable=not show_progress,
+                                                       desc=f"Computing zonal statistics for {year}")])
+        return histograms
+
+    zones = [Geometry(e['geometry']) for e in entities]
+    grids = OrderedDict()
+    for year, path in rasters:
+        level, _ = select_overview(path, zonal_resolution)
+        dataset = get_dataset(path, level)
+        grids.setdefault((dataset.transform, dataset.shape), []).append((year, dataset))
+    histograms = OrderedDict()
+    for years_datasets in grids.values():
+        stack = batch_categorical_histogram_stack(zones, [d for _, d in years_datasets],
+                                                  show_progress=show_progress)
+        for (year, _), year_histograms in zip(years_datasets, stack):
+            histograms[year] = year_histograms
+    return histograms
+
+
+def _batch_histograms_worker(args: tuple) -> OrderedDict:
+    geometries, rasters, zonal_resolution = args
+    return batch_histograms_by_year([{'geometry': g} for g in geometries], rasters, show_progress=False,
+                                    zonal_resolution=zonal_resolution)
+
+
+def parallel_histograms_by_year(entities: List[dict], rasters: List[Tuple[int, str]], jobs: int = 1,
+                                show_progress: bool = True, zonal_resolution: int = 1) -> OrderedDict:
+    """
+    Compute the histograms of many entities for several years of a uint8 raster (see
+    batch_histograms_by_year), spreading chunks of entities across worker processes. Entities are
+    chunked in Hilbert order of their centroids, so that each worker reads a compact region of the
+    rasters. Each worker opens the rasters once, and results are merged back in the order of entities.
+    :param entities: CARMA entities with a 'geometry' attribute
+    :param rasters: List of (year, raster path) tuples
+    :param jobs: Number of worker processes; 1 computes histograms in this process
+    :param show_progress: Display a progress bar
+    :param zonal_resolution: See batch_histograms_by_year
+    :return: OrderedDict mapping year to array of shape (number of entities, 256) of pixel counts
+    """
+    if jobs <= 1 or len(entities) < 2:
+        return batch_histograms_by_year(entities, rasters, show_progress, zonal_resolution)
+
+    # Entities of CARMA documents jump around the country (e.g. counties by FIPS code), so chunks of
+    # entities in Hilbert order keep neighboring entities, and the raster blocks they share, together
+    order = entity_hilbert_order(entities)
+    chunk_size = max(1, math.ceil(len(entities) / (jobs * CHUNKS_PER_JOB)))
+    chunks = [([entities[j]['geometry'] for j in order[i:i + chunk_size]], rasters, zonal_resolution)
+              for i in range(0, len(entities), chunk_size)]
+    logger.debug(f"Computing histograms for {len(entities)} entities in {len(chunks)} chunks using {jobs} processes")
+    with Pool(jobs, initializer=init_worker, initargs=(None, [path for _, path in rasters])) as pool:
+        results = list(tqdm(pool.imap(_batch_histograms_worker, chunks), total=len(chunks),
+                            disable=not show_progress, desc='Computing zonal statistics'))
+    histograms = OrderedDict()
+    for year, _ in rasters:
+        merged = np.concatenate([r[year] for r in results])
+        histograms[year] = np.empty_like(merged)
+        histograms[year][order] = merged
+    return histograms
+
+
+def update_entity_crops(entities: List[dict], cdl_rasters: List[Tuple[int, str]],
+                        show_progress: bool = True, jobs: int = 1, zonal_resolution: int = 1,
+                        report: ZonalErrorReport = None) -> int:
+    """
+    Add crop data for each year of CDL to each CARMA entity (HUC12, county, sub-HUC12) that
+    does not already have crop data for that year.
+    :param entities: CARMA entities with 'geometry', 'area', and 'crops' attributes
+    :param cdl_rasters: List of (year, CDL raster path) tuples
+    :param show_progress: Display a progress bar
+    :param jobs: Number of worker processes
+    :param zonal_resolution: See batch_histograms_by_year
+    :param report: ZonalErrorReport to add standard errors of crop areas to
+    :return: Number of entities updated
+    """
+    missing = [{year for year, _ in cdl_rasters} - {c['year'] for c in e['crops']} for e in entities]
+    to_update = [(e, m) for e, m in zip(entities, missing) if m]
+    if not to_update:
+        return 0
+    rasters = [(year, path) for year, path in cdl_rasters if any(year in m for _, m in to_update)]
+    histograms = parallel_histograms_by_year([e for e, _ in to_update], rasters, jobs, show_progress,
+                                             zonal_resolution)
+    factors = {year: select_overview(path, zonal_resolution)[1] for year, path in rasters}
+    for i, (e, m) in enumerate(to_update):
+        for year, _ in rasters:
+            if year in m:
+                e['crops'].append(crops_entry(year, histograms[year][i], e['area']))
+                if report is not None:
+                    report.add(e, 'crops', year,
+                               crop_area_standard_error(histograms[year][i], e['area'], factors[year]))
+    return len(to_update)
+
+
+def update_entity_developed_area(entities: List[dict], nlcd_rasters: List[Tuple[int, str]],
+                                 show_progress: bool = True, jobs: int = 1, zonal_resolution: int = 1,
+                                 report: ZonalErrorReport = None, store: HistogramStore = None) -> int:
+    """
+    Add developed area for each year of NLCD to each CARMA entity (HUC12, county, sub-HUC12) that
+    does not already have developed area for that year.
+    :param entities: CARMA entities with 'geometry', 'area', and 'developedArea' attributes
+    :param nlcd_rasters: List of (year, NLCD raster path) tuples
+    :param show_progress: Display a progress bar
+    :param jobs: Number of worker processes
+    :param zonal_resolution: See batch_histograms_by_year
+    :param report: ZonalErrorReport to add standard errors of developed areas to
+    :param store: HistogramStore to add the NLCD histograms of updated entities to
+    :return: Number of entities updated
+    """
+    missing = [{year for year, _ in nlcd_rasters} - {d['year'] for d in e['developedArea']} for e in entities]
+    to_update = [(e, m) for e, m in zip(entities, missing) if m]
+    if not to_update:
+        return 0
+    rasters = [(year, path) for year, path in nlcd_rasters if any(year in m for _, m in to_update)]
+    histograms = parallel_histograms_by_year([e for e, _ in to_update], rasters, jobs, show_progress,
+                                             zonal_resolution)
+    factors = {year: select_overview(path, zonal_resolution)[1] for year, path in rasters}
+    for i, (e, m) in enumerate(to_update):
+        for year, _ in rasters:
+            if year in m:
+                e['developedArea'].append(developed_area_entry(year, histograms[year][i], e['area']))
+                if store is not None:
+                    store.put_entity(NLCD_LAYER, e, {year: histograms[year][i]})
+                if report is not None:
+                    report.add(e, 'developedArea', year,
+                               developed_area_standard_error(histograms[year][i], e['area'], factors[year]))
+    return len(to_update)
@@ -41,7 +41,12 @@ setuptools.setup(
             'carma-wassi-init=carma_harvesters.cmd.init_wassi_analysis:main',
             'carma-wassi-weight-generate=carma_harvesters.cmd.generate_wassi_weights:main',
             'carma-wassi-disagg-wateruse=carma_harvesters.cmd.wassi_disaggregate:main',
-            'carma-wassi-calculate=carma_harvesters.cmd.wassi_calculate:main'
+            'carma-wassi-calculate=carma_harvesters.cmd.wassi_calculate:main',
+            'carma-cache-prune=carma_harvesters.cmd.prune_cache:main',
+            'carma-tile-histograms-build=carma_harvesters.cmd.build_tile_histograms:main',
+            'carma-developed-area-recompute=carma_harvesters.cmd.recompute_developed_area:main',
+            'carma-transitions-extract=carma_harvesters.cmd.extract_transitions:main',
+            'carma-raw-rasters-build=carma_harvesters.cmd.build_raw_rasters:main'
     ]},
     include_package_data=True,
     zip_safe=False
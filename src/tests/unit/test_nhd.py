@@ -0,0 +1,114 @@
+# Copyright (C) 2021-present University of Louisiana at Lafayette.
+# All rights reserved. Licensed under the GPLv3 License. See LICENSE.txt in the project root for license information.
+
+import unittest
+import tempfile
+import shutil
+import os
+import sqlite3
+
+import numpy as np
+from shapely.geometry import LineString
+
+from carma_harvesters import nhd
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, 'huc12 flowlines.sqlite')
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('create table nhdflowline_network (streamorde integer, streamleve integer, qe_ma real)')
+        conn.executemany('insert into nhdflowline_network values (?, ?, ?)',
+                         [(1, 4, 0.5), (3, 2, 12.25), (2, 3, 3.0)])
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        nhd.close_connections()
+        shutil.rmtree(self.temp_dir)
+
+    def test_huc12_aggregates(self):
+        self.assertEqual(3, nhd.get_huc12_max_stream_order(self.db_path))
+        self.assertEqual(2, nhd.get_huc12_min_stream_level(self.db_path))
+        self.assertEqual(12.25, nhd.get_huc12_mean_annual_flow(self.db_path))
+
+    def test_connection_reused(self):
+        conn = nhd.get_connection(self.db_path, spatialite=False)
+        self.assertIs(conn, nhd.get_connection(self.db_path, spatialite=False))
+        self.assertEqual(1, len(nhd._connections))
+        # Databases are opened read-only
+        self.assertRaises(sqlite3.OperationalError, conn.execute, 'delete from nhdflowline_network')
+        nhd.close_connections()
+        self.assertEqual(0, len(nhd._connections))
+        self.assertIsNot(conn, nhd.get_connection(self.db_path, spatialite=False))
+
+    def test_flowline_filter(self):
+        geometry = {'type': 'Polygon', 'coordinates': [[[-92.0, 30.0], [-91.0, 30.0], [-91.5, 31.0], [-92.0, 30.0]]]}
+        conn = nhd.get_connection(self.db_path, spatialite=False)
+        where, params = nhd.flowline_filter(conn, geometry)
+        self.assertEqual(nhd.FLOWLINE_INTERSECTS, where)
+        # Flowlines are prefiltered by the bounding box of the geometry when there is a spatial index
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(f"create table {nhd.FLOWLINE_SPATIAL_INDEX} (pkid integer, xmin, xmax, ymin, ymax)")
+        conn.commit()
+        conn.close()
+        # Pooled databases are probed for a spatial index once
+        self.assertFalse(nhd.has_spatial_index(nhd.get_connection(self.db_path, spatialite=False)))
+        nhd.close_connections()
+        conn = nhd.get_connection(self.db_path, spatialite=False)
+        self.assertTrue(nhd.has_spatial_index(conn))
+        where, params = nhd.flowline_filter(conn, geometry)
+        self.assertTrue(where.startswith(nhd.FLOWLINE_BBOX_FILTER))
+        self.assertEqual((-91.0, -92.0, 31.0, 30.0), params[:4])
+
+
+def _square(west, south, size):
+    return {'type': 'Polygon', 'coordinates': [[[west, south], [west + size, south], [west + size, south + size],
+                                                [west, south + size], [west, south]]]}
+
+
+class TestFlowlineIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = nhd.FlowlineIndex([LineString([(0.5, 0.5), (0.5, 1.5)]),
+                                        LineString([(0.2, 0.8), (0.8, 0.8)]),
+                                        LineString([(3.5, 0.5), (3.5, 1.5)]),
+                                        LineString([(9.0, 9.0), (9.5, 9.5)])],
+                                       np.array([2, 3, 1, 5]), np.array([4, np.nan, 2, 1]),
+                                       np.array([1.5, 0.25, 7.0, 100.0]))
+
+    def test_intersecting(self):
+        self.assertEqual([0, 1], self.index.intersecting(_square(0.0, 0.0, 1.0)).tolist())
+        # Bounding box of flowline 0 intersects the square, but flowline 0 does not
+        self.assertEqual([], self.index.intersecting(_square(0.6, 1.0, 0.5)).tolist())
+
+    def test_stream_characteristics(self):
+        # Missing stream levels are ignored, like nulls in SQL aggregates
+        self.assertEqual([(3.0, 4.0, 1.5), (0.0, 0.0, 0.0)],
+                         self.index.stream_characteristics([_square(0.0, 0.0, 1.0), _square(2.0, 0.0, 1.0)]))
+        # Without flowlines in a geometry, the nearest flowline in the HUC12 is used
+        huc_geometry = _square(0.0, 0.0, 4.0)
+        self.assertEqual([(1.0, 2.0, 7.0), (3.0, 4.0, 1.5), (2.0, 4.0, 1.5)],
+                         self.index.stream_characteristics([_square(2.0, 0.0, 1.0), _square(0.0, 0.0, 1.0),
+                                                            _square(0.9, 2.0, 1.0)], huc_geometry))
+
+    def test_nearest(self):
+        geometries = [_square(2.0, 0.0, 1.0), _square(0.9, 2.0, 1.0), _square(8.0, 8.0, 0.5)]
+        self.assertEqual([2, 0, 3], self.index.nearest(geometries, np.arange(4)))
+        # Only the given flowlines are searched
+        self.assertEqual([2, 2, 2], self.index.nearest(geometries, np.array([2])))
+        self.assertEqual([None, None, None], self.index.nearest(geometries, np.array([], dtype=int)))
+
+class TestHuc8Bounds(unittest.TestCase):
+    def test_huc8_bounds(self):
+        huc12s = [{'id': 'https://geoconnex.us/usgs/hydrologic-unit/080801030109', 'geometry': _square(0.0, 0.0, 1.0)},
+                  {'id': 'https://geoconnex.us/usgs/hydrologic-unit/080801030201', 'geometry': _square(1.0, 2.0, 1.0)},
+                  {'id': 'https://geoconnex.us/usgs/hydrologic-unit/080801040101', 'geometry': _square(5.0, 5.0, 0.5)}]
+        self.assertEqual('08080103', nhd.huc8_code(huc12s[0]['id']))
+        self.assertEqual('08080103', nhd.huc8_code('080801030109'))
+        self.assertEqual({'08080103': (0.0, 0.0, 2.0, 3.0), '08080104': (5.0, 5.0, 5.5, 5.5)},
+                         nhd.huc8_bounds(huc12s))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,722 @@
+# Copyright (C) 2021-present University of Louisiana at Lafayette.
+# All rights reserved. Licensed under the GPLv3 License. See LICENSE.txt in the project root for license information.
+
+import unittest
+import tempfile
+import shutil
+import os
+import multiprocessing
+import time
+
+import numpy as np
+import rasterio
+import rasterstats
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+from rasterio.warp import transform_bounds, transform_geom
+from shapely.geometry import shape, box
+
+from carma_harvesters import cache
+from carma_harvesters.crops.cropscape import calculate_geography_crop_area, crop_areas_from_histogram, \
+    calculate_geography_crop_area_batch, CDL_RASTER_VALUE_TO_NAME
+from carma_harvesters.nlcd import get_percent_highly_developed_land, get_percent_highly_developed_land_batch
+from carma_harvesters.usgs.recharge import calculate_huc12_mean_recharge, calculate_recharge_stats_batch, \
+    calculate_huc12_mean_recharge_batch
+from carma_harvesters.zonal import datasets, histogram_to_counts, categorical_histogram, zone_histogram, \
+    zone_values, zone_window, split_window, raster_zone_histogram, raster_zone_mean, ZONAL_MAX_MB_ENV, \
+    ZONAL_BACKEND_ENV, COVERAGE_BACKEND, read_window, dataset_zone
+from carma_harvesters.zonal.coverage import coverage_fraction
+from carma_harvesters.zonal.batch import batch_categorical_histograms
+from carma_harvesters.zonal.blockcache import BlockCache
+from carma_harvesters.zonal.maskcache import MaskCache
+from carma_harvesters.zonal.engine import ZonalStatsEngine
+from carma_harvesters.zonal.update import update_entity_crops, update_entity_developed_area, developed_area_entry, \
+    crops_entry, parallel_histograms_by_year
+from carma_harvesters.zonal.hilbert import hilbert_index, hilbert_order, entity_hilbert_order
+from carma_harvesters.zonal.overview import select_overview, ZonalErrorReport
+from carma_harvesters.zonal import tilehistograms
+from carma_harvesters.zonal.tilehistograms import build_tile_histograms
+from carma_harvesters.zonal import rawraster
+from carma_harvesters.zonal.rawraster import build_raw_raster
+from carma_harvesters.zonal.transitions import zone_transitions, cached_zone_transitions, transition_areas
+from carma_harvesters.zonal.rollup import HistogramStore, CDL_LAYER, NLCD_LAYER, subhuc12_key, rollup_entities
+
+
+PIXEL_SIZE = 0.01
+ORIGIN_X = -92.0
+ORIGIN_Y = 31.0
+
+
+def _write_raster(path: str, data: np.ndarray, nodata, pixel_size=PIXEL_SIZE, crs='EPSG:4326',
+                  origin=(ORIGIN_X, ORIGIN_Y), **creation_options):
+    with rasterio.open(path, 'w', driver='GTiff', width=data.shape[1], height=data.shape[0],
+                       count=1, dtype=data.dtype, crs=crs, nodata=nodata,
+                       transform=from_origin(*origin, pixel_size, pixel_size),
+                       **creation_options) as dst:
+        dst.write(data, 1)
+
+
+def _polygon(coords: list) -> dict:
+    return {'type': 'Polygon', 'coordinates': [coords + [coords[0]]]}
+
+
+def _counts_to_histogram(counts: dict) -> np.ndarray:
+    histogram = np.zeros(256, dtype=np.int64)
+    for value, count in counts.items():
+        histogram[value] = count
+    return histogram
+
+
+def _pooled_dataset_count(path: str) -> tuple:
+    count_before = len(datasets._datasets)
+    datasets.get_dataset(path)
+    return count_before, len(datasets._datasets)
+
+
+class TestZonalStatsEngine(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.mkdtemp()
+        cache.set_derived_cache(os.path.join(cls.temp_dir, 'cache.sqlite'))
+        rng = np.random.default_rng(42)
+
+        cdl = rng.choice(np.array([0, 1, 5, 24, 62, 111, 121, 141, 195], dtype=np.uint8), size=(200, 300))
+        cls.cdl_path = os.path.join(cls.temp_dir, 'cdl.tif')
+        _write_raster(cls.cdl_path, cdl, 0)
+        cls.cdl_tiled_path = os.path.join(cls.temp_dir, 'cdl-cog.tif')
+        _write_raster(cls.cdl_tiled_path, cdl, 0, tiled=True, blockxsize=16, blockysize=16)
+        # Another year of CDL on the same grid
+        cls.cdl_2020_path = os.path.join(cls.temp_dir, 'cdl-2020.tif')
+        _write_raster(cls.cdl_2020_path, np.flipud(cdl), 0)
+
+        nlcd = rng.choice(np.array([11, 21, 22, 23, 24, 41, 81, 82], dtype=np.uint8), size=(200, 300))
+        cls.nlcd_path = os.path.join(cls.temp_dir, 'nlcd.tif')
+        _write_raster(cls.nlcd_path, nlcd, 0)
+
+        recharge = rng.uniform(0, 500, size=(40, 60)).astype(np.float32)
+        recharge[:5, :] = -9999.0
+        cls.recharge_path = os.path.join(cls.temp_dir, 'recharge.tif')
+        _write_raster(cls.recharge_path, recharge, -9999.0, pixel_size=PIXEL_SIZE * 5)
+
+        cls.zones = [
+            # Irregular polygon inside the rasters
+            _polygon([[-91.87, 30.95], [-91.21, 30.81], [-91.45, 29.45], [-91.93, 29.62]]),
+            # Polygon overlapping the raster edge
+            _polygon([[-92.2, 31.1], [-91.8, 31.1], [-91.8, 30.7], [-92.2, 30.7]]),
+        ]
+
+    @classmethod
+    def tearDownClass(cls):
+        datasets.close_datasets()
+        cache.get_derived_cache().close()
+        shutil.rmtree(cls.temp_dir)
+
+    def test_compute_matches_rasterstats(self):
+        engine = ZonalStatsEngine(self.cdl_path, self.nlcd_path, self.recharge_path)
+        for zone in self.zones:
+            result = engine.compute(zone, 123.4)
+
+            cdl_stats = rasterstats.zonal_stats(zone, self.cdl_path, categorical=True)[0]
+            total_crop_area, crop_areas = crop_areas_from_histogram(_counts_to_histogram(cdl_stats), 123.4)
+            self.assertAlmostEqual(total_crop_area, result.total_crop_area)
+            self.assertEqual(list(crop_areas.keys()), list(result.crop_areas.keys()))
+            for name, area in crop_areas.items():
+                self.assertAlmostEqual(area, result.crop_areas[name])
+
+            nlcd_stats = rasterstats.zonal_stats(zone, self.nlcd_path, categorical=True)[0]
+            self.assertEqual(nlcd_stats.get(24, 0.0), result.developed_nlcd_cells)
+            self.assertEqual(sum(nlcd_stats.values()), result.total_nlcd_cells)
+
+            recharge_stats = rasterstats.zonal_stats(zone, self.recharge_path)[0]
+            self.assertAlmostEqual(recharge_stats['mean'], result.recharge, places=3)
+
+    def test_helpers_match_engine(self):
+        engine = ZonalStatsEngine(self.cdl_path, self.nlcd_path, self.recharge_path)
+        for zone in self.zones:
+            result = engine.compute(zone, 50.0)
+            self.assertAlmostEqual(result.total_crop_area,
+                                   calculate_geography_crop_area(zone, self.cdl_path, 50.0)[0])
+            self.assertEqual((result.developed_nlcd_cells, result.total_nlcd_cells),
+                             get_percent_highly_developed_land(zone, self.nlcd_path))
+            self.assertAlmostEqual(result.recharge, calculate_huc12_mean_recharge(zone, self.recharge_path))
+
+    def test_dataset_pool(self):
+        dataset = datasets.get_dataset(self.cdl_path)
+        self.assertIs(dataset, datasets.get_dataset(self.cdl_path))
+        # Forked workers must not inherit the parent's handles
+        with multiprocessing.get_context('fork').Pool(1) as pool:
+            count_before, count_after = pool.apply(_pooled_dataset_count, (self.cdl_path,))
+        self.assertEqual(0, count_before)
+        self.assertEqual(1, count_after)
+        self.assertFalse(dataset.closed)
+        datasets.close_datasets()
+        self.assertTrue(dataset.closed)
+        self.assertIsNot(dataset, datasets.get_dataset(self.cdl_path))
+
+    def test_compute_without_recharge(self):
+        engine = ZonalStatsEngine(self.cdl_path, self.nlcd_path)
+        result = engine.compute({'type': 'Feature', 'properties': {}, 'geometry': self.zones[0]}, 1.0)
+        self.assertIsNone(result.recharge)
+        self.assertGreater(result.total_nlcd_cells, 0)
+
+    def test_compute_outside_rasters(self):
+        zone = _polygon([[-80.0, 40.0], [-79.9, 40.0], [-79.9, 39.9]])
+        engine = ZonalStatsEngine(self.cdl_path, self.nlcd_path, self.recharge_path)
+        result = engine.compute(zone, 10.0)
+        self.assertEqual(0.0, result.total_crop_area)
+        self.assertEqual(0, result.total_nlcd_cells)
+        self.assertIsNone(result.recharge)
+
+
+    def test_batch_matches_single(self):
+        # Non-overlapping zones: a grid of triangles, some straddling the raster edge
+        zones = []
+        for i in range(6):
+            for j in range(4):
+                x, y = -92.05 + i * 0.55, 31.05 - j * 0.6
+                zones.append(_polygon([[x, y], [x + 0.5, y - 0.03], [x + 0.1, y - 0.55]]))
+        histograms = batch_categorical_histograms(zones, datasets.get_dataset(self.cdl_path), window_size=32)
+        # Windows are rounded up to whole tiles of the tiled copy
+        tiled_histograms = batch_categorical_histograms(zones, datasets.get_dataset(self.cdl_tiled_path),
+                                                        window_size=20)
+        for zone, histogram, tiled_histogram in zip(zones, histograms, tiled_histograms):
+            stats = rasterstats.zonal_stats(zone, self.cdl_path, categorical=True)[0]
+            self.assertEqual(stats, histogram_to_counts(histogram))
+            self.assertEqual(stats, histogram_to_counts(tiled_histogram))
+
+        areas = [float(i) for i in range(len(zones))]
+        crop_results = calculate_geography_crop_area_batch(zones, self.cdl_path, areas)
+        developed_results = get_percent_highly_developed_land_batch(zones, self.nlcd_path)
+        for zone, area, crop_result, developed_result in zip(zones, areas, crop_results, developed_results):
+            self.assertEqual(calculate_geography_crop_area(zone, self.cdl_path, area), crop_result)
+            self.assertEqual(get_percent_highly_developed_land(zone, self.nlcd_path), developed_result)
+
+    def test_categorical_histogram(self):
+        data = np.array([[1, 5, 5], [255, 0, 1]], dtype=np.uint8)
+        mask = np.array([[True, True, False], [True, False, True]])
+        self.assertEqual({1: 2, 5: 1, 255: 1}, histogram_to_counts(categorical_histogram(data, mask)))
+        with self.assertRaises(ValueError):
+            categorical_histogram(data.astype(np.int16), mask)
+
+    def test_rollup(self):
+        engine = ZonalStatsEngine([(2015, self.cdl_path)], [(2016, self.nlcd_path)])
+        huc12 = {'id': 'huc', 'area': 2.0, 'geometry': _polygon([[-91.9, 30.9], [-91.3, 30.9], [-91.3, 30.1],
+                                                                   [-91.9, 30.1]]), 'crops': []}
+        # Sub-HUC12s split the HUC12 between two counties; county-a is covered by the HUC12, county-b is not
+        county_a = {'id': 'county-a', 'area': 1.0,
+                    'geometry': _polygon([[-91.9, 30.9], [-91.6, 30.9], [-91.6, 30.1], [-91.9, 30.1]])}
+        county_b = {'id': 'county-b', 'area': 3.0,
+                    'geometry': _polygon([[-91.6, 30.9], [-90.7, 30.9], [-90.7, 30.1], [-91.6, 30.1]])}
+        sub_huc12s = [
+            {'huc12': 'huc', 'county': 'county-a', 'area': 1.0, 'geometry': county_a['geometry']},
+            {'huc12': 'huc', 'county': 'county-b', 'area': 1.0,
+             'geometry': _polygon([[-91.6, 30.9], [-91.3, 30.9], [-91.3, 30.1], [-91.6, 30.1]])}
+        ]
+        store = HistogramStore()
+        for sub_huc in sub_huc12s:
+            result = engine.compute(sub_huc['geometry'], sub_huc['area'])
+            store.put(CDL_LAYER, 2015, subhuc12_key(sub_huc), result.cdl_histogram)
+            store.put(NLCD_LAYER, 2016, subhuc12_key(sub_huc), result.nlcd_histogram)
+        sidecar_path = os.path.join(self.temp_dir, 'histograms.json')
+        store.save(sidecar_path)
+        store = HistogramStore.load(sidecar_path)
+
+        self.assertEqual((1, 0), rollup_entities([huc12], 'huc12', sub_huc12s, store, [2015], [2016], engine))
+        self.assertEqual((1, 1), rollup_entities([county_a, county_b], 'county', sub_huc12s, store,
+                                                 [2015], [2016], engine))
+        for entity in [huc12, county_a, county_b]:
+            result = engine.compute(entity['geometry'], entity['area'])
+            self.assertEqual(1, len(entity['crops']))
+            self.assertAlmostEqual(result.total_crop_area, entity['crops'][0]['cropArea'])
+            self.assertEqual(list(result.crop_areas.keys()), list(entity['crops'][0]['cropAreaDetail'].keys()))
+            self.assertAlmostEqual(entity['area'] * result.developed_nlcd_cells / result.total_nlcd_cells,
+                                   entity['developedArea'][0]['area'])
+            np.testing.assert_array_equal(result.nlcd_histogram, store.get_entity(NLCD_LAYER, 2016, entity))
+
+    def test_developed_classes(self):
+        entities = [{'id': 'huc', 'geometry': self.zones[0], 'area': 10.0, 'developedArea': []}]
+        store = HistogramStore()
+        update_entity_developed_area(entities, [(2016, self.nlcd_path)], show_progress=False, store=store)
+        sidecar_path = os.path.join(self.temp_dir, 'developed-histograms.json')
+        store.save(sidecar_path)
+        histogram = HistogramStore.load(sidecar_path).get_entity(NLCD_LAYER, 2016, entities[0])
+
+        result = ZonalStatsEngine(nlcd_raster_path=self.nlcd_path).compute(self.zones[0], 10.0)
+        np.testing.assert_array_equal(result.nlcd_histogram, histogram)
+        self.assertEqual(developed_area_entry(2016, histogram, 10.0), entities[0]['developedArea'][0])
+        # Developed area for other classes is derived from the stored histogram
+        entry = developed_area_entry(2016, histogram, 10.0, developed_classes=(23, 24))
+        self.assertAlmostEqual(10.0 * (histogram[23] + histogram[24]) / histogram.sum(), entry['area'])
+
+    def test_transitions(self):
+        matrix = zone_transitions(self.cdl_path, self.cdl_2020_path, self.zones[0])
+        from_data, from_mask = zone_window(datasets.get_dataset(self.cdl_path), self.zones[0])
+        to_data, to_mask = zone_window(datasets.get_dataset(self.cdl_2020_path), self.zones[0])
+        # Pixels that are nodata in either year are not counted
+        both = from_mask & to_mask
+        expected = np.bincount(from_data[both].astype(np.int64) * 256 + to_data[both], minlength=256 * 256)
+        np.testing.assert_array_equal(expected.reshape(256, 256), matrix)
+        np.testing.assert_array_equal(matrix, cached_zone_transitions(self.cdl_path, self.cdl_2020_path,
+                                                                      self.zones[0]))
+        # Rasters on aligned grids with other origins are paired by offsetting windows
+        shifted_path = os.path.join(self.temp_dir, 'cdl-2020-shifted.tif')
+        with rasterio.open(self.cdl_2020_path) as src:
+            shifted = src.read(1, window=Window(5, 3, 280, 190))
+        with rasterio.open(shifted_path, 'w', driver='GTiff', width=280, height=190, count=1, dtype=np.uint8,
+                           crs='EPSG:4326', nodata=0,
+                           transform=from_origin(ORIGIN_X + 5 * PIXEL_SIZE, ORIGIN_Y - 3 * PIXEL_SIZE,
+                                                 PIXEL_SIZE, PIXEL_SIZE)) as dst:
+            dst.write(shifted, 1)
+        np.testing.assert_array_equal(matrix, zone_transitions(self.cdl_path, shifted_path, self.zones[0]))
+
+        areas = transition_areas(matrix, CDL_RASTER_VALUE_TO_NAME, 10.0)
+        self.assertAlmostEqual(10.0, sum(sum(by_to.values()) for by_to in areas.values()))
+        self.assertAlmostEqual(10.0 * matrix[1, 5] / matrix.sum(), areas['Corn']['Soybeans'])
+        with self.assertRaises(ValueError):
+            zone_transitions(self.cdl_path, self.recharge_path, self.zones[0])
+
+    def test_multiple_years(self):
+        cdl_rasters = [(2015, self.cdl_path), (2020, self.cdl_2020_path)]
+        result = ZonalStatsEngine(cdl_rasters, [(2016, self.nlcd_path)]).compute(self.zones[0], 10.0)
+        self.assertEqual([2015, 2020], list(result.cdl_histograms.keys()))
+        single = ZonalStatsEngine(self.cdl_2020_path).compute(self.zones[0], 10.0)
+        np.testing.assert_array_equal(single.cdl_histogram, result.cdl_histograms[2020])
+        self.assertEqual(single.total_crop_area,
+                         calculate_geography_crop_area(self.zones[0], self.cdl_2020_path, 10.0)[0])
+
+        # Batched updates require non-overlapping zones
+        zones = [self.zones[0], _polygon([[-91.1, 30.9], [-90.5, 30.87], [-90.52, 30.3]])]
+        entities = [{'geometry': zone, 'area': 10.0, 'crops': [], 'developedArea': []} for zone in zones]
+        entities[0]['crops'].append({'year': 2015, 'cropArea': 0.0, 'cropAreaDetail': {}})
+        self.assertEqual(2, update_entity_crops(entities, cdl_rasters, show_progress=False))
+        self.assertEqual([2015, 2020], [c['year'] for c in entities[0]['crops']])
+        self.assertEqual(0.0, entities[0]['crops'][0]['cropArea'])
+        self.assertAlmostEqual(single.total_crop_area, entities[0]['crops'][1]['cropArea'])
+        self.assertEqual([2015, 2020], [c['year'] for c in entities[1]['crops']])
+        self.assertEqual(0, update_entity_crops(entities, cdl_rasters, show_progress=False))
+
+        self.assertEqual(2, update_entity_developed_area(entities, [(2016, self.nlcd_path)], show_progress=False))
+        self.assertAlmostEqual(10.0 * result.developed_nlcd_cells / result.total_nlcd_cells,
+                               entities[0]['developedArea'][0]['area'])
+
+    def test_parallel_histograms(self):
+        entities = []
+        for i in range(5):
+            for j in range(3):
+                x, y = -91.95 + i * 0.55, 30.95 - j * 0.6
+                entities.append({'geometry': _polygon([[x, y], [x + 0.5, y - 0.03], [x + 0.1, y - 0.55]])})
+        rasters = [(2015, self.cdl_path), (2020, self.cdl_2020_path)]
+        serial = parallel_histograms_by_year(entities, rasters, jobs=1, show_progress=False)
+        parallel = parallel_histograms_by_year(entities, rasters, jobs=2, show_progress=False)
+        self.assertEqual([2015, 2020], list(parallel.keys()))
+        for year in serial:
+            np.testing.assert_array_equal(serial[year], parallel[year])
+
+    def test_zonal_resolution(self):
+        overview_path = os.path.join(self.temp_dir, 'cdl-overviews.tif')
+        shutil.copy(self.cdl_path, overview_path)
+        with rasterio.open(overview_path, 'r+') as dst:
+            dst.build_overviews([2, 4], Resampling.nearest)
+        self.assertEqual((None, 1), select_overview(overview_path, 1))
+        self.assertEqual((0, 2), select_overview(overview_path, 3))
+        self.assertEqual((1, 4), select_overview(overview_path, 8))
+        # Rasters without overviews fall back to full resolution
+        self.assertEqual((None, 1), select_overview(self.cdl_path, 8))
+
+        full = ZonalStatsEngine(overview_path).compute(self.zones[0], 100.0)
+        self.assertEqual(0.0, full.crop_area_errors[None])
+        approximate = ZonalStatsEngine(overview_path, zonal_resolution=4).compute(self.zones[0], 100.0)
+        self.assertAlmostEqual(full.cdl_histogram.sum() / 16, approximate.cdl_histogram.sum(),
+                               delta=0.05 * full.cdl_histogram.sum() / 16)
+        error = approximate.crop_area_errors[None]
+        self.assertGreater(error, 0.0)
+        self.assertLess(abs(full.total_crop_area - approximate.total_crop_area), 4 * error)
+        self.assertEqual(approximate.total_crop_area,
+                         calculate_geography_crop_area(self.zones[0], overview_path, 100.0, zonal_resolution=4)[0])
+
+        entities = [{'id': 'a', 'geometry': self.zones[0], 'area': 100.0, 'crops': [], 'developedArea': []}]
+        report = ZonalErrorReport(4)
+        update_entity_crops(entities, [(2015, overview_path)], show_progress=False, zonal_resolution=4,
+                            report=report)
+        self.assertAlmostEqual(approximate.total_crop_area, entities[0]['crops'][0]['cropArea'])
+        self.assertAlmostEqual(error, report.errors['a']['crops']['2015'])
+
+    def test_batch_recharge(self):
+        zones = [self.zones[0],
+                 _polygon([[-91.1, 30.9], [-90.5, 30.87], [-90.52, 30.3]]),
+                 _polygon([[-80.0, 40.0], [-79.9, 40.0], [-79.9, 39.9]])]
+        stats = calculate_recharge_stats_batch(zones, self.recharge_path, percentiles=[25, 50])
+        for zone, zone_stats in zip(zones[:2], stats):
+            expected = rasterstats.zonal_stats(zone, self.recharge_path,
+                                               stats=['count', 'sum', 'mean', 'min', 'max', 'percentile_25',
+                                                      'percentile_50'])[0]
+            self.assertEqual(expected['count'], zone_stats['count'])
+            for stat in ['sum', 'mean', 'min', 'max', 'percentile_25', 'percentile_50']:
+                self.assertAlmostEqual(expected[stat], zone_stats[stat], places=2)
+        self.assertEqual(0, stats[2]['count'])
+        self.assertIsNone(stats[2]['mean'])
+        self.assertIsNone(stats[2]['percentile_50'])
+
+        means = calculate_huc12_mean_recharge_batch(zones, self.recharge_path)
+        for zone, mean in zip(zones, means):
+            if mean is None:
+                self.assertIsNone(calculate_huc12_mean_recharge(zone, self.recharge_path))
+            else:
+                self.assertAlmostEqual(calculate_huc12_mean_recharge(zone, self.recharge_path), mean)
+        # Duplicate geometries do not share pixels
+        duplicate = _polygon([[-91.05, 30.85], [-90.6, 30.85], [-90.6, 30.4]])
+        means = calculate_huc12_mean_recharge_batch([duplicate, duplicate], self.recharge_path)
+        self.assertIsNotNone(means[0])
+        self.assertEqual(means[0], means[1])
+        self.assertAlmostEqual(calculate_huc12_mean_recharge(duplicate, self.recharge_path), means[0])
+
+    def test_batch_requires_uint8(self):
+        with self.assertRaises(ValueError):
+            batch_categorical_histograms(self.zones, datasets.get_dataset(self.recharge_path))
+
+
+class TestDerivedCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.dataset_path = os.path.join(self.temp_dir, 'data.tif')
+        _write_raster(self.dataset_path, np.ones((10, 10), dtype=np.uint8), 0)
+        cache.set_derived_cache(os.path.join(self.temp_dir, 'cache.sqlite'))
+        self.geometry = _polygon([[-92.0, 31.0], [-91.95, 31.0], [-91.95, 30.95]])
+        self.calls = 0
+
+    def tearDown(self):
+        cache.get_derived_cache().close()
+        shutil.rmtree(self.temp_dir)
+
+    def _compute(self):
+        self.calls += 1
+        return None
+
+    def test_memoize(self):
+        for _ in range(2):
+            self.assertIsNone(cache.memoize('test', self.geometry, self.dataset_path, self._compute))
+        self.assertEqual(1, self.calls)
+        # Different extra parameters, and replaced datasets, are not cache hits
+        cache.memoize('test', self.geometry, self.dataset_path, self._compute, 2015)
+        self.assertEqual(2, self.calls)
+        time.sleep(0.01)
+        _write_raster(self.dataset_path, np.ones((10, 12), dtype=np.uint8), 0)
+        cache.memoize('test', self.geometry, self.dataset_path, self._compute)
+        self.assertEqual(3, self.calls)
+
+    def test_memoize_many(self):
+        other = _polygon([[-92.0, 31.0], [-91.9, 31.0], [-91.9, 30.9]])
+        computed = []
+
+        def _compute_many(geometries):
+            computed.append(len(geometries))
+            return [len(g['coordinates'][0]) * 10 + i for i, g in enumerate(geometries)]
+
+        self.assertEqual(40, cache.memoize_many('test', [self.geometry], self.dataset_path, _compute_many)[0])
+        # Only geometries that are not cached are computed, together
+        self.assertEqual([40, 40], cache.memoize_many('test', [self.geometry, other], self.dataset_path,
+                                                      _compute_many))
+        self.assertEqual([1, 1], computed)
+
+    def test_prune(self):
+        derived_cache = cache.get_derived_cache()
+        for i in range(10):
+            derived_cache.put(str(i), 'test', np.zeros(100, dtype=np.int64))
+        entry_bytes = derived_cache.size() // 10
+        derived_cache.get('0')
+        self.assertEqual(6, derived_cache.prune(4 * entry_bytes))
+        # Most recently used entries are kept
+        self.assertEqual({'0', '7', '8', '9'},
+                         {r[0] for r in derived_cache.conn.execute('SELECT key FROM derived')})
+        # Exceeding the size limit prunes automatically
+        derived_cache.max_bytes = 2 * entry_bytes
+        derived_cache.put('10', 'test', np.zeros(100, dtype=np.int64))
+        self.assertLessEqual(derived_cache.size(), derived_cache.max_bytes)
+
+    def test_buffered_access(self):
+        derived_cache = cache.get_derived_cache()
+        derived_cache.put('0', 'test', 1)
+        accessed = derived_cache.conn.execute("SELECT accessed FROM derived WHERE key = '0'").fetchone()[0]
+        time.sleep(0.01)
+        self.assertEqual(1, derived_cache.get('0'))
+        # Access times of hits are only written when flushed
+        self.assertEqual(accessed, derived_cache.conn.execute("SELECT accessed FROM derived").fetchone()[0])
+        derived_cache.flush()
+        self.assertLess(accessed, derived_cache.conn.execute("SELECT accessed FROM derived").fetchone()[0])
+
+
+class TestBlockCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.data = np.arange(100 * 70, dtype=np.uint16).reshape(100, 70)
+        self.path = os.path.join(self.temp_dir, 'tiled.tif')
+        _write_raster(self.path, self.data, None, tiled=True, blockxsize=16, blockysize=16)
+        self.dataset = rasterio.open(self.path)
+
+    def tearDown(self):
+        self.dataset.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_read(self):
+        cache = BlockCache(1024 * 1024)
+        for window in [Window(0, 0, 70, 100), Window(5, 3, 20, 40), Window(63, 90, 7, 10), Window(16, 16, 16, 16)]:
+            expected = self.data[int(window.row_off):int(window.row_off + window.height),
+                                 int(window.col_off):int(window.col_off + window.width)]
+            np.testing.assert_array_equal(expected, cache.read(self.dataset, window))
+        # The first read decodes every block; later reads are served from the cache
+        self.assertEqual(7 * 5, cache.misses)
+        self.assertEqual(8 + 2 + 1, cache.hits)
+
+    def test_eviction(self):
+        block_bytes = 16 * 16 * 2
+        cache = BlockCache(2 * block_bytes)
+        cache.read(self.dataset, Window(0, 0, 48, 16))
+        self.assertEqual(2, cache.stats()['blocks'])
+        self.assertLessEqual(cache.nbytes, cache.max_bytes)
+        # Least recently used block (0, 0) was evicted
+        cache.read(self.dataset, Window(0, 0, 1, 1))
+        self.assertEqual(4, cache.misses)
+        self.assertEqual(0, cache.hits)
+
+
+class TestChunkedZonalStats(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        rng = np.random.default_rng(7)
+        self.cdl_path = os.path.join(self.temp_dir, 'cdl.tif')
+        _write_raster(self.cdl_path, rng.integers(0, 8, size=(1000, 1200), dtype=np.uint8), 0,
+                      pixel_size=PIXEL_SIZE / 5, tiled=True, blockxsize=64, blockysize=64)
+        self.recharge_path = os.path.join(self.temp_dir, 'recharge.tif')
+        _write_raster(self.recharge_path, rng.uniform(0, 500, size=(600, 500)).astype(np.float32), -9999.0,
+                      pixel_size=PIXEL_SIZE / 3)
+        # Vertices are chosen so that no edge passes exactly through pixel centers
+        self.zone = _polygon([[-91.9873, 30.9913], [-90.0137, 30.5071], [-90.5029, 29.2113], [-91.4931, 29.8077],
+                              [-91.9043, 29.1031]])
+        self.environ = os.environ.copy()
+        os.environ[ZONAL_MAX_MB_ENV] = '1'
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        datasets.close_datasets()
+        shutil.rmtree(self.temp_dir)
+
+    def test_split_window(self):
+        dataset = datasets.get_dataset(self.cdl_path)
+        window = Window(-10, 5, 1100, 990)
+        chunks = split_window(dataset, window, 64 * 1024)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(window.width * window.height, sum(c.width * c.height for c in chunks))
+        for c in chunks:
+            self.assertLessEqual(c.width * c.height * 5, 64 * 1024)
+            # Chunks start on tile boundaries, except at the edges of the window
+            self.assertTrue(c.col_off == window.col_off or c.col_off % 64 == 0)
+            self.assertTrue(c.row_off == window.row_off or c.row_off % 64 == 0)
+
+    def test_chunked_matches_single_window(self):
+        expected = zone_histogram(datasets.get_dataset(self.cdl_path), self.zone)
+        np.testing.assert_array_equal(expected, raster_zone_histogram(self.cdl_path, self.zone))
+        values = zone_values(datasets.get_dataset(self.recharge_path), self.zone)
+        self.assertAlmostEqual(float(values.mean(dtype=np.float64)), raster_zone_mean(self.recharge_path, self.zone))
+
+    def test_tile_histograms(self):
+        expected = zone_histogram(datasets.get_dataset(self.cdl_path), self.zone)
+        build_tile_histograms(self.cdl_path, show_progress=False)
+        tiles = tilehistograms.get_tile_histograms(self.cdl_path)
+        self.assertEqual(64, tiles.tile_size)
+        counts = np.bincount(datasets.get_dataset(self.cdl_path).read(1)[:64, 128:320].ravel(), minlength=256)
+        counts[0] = 0
+        np.testing.assert_array_equal(counts, tiles.run_counts(0, 2, 5))
+        np.testing.assert_array_equal(expected, raster_zone_histogram(self.cdl_path, self.zone))
+        # Tile histograms of a raster that has changed are ignored
+        tilehistograms._tile_histograms.clear()
+        os.utime(self.cdl_path, ns=(0, 0))
+        self.assertIsNone(tilehistograms.get_tile_histograms(self.cdl_path))
+        tilehistograms._tile_histograms.clear()
+
+    def test_raw_raster(self):
+        dataset = datasets.get_dataset(self.cdl_path)
+        expected = zone_histogram(dataset, self.zone)
+        build_raw_raster(self.cdl_path, show_progress=False)
+        raw = rawraster.get_raw_raster(self.cdl_path)
+        self.assertTrue(raw.matches(dataset))
+        # Windows inside the raster are read-only views of the raw raster; others are padded copies
+        data, valid = read_window(dataset, Window(100, 200, 300, 50))
+        self.assertTrue(np.shares_memory(data, raw.data))
+        self.assertFalse(data.flags.writeable)
+        np.testing.assert_array_equal(dataset.read(1, window=Window(100, 200, 300, 50)), data)
+        np.testing.assert_array_equal(data != 0, valid)
+        data, valid = read_window(dataset, Window(-10, 990, 30, 20))
+        self.assertFalse(np.shares_memory(data, raw.data))
+        np.testing.assert_array_equal(dataset.read(1, window=Window(0, 990, 20, 10)), data[:10, 10:])
+        self.assertFalse(valid[10:].any() or valid[:, :10].any())
+        np.testing.assert_array_equal(expected, raster_zone_histogram(self.cdl_path, self.zone))
+        # Raw rasters of a raster that has changed are ignored
+        rawraster._raw_rasters.clear()
+        os.utime(self.cdl_path, ns=(0, 0))
+        self.assertIsNone(rawraster.get_raw_raster(self.cdl_path))
+        rawraster._raw_rasters.clear()
+
+    def test_chunked_coverage_matches_single_window(self):
+        os.environ[ZONAL_BACKEND_ENV] = COVERAGE_BACKEND
+        chunked = raster_zone_histogram(self.cdl_path, self.zone)
+        chunked_mean = raster_zone_mean(self.recharge_path, self.zone)
+        os.environ[ZONAL_MAX_MB_ENV] = '1024'
+        np.testing.assert_allclose(raster_zone_histogram(self.cdl_path, self.zone), chunked)
+        self.assertAlmostEqual(raster_zone_mean(self.recharge_path, self.zone), chunked_mean)
+
+
+class TestCoverageBackend(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        cache.set_derived_cache(os.path.join(self.temp_dir, 'cache.sqlite'))
+        self.cdl_path = os.path.join(self.temp_dir, 'cdl.tif')
+        _write_raster(self.cdl_path, np.ones((20, 20), dtype=np.uint8), 0)
+        self.recharge_path = os.path.join(self.temp_dir, 'recharge.tif')
+        _write_raster(self.recharge_path, np.full((20, 20), 250.0, dtype=np.float32), -9999.0)
+        # Sliver narrower than a pixel, which contains no pixel centers
+        self.sliver = _polygon([[-91.8995, 30.97], [-91.8965, 30.97], [-91.8965, 30.89], [-91.8995, 30.89]])
+        self.environ = os.environ.copy()
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        cache.get_derived_cache().close()
+        datasets.close_datasets()
+        shutil.rmtree(self.temp_dir)
+
+    def test_coverage_fraction(self):
+        transform = from_origin(ORIGIN_X, ORIGIN_Y, PIXEL_SIZE, PIXEL_SIZE)
+        zone = shape(_polygon([[-91.9873, 30.9913], [-91.8137, 30.9571], [-91.9029, 30.8213]])).union(
+            shape(self.sliver)).difference(shape(_polygon([[-91.95, 30.97], [-91.93, 30.97], [-91.94, 30.95]])))
+        coverage = coverage_fraction(zone.__geo_interface__, (20, 25), transform)
+        for row in range(20):
+            for col in range(25):
+                west, north = transform * (col, row)
+                pixel = box(west, north - PIXEL_SIZE, west + PIXEL_SIZE, north)
+                self.assertAlmostEqual(pixel.intersection(zone).area / pixel.area, coverage[row, col])
+
+    def test_sliver(self):
+        area = 10.0
+        self.assertEqual(0.0, calculate_geography_crop_area(self.sliver, self.cdl_path, area)[0])
+        self.assertIsNone(calculate_huc12_mean_recharge(self.sliver, self.recharge_path))
+
+        os.environ[ZONAL_BACKEND_ENV] = COVERAGE_BACKEND
+        total_crop_area, crop_areas = calculate_geography_crop_area(self.sliver, self.cdl_path, area)
+        self.assertAlmostEqual(area, total_crop_area)
+        self.assertAlmostEqual(area, crop_areas['Corn'])
+        self.assertAlmostEqual(250.0, calculate_huc12_mean_recharge(self.sliver, self.recharge_path), places=4)
+        self.assertAlmostEqual(250.0, calculate_huc12_mean_recharge_batch([self.sliver], self.recharge_path)[0],
+                               places=4)
+        with self.assertRaises(ValueError):
+            calculate_recharge_stats_batch([self.sliver], self.recharge_path)
+        # Coverage fractions sum to the area of the sliver, in pixels
+        histogram = raster_zone_histogram(self.cdl_path, self.sliver)
+        self.assertAlmostEqual(0.3 * 8, histogram[1])
+
+    def test_update_entity_crops(self):
+        os.environ[ZONAL_BACKEND_ENV] = COVERAGE_BACKEND
+        zones = [self.sliver, _polygon([[-91.99, 30.99], [-91.85, 30.95], [-91.95, 30.85]])]
+        entities = [{'id': str(i), 'area': 10.0, 'geometry': zone, 'crops': []} for i, zone in enumerate(zones)]
+        self.assertEqual(2, update_entity_crops(entities, [(2015, self.cdl_path)], show_progress=False))
+        # Updated years are weighted by coverage like extracted ones, rather than counted by pixel center
+        engine = ZonalStatsEngine([(2015, self.cdl_path)])
+        for entity, zone in zip(entities, zones):
+            expected = engine.compute(zone, entity['area'])
+            self.assertEqual([crops_entry(2015, expected.cdl_histograms[2015], entity['area'])], entity['crops'])
+        self.assertAlmostEqual(10.0, entities[0]['crops'][0]['cropArea'])
+        with self.assertRaises(ValueError):
+            batch_categorical_histograms(zones, datasets.get_dataset(self.cdl_path))
+
+
+class TestHilbertOrder(unittest.TestCase):
+    def test_hilbert_index(self):
+        np.testing.assert_array_equal([0, 1, 2, 3], hilbert_index([0, 0, 1, 1], [0, 1, 1, 0], order=1))
+        # Every cell is visited once, and consecutive cells along the curve are neighbors
+        y, x = np.mgrid[0:16, 0:16]
+        index = hilbert_index(x.ravel(), y.ravel(), order=4)
+        np.testing.assert_array_equal(np.arange(256), np.sort(index))
+        order = np.argsort(index)
+        steps = np.abs(np.diff(x.ravel()[order])) + np.abs(np.diff(y.ravel()[order]))
+        np.testing.assert_array_equal(np.ones(255), steps)
+
+    def test_entity_order(self):
+        self.assertEqual([], list(hilbert_order(np.empty((0, 2)))))
+        # Entities in a 4 x 4 grid, in row order, are visited in a path of neighbors
+        entities = [{'geometry': _polygon([[x, y], [x + 0.5, y], [x + 0.5, y + 0.5], [x, y + 0.5]])}
+                    for y in range(4) for x in range(4)]
+        order = entity_hilbert_order(entities)
+        self.assertEqual(list(range(16)), sorted(order))
+        steps = np.abs(np.diff(order % 4)) + np.abs(np.diff(order // 4))
+        np.testing.assert_array_equal(np.ones(15), steps)
+
+
+class TestNativeCrs(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        # 1 km pixels in the CONUS Albers equal area CRS of CDL and NLCD, covering the zone
+        west, _, _, north = transform_bounds('EPSG:4326', 'EPSG:5070', -92.0, 29.0, -89.0, 31.0)
+        rng = np.random.default_rng(11)
+        self.cdl_path = os.path.join(self.temp_dir, 'cdl-albers.tif')
+        _write_raster(self.cdl_path, rng.integers(0, 8, size=(260, 320), dtype=np.uint8), 0, pixel_size=1000.0,
+                      crs='EPSG:5070', origin=(west, north))
+        self.zone = _polygon([[-91.87, 30.95], [-90.21, 30.81], [-90.45, 29.45], [-91.93, 29.62]])
+
+    def tearDown(self):
+        datasets.close_datasets()
+        shutil.rmtree(self.temp_dir)
+
+    def test_reprojected_zone(self):
+        dataset = datasets.get_dataset(self.cdl_path)
+        albers_zone = transform_geom('EPSG:4326', 'EPSG:5070', self.zone)
+        stats = rasterstats.zonal_stats(albers_zone, self.cdl_path, categorical=True, nodata=0)[0]
+        expected = _counts_to_histogram(stats)
+        self.assertGreater(expected.sum(), 1000)
+        np.testing.assert_array_equal(expected, zone_histogram(dataset, self.zone))
+        np.testing.assert_array_equal(expected, raster_zone_histogram(self.cdl_path, self.zone))
+        np.testing.assert_array_equal(expected, batch_categorical_histograms([self.zone], dataset)[0])
+        # Reprojected zones are left as they are
+        zone, bounds = dataset_zone(dataset, self.zone)
+        self.assertEqual('EPSG:5070', zone['crs']['properties']['name'])
+        self.assertEqual((zone, bounds), dataset_zone(dataset, zone, bounds))
+        with rasterio.open(self.cdl_path.replace('albers', 'wgs84'), 'w', driver='GTiff', width=10, height=10,
+                           count=1, dtype=np.uint8, crs='EPSG:4326',
+                           transform=from_origin(ORIGIN_X, ORIGIN_Y, PIXEL_SIZE, PIXEL_SIZE)) as wgs84_dataset:
+            self.assertEqual(self.zone, dataset_zone(wgs84_dataset, self.zone)[0])
+            self.assertRaises(ValueError, dataset_zone, wgs84_dataset, zone)
+
+
+class TestMaskCache(unittest.TestCase):
+    def test_get_put(self):
+        rng = np.random.default_rng(0)
+        mask = rng.random((13, 29)) < 0.5
+        signature = ((30.0, 0.0, 100.0, 0.0, -30.0, 200.0), mask.shape)
+        cache = MaskCache(1024)
+        self.assertIsNone(cache.get('a', signature))
+        cache.put('a', signature, mask)
+        cached = cache.get('a', signature)
+        self.assertEqual(bool, cached.dtype)
+        np.testing.assert_array_equal(mask, cached)
+        # Masks are stored bit-packed
+        self.assertEqual((13 * 29 + 7) // 8, cache.nbytes)
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+    def test_eviction(self):
+        signature = ((30.0, 0.0, 100.0, 0.0, -30.0, 200.0), (8, 8))
+        mask = np.ones((8, 8), dtype=bool)
+        cache = MaskCache(2 * 8)
+        cache.put('a', signature, mask)
+        cache.put('b', signature, mask)
+        cache.get('a', signature)
+        cache.put('c', signature, mask)
+        # Least recently used mask 'b' was evicted
+        self.assertIsNotNone(cache.get('a', signature))
+        self.assertIsNone(cache.get('b', signature))
+        self.assertIsNotNone(cache.get('c', signature))
+        self.assertLessEqual(cache.nbytes, cache.max_bytes)
+
+
+if __name__ == '__main__':
+    unittest.main()